@@ -0,0 +1,77 @@
+"""Collects the parts of a Telegram album (media group) before processing.
+
+Telegram delivers each photo of an album as its own message. AlbumAggregator
+buffers them per media_group_id and hands the complete album to a callback
+on the chat's shard once no new part has arrived for quiet_seconds. An album
+is flushed at the latest max_wait_seconds after its first part, even if
+parts keep trickling in.
+
+Memory is capped: at most max_albums albums are buffered (the oldest is
+dropped beyond that) and at most MAX_ALBUM_MESSAGES parts per album, the
+size of a Telegram album.
+"""
+import threading
+import time
+from collections import OrderedDict
+import telebot
+from bot.chat_shards import ChatShardedExecutor
+from bot.logger import get_logger
+from bot.services.scheduler import cancel, schedule
+
+logger = get_logger(__name__)
+
+MAX_ALBUM_MESSAGES = 10
+
+class _Album:
+    __slots__ = ("chat_id", "messages", "first_seen")
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.messages = []
+        self.first_seen = time.monotonic()
+
+class AlbumAggregator:
+    def __init__(self, on_album, chat_shards: ChatShardedExecutor, quiet_seconds: float, max_wait_seconds: float, max_albums: int):
+        self.on_album = on_album
+        self.chat_shards = chat_shards
+        self.quiet_seconds = quiet_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.max_albums = max_albums
+        self._albums = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"albums": 0, "messages": 0, "dropped_albums": 0, "dropped_messages": 0}
+
+    def add(self, message: telebot.types.Message) -> None:
+        media_group_id = message.media_group_id
+        with self._lock:
+            album = self._albums.get(media_group_id)
+            if album is None:
+                if len(self._albums) >= self.max_albums:
+                    dropped_id, dropped = self._albums.popitem(last=False)
+                    cancel(("album", dropped_id))
+                    self._metrics["dropped_albums"] += 1
+                    logger.warning(f"Dropped album {dropped_id} of chat {dropped.chat_id} ({len(dropped.messages)} part(s)); {self.max_albums} albums are already pending.")
+                album = self._albums[media_group_id] = _Album(message.chat.id)
+            if len(album.messages) >= MAX_ALBUM_MESSAGES:
+                self._metrics["dropped_messages"] += 1
+                logger.warning(f"Ignored message {message.message_id}: album {media_group_id} already has {MAX_ALBUM_MESSAGES} parts.")
+                return
+            album.messages.append(message)
+            self._metrics["messages"] += 1
+            delay = min(self.quiet_seconds, max(album.first_seen + self.max_wait_seconds - time.monotonic(), 0.0))
+        # Rescheduling the key pushes the flush back while parts keep arriving
+        schedule(delay, self.chat_shards.submit, message.chat.id, self._flush, media_group_id, key=("album", media_group_id))
+
+    def _flush(self, media_group_id: str) -> None:
+        with self._lock:
+            album = self._albums.pop(media_group_id, None)
+            if album is None:
+                return
+            self._metrics["albums"] += 1
+        self.on_album(sorted(album.messages, key=lambda message: message.message_id))
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["pending_albums"] = len(self._albums)
+        return metrics
@@ -7,41 +7,46 @@ from decimal import Decimal
 import threading
 import time
 from bot.db.connection import get_connection
+from bot.db.migrations import run_migrations
 from bot.logger import get_logger
-from bot.config import BOT_TOKEN, DRAFT_TTL_SECONDS, FILES_CHANNEL_ID, DB_PATH, ADMIN_USER_IDS, REJECTED_TTL_SECONDS, PENDING_TTL_SECONDS
+from bot.config import BOT_TOKEN, DRAFT_TTL_SECONDS, FILES_CHANNEL_ID, DB_PATH, ADMIN_USER_IDS, REJECTED_TTL_SECONDS, PENDING_TTL_SECONDS, DEBT_SNAPSHOT_INTERVAL_SECONDS, CHAT_SHARDS, CHAT_SHARD_QUEUE_SIZE, EDIT_DEBOUNCE_SECONDS
+from bot.config import ALBUM_QUIET_SECONDS, ALBUM_MAX_WAIT_SECONDS, ALBUM_MAX_PENDING
+from bot.config import TELEGRAM_API_URL
+from bot.config import BOT_MODE, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE
 from bot.services.menu_service import ensure_menu
+from bot.webhook import WebhookServer
+from bot.chat_shards import ChatShardedExecutor
+from bot.edit_coalescer import EditCoalescer
+from bot.album_aggregator import AlbumAggregator
+from bot.outbound import RateLimitedTeleBot, submit_nowait
+from bot.services.simplify import get_simplified_debts, get_payable_amount
+from bot.services.balance_cache import get_users_owed_by_user, get_debt_between_users
+from bot.services.chat_titles import get_group_name, update_group_name
+from bot.services.scheduler import schedule, send_temporary_message, start_scheduler
 from bot.db.repos import (
     create_user_if_not_exists,
     create_draft,
     get_active_draft,
     get_draft_owner_by_message_id,
     update_draft,
+    delete_draft,
     add_user_to_group_if_not_exists,
     delete_file_by_id,
     get_group_members,    
-    create_expense,
-    create_expense_debtors,
     get_expense,
     get_expense_debtors,
-    update_debtor_status,
-    reject_expense,
-    upsert_debt,
     get_user_display_name,
     get_user,
     create_group_if_not_exists,
     get_group,
     get_expense_files,
-    update_file_relation,
     delete_expense,
     update_group_last_activity,
     get_groups_with_old_menus,
-    create_settlement,
     get_settlement,
     update_settlement_status,
     get_settlement_files,
     delete_settlement,
-    get_users_owed_by_user,
-    get_owed_amount,
     get_spending_by_category,
     get_spending_by_user_by_period,
     set_settings_editor_id,
@@ -49,7 +54,6 @@ from bot.db.repos import (
     get_group_history,
     update_expense_message_id,
     update_settlement_message_id,
-    get_debt_between_users,
     get_group_settings,
     update_group_settings,
     get_old_stale_drafts,
@@ -59,40 +63,63 @@ from bot.db.repos import (
     set_menu_message_id,
     get_old_pending_expenses,
     get_old_pending_settlements,
+    find_member_balance_mismatches,
 )
 from bot.services.draft_service import expire_drafts
-from bot.services.file_service import store_file_ref
+from bot.services.file_service import store_file_ref, store_file_refs, forward_album_to_files_channel
 from bot.utils.currency import format_amount
 from bot.utils.time import get_now_in_configured_timezone
 from bot.services.reporter import generate_csv_report
-from bot.services.accounting import get_all_balances, get_my_balance
+from bot.services.accounting import (
+    get_all_balances,
+    get_my_balance,
+    get_month_end_balances,
+    snapshot_debts,
+    publish_expense,
+    confirm_expense_debtor,
+    reject_expense_debtor,
+    publish_settlement,
+    confirm_settlement,
+    clear_debt,
+)
 from bot.services.wizard_service import handle_amount_input, start_wizard, update_wizard_after_file_processing, handle_wizard_next, handle_wizard_back
-from bot.ui.renderers import render_main_menu, render_expense_message, render_history_message, render_settlement_message, render_help_message, render_analytics_page, render_spending_by_category, render_who_paid_how_much, render_settings_page, render_reports_menu, render_balances_page, render_clear_debt_confirmation, render_excluded_members_page, render_wizard
+from bot.ui.renderers import render_main_menu, render_expense_message, render_history_message, render_settlement_message, render_help_message, render_analytics_page, render_spending_by_category, render_who_paid_how_much, render_settings_page, render_reports_menu, render_month_end_balances_page, render_balances_page, render_simplified_balances_page, render_clear_debt_confirmation, render_excluded_members_page, render_wizard
 
 logger = get_logger(__name__)
 
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
+
+# Toggle actions whose re-rendered message goes through the edit coalescer
+COALESCED_EDIT_ACTIONS = {"set_category", "toggle_debtor", "toggle_all_debtors", "toggle_excluded_member"}
+
 class Bot:
-    def __init__(self):
-        self.bot = telebot.TeleBot(BOT_TOKEN)
-        self.media_group_cache = {}
-        self.media_group_timers = {}
-        self.user_locks = set()
-        self.clear_debt_timers = {}
-        self.file_processing_lock = threading.Lock()
+    def __init__(self, bot=None):
+        # bot is injected by the asyncio runtime (bot.async_app); anything with
+        # the TeleBot methods used here works.
+        self.bot = bot if bot is not None else RateLimitedTeleBot(BOT_TOKEN, threaded=False)
+        # Each chat's updates are handled serially on its shard; chats run in parallel
+        self.chat_shards = ChatShardedExecutor(CHAT_SHARDS, CHAT_SHARD_QUEUE_SIZE)
+        self.edit_coalescer = EditCoalescer(self.bot, self.chat_shards, EDIT_DEBOUNCE_SECONDS)
+        # Albums arrive as one message per photo; they are processed once complete
+        self.album_aggregator = AlbumAggregator(self.process_media_group, self.chat_shards, ALBUM_QUIET_SECONDS, ALBUM_MAX_WAIT_SECONDS, ALBUM_MAX_PENDING)
         self.menu_creation_time = {}
         self.setup_handlers()
 
     def setup_database(self):
         with get_connection() as conn:
+            run_migrations(conn)
             logger.info("Database connection established and migrations run.")
 
     def setup_handlers(self):
-        self.bot.register_message_handler(self.handle_menu_command, commands=['menu'])
-        self.bot.register_message_handler(self.handle_start_command, commands=['start'])
-        self.bot.register_message_handler(self.handle_file_message, content_types=['photo', 'document'])
-        self.bot.register_message_handler(self.handle_text_message, func=lambda message: True, content_types=['text'])
-        self.bot.register_callback_query_handler(self.handle_callback_query, func=lambda call: call.data.startswith("dm:"))
-        self.bot.register_message_handler(self.handle_new_chat_members, content_types=['new_chat_members'])
+        sharded = self.chat_shards.wrap
+        self.bot.register_message_handler(sharded(self.handle_menu_command), commands=['menu'])
+        self.bot.register_message_handler(sharded(self.handle_start_command), commands=['start'])
+        self.bot.register_message_handler(sharded(self.handle_file_message), content_types=['photo', 'document'])
+        self.bot.register_message_handler(sharded(self.handle_text_message), func=lambda message: True, content_types=['text'])
+        self.bot.register_callback_query_handler(sharded(self.handle_callback_query), func=lambda call: call.data.startswith("dm:"))
+        self.bot.register_message_handler(sharded(self.handle_new_chat_members), content_types=['new_chat_members'])
+        self.bot.register_message_handler(sharded(self.handle_new_chat_title), content_types=['new_chat_title'])
 
         # Set bot commands
         self.bot.set_my_commands(
@@ -112,6 +139,13 @@ class Bot:
             except Exception as e:
                 logger.error(f"Error adding new member to group: {e}")
 
+    def handle_new_chat_title(self, message: telebot.types.Message):
+        try:
+            logger.info(f"Chat {message.chat.id} was renamed to {message.new_chat_title!r}")
+            update_group_name(message.chat.id, message.new_chat_title)
+        except Exception as e:
+            logger.error(f"Error updating the title of chat {message.chat.id}: {e}")
+
     def run(self):
         logger.info("Starting Debt Manager Bot...")
         logger.info(f"REJECTED_TTL_SECONDS: {REJECTED_TTL_SECONDS}")
@@ -119,7 +153,20 @@ class Bot:
             logger.critical("BOT_TOKEN environment variable not set. Exiting.")
             return
 
+        self.start_background_tasks()
+
+        if BOT_MODE == "webhook":
+            self.run_webhook()
+            return
+
+        # Polling fails while a webhook is set, e.g. after switching modes
+        self.bot.remove_webhook()
+        logger.info("Starting bot polling...")
+        self.bot.polling(none_stop=True)
+
+    def start_background_tasks(self):
         self.setup_database()
+        start_scheduler(self.delete_message)
 
         # cleanup_thread = threading.Thread(target=self.cleanup_old_menus, daemon=True)
         # cleanup_thread.start()
@@ -130,10 +177,22 @@ class Bot:
         menu_creation_time_cleanup_thread = threading.Thread(target=self.cleanup_menu_creation_time, daemon=True)
         menu_creation_time_cleanup_thread.start()
 
-        logger.info("Starting bot polling...")
-        self.bot.polling(none_stop=True)
+    def run_webhook(self):
+        if not WEBHOOK_SECRET:
+            logger.critical("WEBHOOK_SECRET must be set in webhook mode. Exiting.")
+            return
+
+        self.webhook_server = WebhookServer(self.bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE)
+        if WEBHOOK_URL:
+            self.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+            logger.info(f"Registered webhook {WEBHOOK_URL} with Telegram.")
+        else:
+            # Local testing: updates are POSTed to the server by hand
+            logger.warning("WEBHOOK_URL is not set; not registering the webhook with Telegram.")
+        self.webhook_server.serve_forever()
 
     def cleanup_old_records(self):
+        last_snapshot_at = 0.0
         while True:
             try:
                 # logger.debug("Running old records cleanup...")
@@ -215,6 +274,13 @@ class Bot:
                     except Exception as e:
                         logger.error(f"Error processing pending settlement {settlement['id']} for deletion: {e}")
 
+                # Checkpoint the debt journal so replays don't start from scratch,
+                # and check the per-member totals against the pairwise ledger
+                if time.monotonic() - last_snapshot_at >= DEBT_SNAPSHOT_INTERVAL_SECONDS:
+                    snapshot_debts()
+                    find_member_balance_mismatches()
+                    last_snapshot_at = time.monotonic()
+
             except Exception as e:
                 logger.error(f"Error in cleanup_old_records: {e}")
             
@@ -257,21 +323,18 @@ class Bot:
             time.sleep(3600) # Sleep for 1 hour
 
     def delete_message(self, chat_id, message_id):
-        try:
-            self.bot.delete_message(chat_id, message_id)
-        except Exception as e:
-            logger.error(f"Error deleting message {message_id} in chat {chat_id}: {e}")
+        """Queues a low-priority delete without waiting for it.
+
+        Returns the call's Future, so the scheduler can keep the deletion until it has gone through.
+        """
+        return submit_nowait(self.bot, "delete_message", chat_id, message_id)
 
     def _delete_draft_and_files(self, draft_id: int, draft_data: dict):
         if 'files' in draft_data:
             for file_info in draft_data['files']:
-                try:
-                    self.bot.delete_message(FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
-                except Exception as e:
-                    logger.error(f"Error deleting file from channel: {e}")
+                self.delete_message(FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
                 delete_file_by_id(file_info['file_row_id'])
-        with get_connection() as conn:
-            conn.execute("DELETE FROM drafts WHERE id = ?", (draft_id,))
+        delete_draft(draft_id)
 
     def handle_menu_command(self, message: telebot.types.Message):
         if message.chat.type == 'private':
@@ -283,7 +346,7 @@ class Bot:
 
         if last_creation_time and (now - last_creation_time) < timedelta(seconds=5):
             logger.info(f"Menu command for chat {chat_id} was issued too quickly. Ignoring.")
-            self.bot.delete_message(chat_id, message.message_id)
+            self.delete_message(chat_id, message.message_id)
             return
         
         self.menu_creation_time[chat_id] = now
@@ -294,7 +357,7 @@ class Bot:
             add_user_to_group_if_not_exists(user_id, chat_id)
 
             # Immediately delete the user's /menu command
-            self.bot.delete_message(chat_id, message.message_id)
+            self.delete_message(chat_id, message.message_id)
 
             settings = get_group_settings(chat_id)
             excluded_members = settings.get('excluded_members', [])
@@ -306,19 +369,11 @@ class Bot:
 
             # If an existing menu message ID is found, delete it.
             if existing_menu_id:
-                try:
-                    self.bot.delete_message(chat_id, existing_menu_id)
-                    logger.info(f"Deleted old menu message {existing_menu_id} in chat {chat_id}.")
-                except telebot.apihelper.ApiTelegramException as e:
-                    if "message to delete not found" in str(e).lower():
-                        logger.info(f"Old menu message {existing_menu_id} not found in chat {chat_id}. It might have been deleted manually.")
-                    else:
-                        logger.error(f"Error deleting old menu message {existing_menu_id}: {e}")
+                self.delete_message(chat_id, existing_menu_id)
                 # Always clear the stored menu ID after attempting to delete.
                 set_menu_message_id(chat_id, None)
 
-            chat_info = self.bot.get_chat(chat_id)
-            group_name = chat_info.title if chat_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             menu_text, menu_keyboard = render_main_menu(group_name=group_name)
             
             # Send a new menu message.
@@ -336,111 +391,122 @@ class Bot:
 
     def handle_start_command(self, message: telebot.types.Message):
         if message.chat.type == 'private':
-            self.bot.send_message(message.chat.id, "I only work in groups.")
+            submit_nowait(self.bot, "send_message", message.chat.id, "I only work in groups.")
             return
         self.handle_menu_command(message)
 
     def handle_file_message(self, message: telebot.types.Message):
         if message.chat.type == 'private':
             return
-        update_group_last_activity(message.chat.id)
+        update_group_last_activity.submit(message.chat.id)
         if message.media_group_id:
-            if message.media_group_id not in self.media_group_cache:
-                self.media_group_cache[message.media_group_id] = []
-            self.media_group_cache[message.media_group_id].append(message)
-
-            if message.media_group_id in self.media_group_timers:
-                self.media_group_timers[message.media_group_id].cancel()
-            
-            timer = threading.Timer(1.0, self.process_media_group, [message.media_group_id])
-            self.media_group_timers[message.media_group_id] = timer
-            timer.start()
+            self.album_aggregator.add(message)
         else:
             self.process_single_file(message)
 
-    def process_media_group(self, media_group_id):
-        with self.file_processing_lock:
-            messages = self.media_group_cache.pop(media_group_id, [])
-            if not messages:
-                return
-            
-            first_message = messages[0]
-            chat_id = first_message.chat.id
-            user_id = create_user_if_not_exists(first_message.from_user.id, first_message.from_user.username, first_message.from_user.full_name)
-            add_user_to_group_if_not_exists(user_id, chat_id)
-
-            active_draft = get_active_draft(chat_id, user_id)
-
-            if not active_draft or active_draft['type'] not in ['expense', 'settlement']:
-                return
+    def process_media_group(self, messages: list[telebot.types.Message]):
+        first_message = messages[0]
+        chat_id = first_message.chat.id
+        user_id = create_user_if_not_exists(first_message.from_user.id, first_message.from_user.username, first_message.from_user.full_name)
+        add_user_to_group_if_not_exists(user_id, chat_id)
 
-            draft_data = json.loads(active_draft['data_json'])
-            draft_id = active_draft['id']
-            current_step = active_draft['step']
+        active_draft = get_active_draft(chat_id, user_id)
 
-            if 'files' not in draft_data:
-                draft_data['files'] = []
+        if not active_draft or active_draft['type'] not in ['expense', 'settlement']:
+            return
 
-            processed_files_info = []
-            for message in messages:
-                # Process each file but don't delete the source messages yet.
-                file_info = self.process_file(message, user_id, draft_id, draft_data, delete_source_message=False)
-                if file_info:
-                    processed_files_info.append(file_info)
+        draft_data = json.loads(active_draft['data_json'])
+        draft_id = active_draft['id']
+        current_step = active_draft['step']
+
+        if 'files' not in draft_data:
+            draft_data['files'] = []
+
+        accepted = []
+        for message in messages:
+            if message.caption:
+                draft_data['description'] = message.caption
+            mime_type = self._accept_file_type(message)
+            if mime_type:
+                accepted.append((message, mime_type))
+        if not accepted:
+            return
 
-            if not processed_files_info:
-                # No files were successfully processed
-                return
+        # One forwardMessages call and one transaction for the whole album
+        channel_message_ids = forward_album_to_files_channel(self.bot, chat_id, [message.message_id for message, _ in accepted])
+        refs = []
+        for (message, mime_type), channel_message_id in zip(accepted, channel_message_ids):
+            if channel_message_id is None:
+                continue
+            file_id, file_size = (message.photo[-1].file_id, message.photo[-1].file_size) if message.photo else (message.document.file_id, message.document.file_size)
+            refs.append((file_id, channel_message_id, user_id, "draft", str(draft_id), mime_type, file_size))
+        if not refs:
+            # No files were successfully processed
+            return
+        file_row_ids = store_file_refs(refs)
+        for (file_id, channel_message_id, _, _, _, mime_type, file_size), file_row_id in zip(refs, file_row_ids):
+            draft_data['files'].append({
+                'file_id': file_id,
+                'mime': mime_type,
+                'file_size': file_size,
+                'origin_channel_message_id': channel_message_id,
+                'file_row_id': file_row_id
+            })
 
-            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-            update_draft(draft_id, draft_data, current_step, expires_at)
-            
-            if update_wizard_after_file_processing(self.bot, chat_id, user_id, draft_data, current_step, active_draft['type']):
-                # Success! Now delete all source messages from the media group.
-                for msg in messages:
-                    self.bot.delete_message(chat_id, msg.message_id)
+        expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+        update_draft(draft_id, draft_data, current_step, expires_at)
+        
+        if update_wizard_after_file_processing(self.bot, chat_id, user_id, draft_data, current_step, active_draft['type']):
+            # Success! Now delete the source messages in one call (rejected ones are already gone).
+            source_ids = [message.message_id for message, _ in accepted]
+            submit_nowait(self.bot, "delete_messages", chat_id, source_ids)
 
     def process_single_file(self, message: telebot.types.Message):
-        with self.file_processing_lock:
-            chat_id = message.chat.id
-            user_id = create_user_if_not_exists(message.from_user.id, message.from_user.username, message.from_user.full_name)
-            add_user_to_group_if_not_exists(user_id, chat_id)
+        chat_id = message.chat.id
+        user_id = create_user_if_not_exists(message.from_user.id, message.from_user.username, message.from_user.full_name)
+        add_user_to_group_if_not_exists(user_id, chat_id)
 
-            active_draft = get_active_draft(chat_id, user_id)
+        active_draft = get_active_draft(chat_id, user_id)
 
-            if not active_draft or active_draft['type'] not in ['expense', 'settlement']:
-                return
+        if not active_draft or active_draft['type'] not in ['expense', 'settlement']:
+            return
 
-            draft_data = json.loads(active_draft['data_json'])
-            draft_id = active_draft['id']
-            current_step = active_draft['step']
+        draft_data = json.loads(active_draft['data_json'])
+        draft_id = active_draft['id']
+        current_step = active_draft['step']
 
-            if 'files' not in draft_data:
-                draft_data['files'] = []
+        if 'files' not in draft_data:
+            draft_data['files'] = []
 
-            # Process the file but don't delete the source message yet.
-            processed_file_info = self.process_file(message, user_id, draft_id, draft_data, delete_source_message=False)
-            if not processed_file_info:
-                # process_file failed (e.g. wrong mime type) and handled its own messaging/deletion.
-                return
+        # Process the file but don't delete the source message yet.
+        processed_file_info = self.process_file(message, user_id, draft_id, draft_data, delete_source_message=False)
+        if not processed_file_info:
+            # process_file failed (e.g. wrong mime type) and handled its own messaging/deletion.
+            return
 
-            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-            update_draft(draft_id, draft_data, current_step, expires_at)
+        expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+        update_draft(draft_id, draft_data, current_step, expires_at)
+
+        if update_wizard_after_file_processing(self.bot, chat_id, user_id, draft_data, current_step, active_draft['type']):
+            # Success! Now delete the source message.
+            self.delete_message(message.chat.id, message.message_id)
 
-            if update_wizard_after_file_processing(self.bot, chat_id, user_id, draft_data, current_step, active_draft['type']):
-                # Success! Now delete the source message.
-                self.bot.delete_message(message.chat.id, message.message_id)
+    def _accept_file_type(self, message: telebot.types.Message) -> str | None:
+        """Returns the file's mime type, or None after warning about an unsupported one."""
+        mime_type = "image/jpeg" if message.photo else message.document.mime_type
+        if mime_type not in ["image/jpeg", "image/png", "application/pdf"]:
+            send_temporary_message(self.bot, message.chat.id, "❗ Invalid file type. Only photos, PNGs, and PDFs are accepted.", 5.0)
+            # Always delete the source message for an invalid file type, as it can't be processed.
+            self.delete_message(message.chat.id, message.message_id)
+            return None
+        return mime_type
 
     def process_file(self, message: telebot.types.Message, user_id: int, draft_id: int, draft_data: dict, delete_source_message: bool = True):
         if message.caption:
             draft_data['description'] = message.caption
 
-        mime_type = "image/jpeg" if message.photo else message.document.mime_type
-        if mime_type not in ["image/jpeg", "image/png", "application/pdf"]:
-            warning_msg = self.bot.send_message(message.chat.id, "❗ Invalid file type. Only photos, PNGs, and PDFs are accepted.")
-            # Always delete the source message for an invalid file type, as it can't be processed.
-            self.bot.delete_message(message.chat.id, message.message_id)
-            threading.Timer(5.0, self.delete_message, [message.chat.id, warning_msg.message_id]).start()
+        mime_type = self._accept_file_type(message)
+        if not mime_type:
             return None # Indicate failure
 
         forwarded_message = self.bot.forward_message(FILES_CHANNEL_ID, message.chat.id, message.message_id)
@@ -449,7 +515,7 @@ class Bot:
             if file_id:
                 file_row_id = store_file_ref(file_id, forwarded_message.message_id, user_id, "draft", str(draft_id), mime_type, file_size)
                 if delete_source_message:
-                    self.bot.delete_message(message.chat.id, message.message_id)
+                    self.delete_message(message.chat.id, message.message_id)
                 
                 file_info = {
                     'file_id': file_id,
@@ -468,162 +534,150 @@ class Bot:
         try:
             chat_id = message.chat.id
             create_group_if_not_exists(chat_id)
-            with get_connection() as conn:
-                logger.info(f"Received text message from user {message.from_user.id} in chat {chat_id}: {message.text}")
-                update_group_last_activity(chat_id)
-                user_id = create_user_if_not_exists(message.from_user.id, message.from_user.username, message.from_user.full_name)
-                add_user_to_group_if_not_exists(user_id, chat_id)
-                
-                settings = get_group_settings(chat_id)
-                excluded_members = settings.get('excluded_members', [])
-                if user_id in excluded_members:
-                    if message.text == '/menu':
-                        self.bot.delete_message(chat_id, message.message_id)
-                    return
+            logger.info(f"Received text message from user {message.from_user.id} in chat {chat_id}: {message.text}")
+            update_group_last_activity.submit(chat_id)
+            user_id = create_user_if_not_exists(message.from_user.id, message.from_user.username, message.from_user.full_name)
+            add_user_to_group_if_not_exists(user_id, chat_id)
+            
+            settings = get_group_settings(chat_id)
+            excluded_members = settings.get('excluded_members', [])
+            if user_id in excluded_members:
+                if message.text == '/menu':
+                    self.delete_message(chat_id, message.message_id)
+                return
 
-                active_draft = get_active_draft(chat_id, user_id)
+            active_draft = get_active_draft(chat_id, user_id)
 
-                if not active_draft:
-                    return
+            if not active_draft:
+                return
 
-                draft_data = json.loads(active_draft['data_json'])
-                wizard_message_id = draft_data.get('wizard_message_id')
+            draft_data = json.loads(active_draft['data_json'])
+            wizard_message_id = draft_data.get('wizard_message_id')
 
-                if not wizard_message_id:
-                    return
+            if not wizard_message_id:
+                return
 
-                # Check if the wizard message is still alive
-                try:
-                    # We need the keyboard to check if the message is alive without changing it
-                    editor_name = get_user_display_name(user_id)
-                    if active_draft['type'] in ['expense', 'settlement', 'clear_debt']:
-                        _, keyboard = render_wizard(
-                            wizard_type=active_draft['type'],
-                            draft_data=draft_data,
-                            current_step=active_draft['step'],
-                            chat_id=chat_id,
-                            user_id=user_id,
-                            editor_name=editor_name
-                        )
+            # Check if the wizard message is still alive
+            try:
+                # We need the keyboard to check if the message is alive without changing it
+                editor_name = get_user_display_name(user_id)
+                if active_draft['type'] in ['expense', 'settlement', 'clear_debt']:
+                    _, keyboard = render_wizard(
+                        wizard_type=active_draft['type'],
+                        draft_data=draft_data,
+                        current_step=active_draft['step'],
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        editor_name=editor_name
+                    )
+                else:
+                    keyboard = None
+
+                if keyboard:
+                    self.bot.edit_message_reply_markup(chat_id=chat_id, message_id=wizard_message_id, reply_markup=keyboard)
+            except telebot.apihelper.ApiTelegramException as e:
+                if hasattr(e, 'error_code') and e.error_code == 400:
+                    if "message to edit not found" in e.description:
+                        logger.debug(f"Wizard message {wizard_message_id} not found. Ignoring text message.")
+                        self._delete_draft_and_files(active_draft['id'], draft_data)
+                        return
+                    elif "message is not modified" in e.description:
+                        # This is okay, it means the message is alive.
+                        pass
                     else:
-                        keyboard = None
-
-                    if keyboard:
-                        self.bot.edit_message_reply_markup(chat_id=chat_id, message_id=wizard_message_id, reply_markup=keyboard)
-                except telebot.apihelper.ApiTelegramException as e:
-                    if hasattr(e, 'error_code') and e.error_code == 400:
-                        if "message to edit not found" in e.description:
-                            logger.debug(f"Wizard message {wizard_message_id} not found. Ignoring text message.")
-                            self._delete_draft_and_files(active_draft['id'], draft_data)
-                            return
-                        elif "message is not modified" in e.description:
-                            # This is okay, it means the message is alive.
-                            pass
+                        raise
+                else:
+                    raise
+
+            if active_draft['type'] == 'expense':
+                current_step = active_draft['step']
+                draft_id = active_draft['id']
+
+                if current_step == 1:
+                    handle_amount_input(self.bot, message, active_draft)
+                elif current_step == 3:
+                    description_text = message.text
+                    if len(description_text) > 255:
+                        self.delete_message(message.chat.id, message.message_id)
+                        send_temporary_message(self.bot, message.chat.id, "❗ Description is too long. Please keep it under 255 characters.", 5.0)
+                        return
+                    draft_data['description'] = description_text
+                    expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+                    update_draft(draft_id, draft_data, current_step, expires_at)
+                    self.delete_message(message.chat.id, message.message_id)
+                    editor_name = get_user_display_name(user_id)
+                    wizard_text, wizard_keyboard = render_wizard(
+                        wizard_type='expense',
+                        draft_data=draft_data,
+                        current_step=current_step,
+                        chat_id=message.chat.id,
+                        user_id=user_id,
+                        editor_name=editor_name
+                    )
+                    self.bot.edit_message_text(chat_id=message.chat.id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+            elif active_draft['type'] == 'settlement':
+                current_step = active_draft['step']
+                draft_id = active_draft['id']
+
+                if current_step == 2:
+                    handle_amount_input(self.bot, message, active_draft)
+            elif active_draft['type'] == 'clear_debt':
+                try:
+                    amount = Decimal(message.text)
+                    if amount >= 1_000_000_000:
+                        self.delete_message(message.chat.id, message.message_id)
+                        send_temporary_message(self.bot, message.chat.id, "❗ Amount must be less than 1,000,000,000.", 5.0)
+                        return
+                    total_debt = draft_data['total_debt_u5'] / 100000
+                    if not (0.00001 <= amount <= total_debt):
+                        self.delete_message(message.chat.id, message.message_id)
+                        send_temporary_message(self.bot, message.chat.id, f"❗ Amount must be between 0.00001 and {total_debt}.", 5.0)
+                        return
+                    
+                    draft_data['amount_to_clear'] = float(amount)
+                    draft_data['amount_to_clear_u5'] = int(amount * 100000)
+                    expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+                    update_draft(active_draft['id'], draft_data, 2, expires_at)
+                    self.delete_message(message.chat.id, message.message_id)
+                    
+                    text, keyboard = render_wizard(
+                        wizard_type='clear_debt',
+                        draft_data=draft_data,
+                        current_step=2,
+                        chat_id=message.chat.id,
+                        user_id=user_id
+                    )
+                    try:
+                        self.bot.edit_message_text(chat_id=message.chat.id, message_id=draft_data['wizard_message_id'], text=text, reply_markup=keyboard, parse_mode='HTML')
+                    except telebot.apihelper.ApiTelegramException as e:
+                        if e.result.status_code == 400 and "message to edit not found" in e.result.text:
+                            logger.warning(f"Wizard message {draft_data['wizard_message_id']} not found for clear_debt. Cleaning up draft.")
+                            delete_draft(active_draft['id'])
+                            set_active_wizard_user_id(chat_id, None)
                         else:
                             raise
-                    else:
-                        raise
 
-                if active_draft['type'] == 'expense':
-                    current_step = active_draft['step']
-                    draft_id = active_draft['id']
-
-                    if current_step == 1:
-                        handle_amount_input(self.bot, message, active_draft)
-                    elif current_step == 3:
-                        description_text = message.text
-                        if len(description_text) > 255:
-                            self.bot.delete_message(message.chat.id, message.message_id)
-                            warning_msg = self.bot.send_message(message.chat.id, "❗ Description is too long. Please keep it under 255 characters.")
-                            threading.Timer(5.0, self.delete_message, [message.chat.id, warning_msg.message_id]).start()
-                            return
-                        draft_data['description'] = description_text
-                        expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                        update_draft(draft_id, draft_data, current_step, expires_at)
-                        self.bot.delete_message(message.chat.id, message.message_id)
-                        editor_name = get_user_display_name(user_id)
-                        wizard_text, wizard_keyboard = render_wizard(
-                            wizard_type='expense',
-                            draft_data=draft_data,
-                            current_step=current_step,
-                            chat_id=message.chat.id,
-                            user_id=user_id,
-                            editor_name=editor_name
-                        )
-                        self.bot.edit_message_text(chat_id=message.chat.id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                elif active_draft['type'] == 'settlement':
-                    current_step = active_draft['step']
-                    draft_id = active_draft['id']
-
-                    if current_step == 2:
-                        handle_amount_input(self.bot, message, active_draft)
-                elif active_draft['type'] == 'clear_debt':
-                    try:
-                        amount = Decimal(message.text)
-                        if amount >= 1_000_000_000:
-                            self.bot.delete_message(message.chat.id, message.message_id)
-                            warning_msg = self.bot.send_message(message.chat.id, "❗ Amount must be less than 1,000,000,000.")
-                            threading.Timer(5.0, self.delete_message, [message.chat.id, warning_msg.message_id]).start()
-                            return
-                        total_debt = draft_data['total_debt_u5'] / 100000
-                        if not (0.00001 <= amount <= total_debt):
-                            self.bot.delete_message(message.chat.id, message.message_id)
-                            warning_msg = self.bot.send_message(message.chat.id, f"❗ Amount must be between 0.00001 and {total_debt}.")
-                            threading.Timer(5.0, self.delete_message, [message.chat.id, warning_msg.message_id]).start()
-                            return
-                        
-                        draft_data['amount_to_clear'] = float(amount)
-                        draft_data['amount_to_clear_u5'] = int(amount * 100000)
-                        expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                        update_draft(active_draft['id'], draft_data, 2, expires_at)
-                        self.bot.delete_message(message.chat.id, message.message_id)
-                        
-                        text, keyboard = render_wizard(
-                            wizard_type='clear_debt',
-                            draft_data=draft_data,
-                            current_step=2,
-                            chat_id=message.chat.id,
-                            user_id=user_id
-                        )
-                        try:
-                            self.bot.edit_message_text(chat_id=message.chat.id, message_id=draft_data['wizard_message_id'], text=text, reply_markup=keyboard, parse_mode='HTML')
-                        except telebot.apihelper.ApiTelegramException as e:
-                            if e.result.status_code == 400 and "message to edit not found" in e.result.text:
-                                logger.warning(f"Wizard message {draft_data['wizard_message_id']} not found for clear_debt. Cleaning up draft.")
-                                with get_connection() as conn:
-                                    conn.execute("DELETE FROM drafts WHERE id = ?", (active_draft['id'],))
-                                set_active_wizard_user_id(chat_id, None)
-                            else:
-                                raise
-
-                    except ValueError:
-                        self.bot.delete_message(message.chat.id, message.message_id)
-                        warning_msg = self.bot.send_message(message.chat.id, "❗ Invalid amount. Please enter a number.")
-                        threading.Timer(5.0, self.delete_message, [message.chat.id, warning_msg.message_id]).start()
+                except ValueError:
+                    self.delete_message(message.chat.id, message.message_id)
+                    send_temporary_message(self.bot, message.chat.id, "❗ Invalid amount. Please enter a number.", 5.0)
 
         except Exception as e:
             logger.error(f"Error in handle_text_message: {e}")
 
     def handle_callback_query(self, call: telebot.types.CallbackQuery):
-        user_id = call.from_user.id
-        update_group_last_activity(call.message.chat.id)
-        if user_id in self.user_locks:
-            self.bot.answer_callback_query(call.id, text="⏳ Please wait, processing previous request.", show_alert=False)
-            return
-
+        update_group_last_activity.submit(call.message.chat.id)
         try:
-            self.user_locks.add(user_id)
             logger.info(f"Received callback query from user {call.from_user.id} in chat {call.message.chat.id}: {call.data}")
             action_payload = call.data[3:]
             parts = action_payload.split(":", 1)
             action = parts[0] if parts else ""
             payload = parts[1] if len(parts) > 1 else ""
+            if action not in COALESCED_EDIT_ACTIONS:
+                # Whatever this action renders must not be overwritten by a pending toggle view
+                self.edit_coalescer.discard(call.message.chat.id, call.message.message_id)
             self.callback_router(call, action, payload)
         except Exception as e:
             logger.error(f"Error in handle_callback_query: {e}")
-        finally:
-            if user_id in self.user_locks:
-                self.user_locks.remove(user_id)
 
     def callback_router(self, call: telebot.types.CallbackQuery, action: str, payload: str):
         if call.message.chat.type == 'private':
@@ -658,17 +712,14 @@ class Bot:
             "wizard_no_receipt", "set_category", "toggle_debtor", "toggle_all_debtors",
             "edit_amount", "edit_files", "edit_category_desc", "edit_debtors", "delete_file",
             "settle_wizard_next", "settle_wizard_back", "settle_wizard_cancel", "settle_confirm",
-            "toggle_payee", "settle_edit_step", "settle_full_amount", "settle_no_proof",
+            "toggle_payee", "toggle_suggested_payee", "settle_edit_step", "settle_full_amount", "settle_no_proof",
             "clear_full_debt", "clear_debt_cancel", "confirm_clear_debt"
         ]
         if action in WIZARD_ACTIONS:
             active_draft = get_active_draft(chat_id, user_id)
             if not active_draft:
                 self.bot.answer_callback_query(call.id, "❗ This wizard has expired or been cancelled.", show_alert=True)
-                try:
-                    self.bot.delete_message(chat_id, call.message.message_id)
-                except Exception:
-                    pass
+                self.delete_message(chat_id, call.message.message_id)
                 return
 
         settings = get_group_settings(chat_id)
@@ -721,8 +772,12 @@ class Bot:
             self.handle_edit_expense(call, chat_id, user_id, payload)
         elif action == "balances":
             self.handle_balances(call, chat_id, user_id)
+        elif action == "simplified_balances":
+            self.handle_simplified_balances(call, chat_id, user_id)
         elif action == "reports":
             self.handle_reports(call, chat_id, user_id)
+        elif action == "month_end_balances":
+            self.handle_month_end_balances(call, chat_id, user_id, payload)
         elif action == "noop":
             self.bot.answer_callback_query(call.id)
         elif action == "clear_debt_start":
@@ -758,6 +813,8 @@ class Bot:
             self.handle_reject_settlement(call, chat_id, user_id, payload)
         elif action == "toggle_payee":
             self.handle_toggle_payee(call, chat_id, user_id, int(payload))
+        elif action == "toggle_suggested_payee":
+            self.handle_toggle_payee(call, chat_id, user_id, int(payload), suggested=True)
         elif action == "settle_edit_step":
             step = int(payload)
             self.handle_settle_edit_step(call, chat_id, user_id, step)
@@ -836,8 +893,7 @@ class Bot:
 
     def handle_analytics(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             text, keyboard = render_analytics_page(group_name)
             
@@ -855,8 +911,7 @@ class Bot:
 
     def handle_analytics_by_category(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             spending_data = get_spending_by_category(chat_id)
             text, keyboard = render_spending_by_category(group_name, spending_data)
@@ -875,8 +930,7 @@ class Bot:
 
     def handle_analytics_paid_week(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             payment_data = get_spending_by_user_by_period(chat_id, 7)
             text, keyboard = render_who_paid_how_much(group_name, payment_data, "Last 7 Days")
@@ -895,8 +949,7 @@ class Bot:
 
     def handle_analytics_paid_month(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             payment_data = get_spending_by_user_by_period(chat_id, 30)
             text, keyboard = render_who_paid_how_much(group_name, payment_data, "Last 30 Days")
@@ -928,8 +981,7 @@ class Bot:
 
             set_settings_editor_id(chat_id, user_id)
             
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             editor_name = get_user_display_name(user_id)
             
@@ -955,8 +1007,7 @@ class Bot:
             return
 
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             settings = get_group_settings(chat_id)
             excluded_members = settings.get('excluded_members', [])
@@ -992,11 +1043,15 @@ class Bot:
             else:
                 excluded_members.append(member_id)
                 
+            self.bot.answer_callback_query(call.id)
             settings['excluded_members'] = excluded_members
             update_group_settings(chat_id, settings)
             
-            # Refresh the page
-            self.handle_manage_excluded_members(call, chat_id, user_id)
+            # Refresh the page once the taps stop
+            group_name = get_group_name(self.bot, chat_id)
+            members = get_group_members(chat_id, exclude_user_id=user_id, exclude_from_settings=False)
+            text, keyboard = render_excluded_members_page(group_name, members, excluded_members)
+            self.edit_coalescer.edit(chat_id, call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
             
         except Exception as e:
             logger.error(f"Error in handle_toggle_excluded_member: {e}")
@@ -1024,301 +1079,271 @@ class Bot:
                 self.bot.answer_callback_query(call.id, text="❗ Invalid callback data.", show_alert=True)
                 return
 
-            with get_connection() as conn:
-                expense = get_expense(expense_id)
-                if not expense:
-                    self.bot.answer_callback_query(call.id, text="❗ This expense does not exist.", show_alert=True)
-                    return
+            expense = get_expense(expense_id)
+            if not expense:
+                self.bot.answer_callback_query(call.id, text="❗ This expense does not exist.", show_alert=True)
+                return
 
-                if expense['payer_id'] != user_id:
-                    self.bot.answer_callback_query(call.id, text="❗ You are not authorized to delete this expense.", show_alert=True)
-                    return
+            if expense['payer_id'] != user_id:
+                self.bot.answer_callback_query(call.id, text="❗ You are not authorized to delete this expense.", show_alert=True)
+                return
 
-                files = get_expense_files(expense_id)
-                for file_info in files:
-                    try:
-                        self.bot.delete_message(FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
-                    except Exception as e:
-                        logger.error(f"Error deleting file from channel: {e}")
-                    delete_file_by_id(file_info['file_row_id'])
+            files = get_expense_files(expense_id)
+            for file_info in files:
+                self.delete_message(FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
+                delete_file_by_id(file_info['file_row_id'])
 
-                delete_expense(expense_id)
-                self.bot.delete_message(chat_id, call.message.message_id)
-                self.bot.answer_callback_query(call.id, text="✅ Expense deleted!")
+            delete_expense(expense_id)
+            self.delete_message(chat_id, call.message.message_id)
+            self.bot.answer_callback_query(call.id, text="✅ Expense deleted!")
         else:
             active_draft = get_active_draft(chat_id, user_id)
             if active_draft:
                 draft_data = json.loads(active_draft['data_json'])
                 self._delete_draft_and_files(active_draft['id'], draft_data)
                 set_active_wizard_user_id(chat_id, None)
-                self.bot.delete_message(chat_id, draft_data['wizard_message_id'])
+                self.delete_message(chat_id, draft_data['wizard_message_id'])
                 self.bot.answer_callback_query(call.id, text="Draft cancelled.")
 
     def handle_wizard_no_receipt(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 2:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                draft_data['no_receipt'] = True
-                current_step += 1
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, current_step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='expense',
-                    draft_data=draft_data,
-                    current_step=current_step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id)
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 2:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            draft_data['no_receipt'] = True
+            current_step += 1
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, current_step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='expense',
+                draft_data=draft_data,
+                current_step=current_step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+            self.bot.answer_callback_query(call.id)
 
     def handle_set_category(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, category: str):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 3:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                
-                if 'categories' not in draft_data:
-                    draft_data['categories'] = []
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 3:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            
+            if 'categories' not in draft_data:
+                draft_data['categories'] = []
 
-                # Exclusive "Debt" category logic
-                if category == 'Debt':
-                    if any(c != 'Debt' for c in draft_data['categories']):
-                        self.bot.answer_callback_query(call.id, text="❗ 'Debt' must be selected alone. Please deselect other categories first.", show_alert=True)
-                        return
-                elif 'Debt' in draft_data['categories']:
-                    self.bot.answer_callback_query(call.id, text="❗ Please deselect 'Debt' before choosing other categories.", show_alert=True)
+            # Exclusive "Debt" category logic
+            if category == 'Debt':
+                if any(c != 'Debt' for c in draft_data['categories']):
+                    self.bot.answer_callback_query(call.id, text="❗ 'Debt' must be selected alone. Please deselect other categories first.", show_alert=True)
                     return
+            elif 'Debt' in draft_data['categories']:
+                self.bot.answer_callback_query(call.id, text="❗ Please deselect 'Debt' before choosing other categories.", show_alert=True)
+                return
 
-                if category in draft_data['categories']:
-                    draft_data['categories'].remove(category)
-                else:
-                    draft_data['categories'].append(category)
+            if category in draft_data['categories']:
+                draft_data['categories'].remove(category)
+            else:
+                draft_data['categories'].append(category)
 
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, current_step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='expense',
-                    draft_data=draft_data,
-                    current_step=current_step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id)
+            # Acknowledge the tap now; the re-rendered wizard follows after the debounce
+            self.bot.answer_callback_query(call.id)
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, current_step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='expense',
+                draft_data=draft_data,
+                current_step=current_step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            self.edit_coalescer.edit(chat_id, draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
 
     def handle_toggle_debtor(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, debtor_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 4:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                
-                if 'debtors' not in draft_data:
-                    draft_data['debtors'] = []
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 4:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            
+            if 'debtors' not in draft_data:
+                draft_data['debtors'] = []
 
-                if debtor_id in draft_data['debtors']:
-                    draft_data['debtors'].remove(debtor_id)
-                else:
-                    draft_data['debtors'].append(debtor_id)
+            if debtor_id in draft_data['debtors']:
+                draft_data['debtors'].remove(debtor_id)
+            else:
+                draft_data['debtors'].append(debtor_id)
 
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, current_step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='expense',
-                    draft_data=draft_data,
-                    current_step=current_step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id)
+            # Acknowledge the tap now; the re-rendered wizard follows after the debounce
+            self.bot.answer_callback_query(call.id)
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, current_step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='expense',
+                draft_data=draft_data,
+                current_step=current_step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            self.edit_coalescer.edit(chat_id, draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
 
     def handle_toggle_all_debtors(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 4:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                
-                members = get_group_members(chat_id, exclude_user_id=user_id)
-                member_ids = [member['id'] for member in members]
-                
-                if 'debtors' in draft_data and set(member_ids) == set(draft_data['debtors']):
-                    draft_data['debtors'] = []
-                else:
-                    draft_data['debtors'] = member_ids
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'expense' and active_draft['step'] == 4:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            
+            members = get_group_members(chat_id, exclude_user_id=user_id)
+            member_ids = [member['id'] for member in members]
+            
+            if 'debtors' in draft_data and set(member_ids) == set(draft_data['debtors']):
+                draft_data['debtors'] = []
+            else:
+                draft_data['debtors'] = member_ids
 
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, current_step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='expense',
-                    draft_data=draft_data,
-                    current_step=current_step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id)
+            # Acknowledge the tap now; the re-rendered wizard follows after the debounce
+            self.bot.answer_callback_query(call.id)
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, current_step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='expense',
+                draft_data=draft_data,
+                current_step=current_step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            self.edit_coalescer.edit(chat_id, draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
 
     def handle_edit_step(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, step: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'expense':
-                draft_id, draft_data = active_draft['id'], json.loads(active_draft['data_json'])
-                
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='expense',
-                    draft_data=draft_data,
-                    current_step=step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id)
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'expense':
+            draft_id, draft_data = active_draft['id'], json.loads(active_draft['data_json'])
+            
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='expense',
+                draft_data=draft_data,
+                current_step=step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+            self.bot.answer_callback_query(call.id)
 
     def handle_delete_file(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, file_row_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] in ['expense', 'settlement']:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                
-                file_to_delete = next((f for f in draft_data.get('files', []) if f['file_row_id'] == file_row_id), None)
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] in ['expense', 'settlement']:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            
+            file_to_delete = next((f for f in draft_data.get('files', []) if f['file_row_id'] == file_row_id), None)
 
-                if 'files' in draft_data:
-                    draft_data['files'] = [f for f in draft_data['files'] if f['file_row_id'] != file_row_id]
-                
-                delete_file_by_id(file_row_id)
+            if 'files' in draft_data:
+                draft_data['files'] = [f for f in draft_data['files'] if f['file_row_id'] != file_row_id]
+            
+            delete_file_by_id(file_row_id)
 
-                if file_to_delete:
-                    try:
-                        self.bot.delete_message(FILES_CHANNEL_ID, file_to_delete['origin_channel_message_id'])
-                    except Exception as e:
-                        logger.error(f"Error deleting file from channel: {e}")
+            if file_to_delete:
+                self.delete_message(FILES_CHANNEL_ID, file_to_delete['origin_channel_message_id'])
 
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, current_step, expires_at)
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, current_step, expires_at)
 
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type=active_draft['type'],
-                    draft_data=draft_data,
-                    current_step=current_step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id, text=f"File deleted.")
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type=active_draft['type'],
+                draft_data=draft_data,
+                current_step=current_step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            
+            self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+            self.bot.answer_callback_query(call.id, text=f"File deleted.")
 
     def handle_wizard_confirm(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if not active_draft:
-                self.bot.answer_callback_query(call.id, text="❗ Your draft has expired.", show_alert=True)
-                return
-
-            draft_data = json.loads(active_draft['data_json'])
-            
-            # Validation
-            if 'amount' not in draft_data or 'debtors' not in draft_data or not draft_data['debtors']:
-                self.bot.answer_callback_query(call.id, text="❗ Please fill in all the required fields.", show_alert=True)
-                return
-            if not draft_data.get('description') and not draft_data.get('categories'):
-                self.bot.answer_callback_query(call.id, text="❗ Please provide a description or select at least one category.", show_alert=True)
-                return
+        active_draft = get_active_draft(chat_id, user_id)
+        if not active_draft:
+            self.bot.answer_callback_query(call.id, text="❗ Your draft has expired.", show_alert=True)
+            return
 
-            payer_id = active_draft['user_id']
-            amount_u5 = draft_data['amount_u5']
-            description = draft_data.get('description')
-            category = ', '.join(draft_data.get('categories', []))
-            debtors = draft_data['debtors']
-            files = draft_data.get('files', [])
-            
-            categories = draft_data.get('categories', [])
-            
-            # Determine participants based on category
-            if categories == ['Debt']:
-                # For a debt, only the selected debtors are participants
-                participants = debtors
-                if not participants:
-                    self.bot.answer_callback_query(call.id, text="❗ For a debt, you must select at least one debtor.", show_alert=True)
-                    return
-            else:
-                # For a regular expense, the payer is also a participant
-                participants = debtors + [payer_id]
+        draft_data = json.loads(active_draft['data_json'])
+        
+        # Validation
+        if 'amount' not in draft_data or 'debtors' not in draft_data or not draft_data['debtors']:
+            self.bot.answer_callback_query(call.id, text="❗ Please fill in all the required fields.", show_alert=True)
+            return
+        if not draft_data.get('description') and not draft_data.get('categories'):
+            self.bot.answer_callback_query(call.id, text="❗ Please provide a description or select at least one category.", show_alert=True)
+            return
 
+        payer_id = active_draft['user_id']
+        amount_u5 = draft_data['amount_u5']
+        description = draft_data.get('description')
+        category = ', '.join(draft_data.get('categories', []))
+        debtors = draft_data['debtors']
+        files = draft_data.get('files', [])
+        
+        categories = draft_data.get('categories', [])
+        
+        # Determine participants based on category
+        if categories == ['Debt']:
+            # For a debt, only the selected debtors are participants
+            participants = debtors
             if not participants:
-                self.bot.answer_callback_query(call.id, text="❗ Cannot calculate split with no participants.", show_alert=True)
+                self.bot.answer_callback_query(call.id, text="❗ For a debt, you must select at least one debtor.", show_alert=True)
                 return
+        else:
+            # For a regular expense, the payer is also a participant
+            participants = debtors + [payer_id]
 
-            if categories == ['Debt'] and len(participants) == 1:
-                # This is a direct debt, not a split, so use the full amount.
-                share_u5 = amount_u5
-            else:
-                # For regular splits, use the existing truncation logic for fairness.
-                # Use the precise amount_u5 for splitting to avoid float precision issues.
-                total_amount_decimal = Decimal(amount_u5) / Decimal(100000)
-                share_decimal = total_amount_decimal / len(participants)
-                truncated_share_decimal = Decimal(int(share_decimal * 1000)) / 1000
-                share_u5 = int(truncated_share_decimal * 100000)
+        if not participants:
+            self.bot.answer_callback_query(call.id, text="❗ Cannot calculate split with no participants.", show_alert=True)
+            return
 
-            try:
-                expense_id = create_expense(chat_id, payer_id, amount_u5, description, category)
-                create_expense_debtors(expense_id, debtors, share_u5)
+        if categories == ['Debt'] and len(participants) == 1:
+            # This is a direct debt, not a split, so use the full amount.
+            share_u5 = amount_u5
+        else:
+            # For regular splits, use the existing truncation logic for fairness.
+            # Use the precise amount_u5 for splitting to avoid float precision issues.
+            total_amount_decimal = Decimal(amount_u5) / Decimal(100000)
+            share_decimal = total_amount_decimal / len(participants)
+            truncated_share_decimal = Decimal(int(share_decimal * 1000)) / 1000
+            share_u5 = int(truncated_share_decimal * 100000)
 
-                settings = get_group_settings(chat_id)
-                auto_confirm_users = settings.get('auto_confirm_expense_users', [])
+        try:
+            settings = get_group_settings(chat_id)
+            auto_confirm_users = settings.get('auto_confirm_expense_users', [])
 
-                for debtor_id in debtors:
-                    if debtor_id in auto_confirm_users:
-                        update_debtor_status(expense_id, debtor_id, 'confirmed')
+            # Expense, debtors, auto-confirmations, debts, file links and
+            # the draft cleanup are committed together.
+            expense_id = publish_expense(chat_id, payer_id, amount_u5, description, category, debtors, share_u5, files, active_draft['id'], auto_confirm_users)
 
-                # NEW: Check if all debtors were auto-confirmed and create debts if so
-                expense_debtors_after_auto_confirm = get_expense_debtors(expense_id)
-                all_confirmed = all(d['status'] == 'confirmed' for d in expense_debtors_after_auto_confirm)
-
-                if all_confirmed:
-                    for debtor in expense_debtors_after_auto_confirm:
-                        upsert_debt(debtor['debtor_id'], payer_id, debtor['share_u5'])
-
-                for file_info in files:
-                    update_file_relation(file_info['file_row_id'], "expense", expense_id)
-                
-                # Clean up draft
-                with get_connection() as conn:
-                    conn.execute("DELETE FROM drafts WHERE id = ?", (active_draft['id'],))
-
-                
-                # Delete the wizard message
-                self.bot.delete_message(chat_id, draft_data['wizard_message_id'])
-                
-                # Send expense message
-                expense = get_expense(expense_id)
-                expense_debtors = get_expense_debtors(expense_id)
-                payer_name = get_user_display_name(payer_id)
-                text, keyboard = render_expense_message(expense, payer_name, expense_debtors, share_u5, files)
-                
-                sent_message = self.bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
-                update_expense_message_id(expense_id, sent_message.message_id)
-                
-                self.bot.answer_callback_query(call.id, text="✅ Expense published!")
+            # Delete the wizard message
+            self.delete_message(chat_id, draft_data['wizard_message_id'])
+            
+            # Send expense message
+            expense = get_expense(expense_id)
+            expense_debtors = get_expense_debtors(expense_id)
+            payer_name = get_user_display_name(payer_id)
+            text, keyboard = render_expense_message(expense, payer_name, expense_debtors, share_u5, files)
+            
+            sent_message = self.bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
+            update_expense_message_id(expense_id, sent_message.message_id)
+            
+            self.bot.answer_callback_query(call.id, text="✅ Expense published!")
 
-            except Exception as e:
-                logger.error(f"Error creating expense: {e}")
-                self.bot.answer_callback_query(call.id, text="❗ An error occurred while creating the expense.", show_alert=True)
+        except Exception as e:
+            logger.error(f"Error creating expense: {e}")
+            self.bot.answer_callback_query(call.id, text="❗ An error occurred while creating the expense.", show_alert=True)
 
     def handle_confirm_debt(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payload: str):
         try:
@@ -1328,54 +1353,48 @@ class Bot:
             self.bot.answer_callback_query(call.id, text="❗ Invalid callback data.", show_alert=True)
             return
 
-        with get_connection() as conn:
-            expense = get_expense(expense_id)
-            if not expense:
-                self.bot.answer_callback_query(call.id, text="❗ This expense does not exist.", show_alert=True)
-                return
+        expense = get_expense(expense_id)
+        if not expense:
+            self.bot.answer_callback_query(call.id, text="❗ This expense does not exist.", show_alert=True)
+            return
 
-            payer_id = expense['payer_id']
-            payer_name = get_user_display_name(payer_id)
-            
-            # Find the specific debtor to update
-            expense_debtors = get_expense_debtors(expense_id)
-            debtor_to_update = next((d for d in expense_debtors if d['debtor_id'] == debtor_id_to_confirm), None)
+        payer_id = expense['payer_id']
+        payer_name = get_user_display_name(payer_id)
+        
+        # Find the specific debtor to update
+        expense_debtors = get_expense_debtors(expense_id)
+        debtor_to_update = next((d for d in expense_debtors if d['debtor_id'] == debtor_id_to_confirm), None)
 
-            if not debtor_to_update or debtor_to_update['status'] != 'pending':
-                self.bot.answer_callback_query(call.id, text="❗ This debt is not pending or does not exist for you.", show_alert=True)
-                return
+        if not debtor_to_update or debtor_to_update['status'] != 'pending':
+            self.bot.answer_callback_query(call.id, text="❗ This debt is not pending or does not exist for you.", show_alert=True)
+            return
 
-            share_u5 = debtor_to_update['share_u5']
+        share_u5 = debtor_to_update['share_u5']
 
-            # Check if expense is already disputed
-            is_disputed = any(d['status'] == 'rejected' for d in expense_debtors)
-            if is_disputed:
-                self.bot.answer_callback_query(call.id, text="❗ This expense has been disputed and cannot be confirmed.", show_alert=True)
+        # Check if expense is already disputed
+        is_disputed = any(d['status'] == 'rejected' for d in expense_debtors)
+        if is_disputed:
+            self.bot.answer_callback_query(call.id, text="❗ This expense has been disputed and cannot be confirmed.", show_alert=True)
+            return
+
+        try:
+            # Creates the debts as well once every debtor has confirmed
+            expense_debtors = confirm_expense_debtor(expense, debtor_id_to_confirm)
+            if expense_debtors is None:
+                self.bot.answer_callback_query(call.id, text="❗ This debt is not pending or does not exist for you.", show_alert=True)
                 return
 
-            try:
-                update_debtor_status(expense_id, debtor_id_to_confirm, 'confirmed')
-                
-                # Check if all debtors have confirmed
-                expense_debtors = get_expense_debtors(expense_id) # refresh
-                all_confirmed = all(d['status'] == 'confirmed' for d in expense_debtors)
-
-                if all_confirmed:
-                    # Create debts for all debtors
-                    for debtor in expense_debtors:
-                        upsert_debt(debtor['debtor_id'], payer_id, debtor['share_u5'])
-                
-                # Update the expense message
-                files = get_expense_files(expense_id)
-                text, keyboard = render_expense_message(expense, payer_name, expense_debtors, share_u5, files)
+            # Update the expense message
+            files = get_expense_files(expense_id)
+            text, keyboard = render_expense_message(expense, payer_name, expense_debtors, share_u5, files)
 
-                self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
-                
-                self.bot.answer_callback_query(call.id, text="✅ Debt confirmed!")
+            self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
+            
+            self.bot.answer_callback_query(call.id, text="✅ Debt confirmed!")
 
-            except Exception as e:
-                logger.error(f"Error confirming debt: {e}")
-                self.bot.answer_callback_query(call.id, text="❗ An error occurred while confirming the debt.", show_alert=True)
+        except Exception as e:
+            logger.error(f"Error confirming debt: {e}")
+            self.bot.answer_callback_query(call.id, text="❗ An error occurred while confirming the debt.", show_alert=True)
 
     def handle_reject_debt(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payload: str):
         try:
@@ -1385,60 +1404,56 @@ class Bot:
             self.bot.answer_callback_query(call.id, text="❗ Invalid callback data.", show_alert=True)
             return
 
-        with get_connection() as conn:
-            expense = get_expense(expense_id)
-            if not expense:
-                self.bot.answer_callback_query(call.id, text="❗ This expense does not exist.", show_alert=True)
-                return
+        expense = get_expense(expense_id)
+        if not expense:
+            self.bot.answer_callback_query(call.id, text="❗ This expense does not exist.", show_alert=True)
+            return
 
-            # Find the specific debtor to update
-            expense_debtors = get_expense_debtors(expense_id)
-            debtor_to_update = next((d for d in expense_debtors if d['debtor_id'] == debtor_id_to_reject), None)
+        # Find the specific debtor to update
+        expense_debtors = get_expense_debtors(expense_id)
+        debtor_to_update = next((d for d in expense_debtors if d['debtor_id'] == debtor_id_to_reject), None)
 
-            if not debtor_to_update or debtor_to_update['status'] != 'pending':
-                self.bot.answer_callback_query(call.id, text="❗ This debt is not pending or does not exist for you.", show_alert=True)
-                return
+        if not debtor_to_update or debtor_to_update['status'] != 'pending':
+            self.bot.answer_callback_query(call.id, text="❗ This debt is not pending or does not exist for you.", show_alert=True)
+            return
 
-            # Check if expense is already disputed
-            is_disputed = any(d['status'] == 'rejected' for d in expense_debtors)
-            if is_disputed:
-                self.bot.answer_callback_query(call.id, text="❗ This expense has already been disputed.", show_alert=True)
-                return
+        # Check if expense is already disputed
+        is_disputed = any(d['status'] == 'rejected' for d in expense_debtors)
+        if is_disputed:
+            self.bot.answer_callback_query(call.id, text="❗ This expense has already been disputed.", show_alert=True)
+            return
 
-            try:
-                logger.info(f"User {debtor_id_to_reject} is rejecting expense {expense_id}. Updating status to 'rejected'.")
-                update_debtor_status(expense_id, debtor_id_to_reject, 'rejected')
-                reject_expense(expense_id)
-                
-                # Notify the payer with an @-mention in the group chat
-                payer_id_internal = expense['payer_id']
-                payer_user = get_user(payer_id_internal)
-                payer_tg_id = payer_user['tg_id']
-                payer_name = payer_user['display_name']
-                rejector_name = get_user_display_name(debtor_id_to_reject)
-                expense_description = expense.get('category') or expense.get('description') or  'the expense'
-                
-                payer_mention = f'<a href="tg://user?id={payer_tg_id}">{payer_name}</a>'
-                mention_message_text = f"{payer_mention}, {rejector_name} has rejected their share of the expense for \"{expense_description}\". Please resolve this and then edit and resubmit the expense."
-                sent_mention_message = self.bot.send_message(chat_id, mention_message_text, parse_mode='HTML')
-                
-                # Delete the mention message after 30 seconds
-                threading.Timer(30.0, self.delete_message, [chat_id, sent_mention_message.message_id]).start()
-
-                # Update the expense message
-                expense_debtors = get_expense_debtors(expense_id)
-                payer_name = get_user_display_name(payer_id_internal)
-                share_u5 = debtor_to_update['share_u5']
-                files = get_expense_files(expense_id)
-                text, keyboard = render_expense_message(expense, payer_name, expense_debtors, share_u5, files)
-                
-                self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
-                
-                self.bot.answer_callback_query(call.id, text="❌ Debt rejected!")
+        try:
+            logger.info(f"User {debtor_id_to_reject} is rejecting expense {expense_id}. Updating status to 'rejected'.")
+            reject_expense_debtor(expense_id, debtor_id_to_reject)
+            
+            # Notify the payer with an @-mention in the group chat
+            payer_id_internal = expense['payer_id']
+            payer_user = get_user(payer_id_internal)
+            payer_tg_id = payer_user['tg_id']
+            payer_name = payer_user['display_name']
+            rejector_name = get_user_display_name(debtor_id_to_reject)
+            expense_description = expense.get('category') or expense.get('description') or  'the expense'
+            
+            payer_mention = f'<a href="tg://user?id={payer_tg_id}">{payer_name}</a>'
+            mention_message_text = f"{payer_mention}, {rejector_name} has rejected their share of the expense for \"{expense_description}\". Please resolve this and then edit and resubmit the expense."
+            # Delete the mention message after 30 seconds
+            send_temporary_message(self.bot, chat_id, mention_message_text, 30.0, parse_mode='HTML')
 
-            except Exception as e:
-                logger.error(f"Error rejecting debt: {e}")
-                self.bot.answer_callback_query(call.id, text="❗ An error occurred while rejecting the debt.", show_alert=True)
+            # Update the expense message
+            expense_debtors = get_expense_debtors(expense_id)
+            payer_name = get_user_display_name(payer_id_internal)
+            share_u5 = debtor_to_update['share_u5']
+            files = get_expense_files(expense_id)
+            text, keyboard = render_expense_message(expense, payer_name, expense_debtors, share_u5, files)
+            
+            self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
+            
+            self.bot.answer_callback_query(call.id, text="❌ Debt rejected!")
+
+        except Exception as e:
+            logger.error(f"Error rejecting debt: {e}")
+            self.bot.answer_callback_query(call.id, text="❗ An error occurred while rejecting the debt.", show_alert=True)
 
 
 
@@ -1477,10 +1492,7 @@ class Bot:
         delete_expense(expense_id)
 
         # Delete the old expense message
-        try:
-            self.bot.delete_message(chat_id, call.message.message_id)
-        except Exception as e:
-            logger.warning(f"Could not delete old expense message {call.message.message_id}: {e}")
+        self.delete_message(chat_id, call.message.message_id)
 
         # Start the wizard
         editor_name = get_user_display_name(user_id)
@@ -1497,14 +1509,9 @@ class Bot:
         update_draft(draft_id, draft_data, 5, expires_at)
 
     def handle_balances(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
-        message_id = call.message.message_id
-        if message_id in self.clear_debt_timers:
-            self.clear_debt_timers.pop(message_id).cancel()
-            
         self.bot.answer_callback_query(call.id)
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             balance_summary = get_my_balance(user_id, chat_id)
             all_balances = get_all_balances(chat_id)
@@ -1522,10 +1529,59 @@ class Bot:
             logger.error(f"Error in handle_balances: {e}")
             self.bot.answer_callback_query(call.id, text="❗ An error occurred while opening balances.", show_alert=True)
 
+    def handle_simplified_balances(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
+        self.bot.answer_callback_query(call.id)
+        try:
+            group_name = get_group_name(self.bot, chat_id)
+
+            transfers = get_simplified_debts(chat_id)
+            text, keyboard = render_simplified_balances_page(user_id, group_name, transfers)
+
+            self.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=call.message.message_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            logger.error(f"Error in handle_simplified_balances: {e}")
+
+    def handle_month_end_balances(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payload: str):
+        try:
+            # The latest month with an end is the previous calendar month
+            today = get_now_in_configured_timezone()
+            latest_year, latest_month = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+            year, month = latest_year, latest_month
+            if payload:
+                try:
+                    year, month = (int(part) for part in payload.split('-'))
+                except ValueError:
+                    self.bot.answer_callback_query(call.id, text="❗ Invalid callback data.", show_alert=True)
+                    return
+                if not 1 <= month <= 12 or (year, month) > (latest_year, latest_month):
+                    year, month = latest_year, latest_month
+
+            group_name = get_group_name(self.bot, chat_id)
+
+            balances = get_month_end_balances(chat_id, year, month)
+            text, keyboard = render_month_end_balances_page(group_name, year, month, balances, (year, month) == (latest_year, latest_month))
+
+            self.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=call.message.message_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode='HTML'
+            )
+            self.bot.answer_callback_query(call.id)
+        except Exception as e:
+            logger.error(f"Error in handle_month_end_balances: {e}")
+            self.bot.answer_callback_query(call.id, text="❗ An error occurred while fetching month-end balances.", show_alert=True)
+
     def handle_reports(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             text, keyboard = render_reports_menu(group_name)
             
@@ -1567,8 +1623,7 @@ class Bot:
     def handle_clear_debt_cancel(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
         active_draft = get_active_draft(chat_id, user_id)
         if active_draft and active_draft['type'] == 'clear_debt':
-            with get_connection() as conn:
-                conn.execute("DELETE FROM drafts WHERE id = ?", (active_draft['id'],))
+            delete_draft(active_draft['id'])
         
         self.handle_balances(call, chat_id, user_id)
 
@@ -1589,7 +1644,7 @@ class Bot:
             set_active_wizard_user_id(chat_id, user_id)
             debtor_id = int(payload)
             
-            debt_amount_u5 = get_debt_between_users(debtor_id, user_id)
+            debt_amount_u5 = get_debt_between_users(chat_id, debtor_id, user_id)
             if not debt_amount_u5 or debt_amount_u5 <= 0:
                 self.bot.answer_callback_query(call.id, text="❗ No debt to clear.", show_alert=True)
                 return
@@ -1637,8 +1692,7 @@ class Bot:
             amount_to_clear = draft_data['amount_to_clear']
             amount_to_clear_u5 = draft_data['amount_to_clear_u5']
 
-            # To clear the debt, we credit the payee from the debtor
-            upsert_debt(payee_id, debtor_id, amount_to_clear_u5)
+            clear_debt(chat_id, payee_id, debtor_id, amount_to_clear_u5, active_draft['id'])
 
             self.bot.answer_callback_query(call.id, text="✅ Debt cleared!")
             
@@ -1647,11 +1701,7 @@ class Bot:
             amount_str = format_amount(amount_to_clear)
             
             message_text = f"✅ {payee_name} has cleared a debt of {amount_str} from {debtor_name}."
-            self.bot.send_message(chat_id, message_text)
-
-            # Clean up
-            with get_connection() as conn:
-                conn.execute("DELETE FROM drafts WHERE id = ?", (active_draft['id'],))
+            submit_nowait(self.bot, "send_message", chat_id, message_text)
 
             # Refresh the balances page
             self.handle_balances(call, chat_id, user_id)
@@ -1672,8 +1722,7 @@ class Bot:
                     self._delete_draft_and_files(active_draft['id'], draft_data)
 
             set_settings_editor_id(chat_id, None)
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
             
             menu_text, menu_keyboard = render_main_menu(group_name=group_name)
             
@@ -1702,7 +1751,7 @@ class Bot:
                     self._delete_draft_and_files(active_draft['id'], draft_data)
 
             set_settings_editor_id(chat_id, None)
-            self.bot.delete_message(chat_id, call.message.message_id)
+            self.delete_message(chat_id, call.message.message_id)
             self.bot.answer_callback_query(call.id, text="Menu closed.")
         except Exception as e:
             logger.error(f"Error in handle_close_menu: {e}")
@@ -1710,8 +1759,7 @@ class Bot:
             
     def handle_history(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, offset: int = 0):
         try:
-            group_info = self.bot.get_chat(chat_id)
-            group_name = group_info.title if group_info.title else "Your Group Name"
+            group_name = get_group_name(self.bot, chat_id)
 
             limit = 10
             history_events = get_group_history(chat_id, limit=limit, offset=offset)
@@ -1734,184 +1782,178 @@ class Bot:
         if active_draft and active_draft['type'] == 'settlement':
             draft_data = json.loads(active_draft['data_json'])
             self._delete_draft_and_files(active_draft['id'], draft_data)
-            self.bot.delete_message(chat_id, draft_data['wizard_message_id'])
+            self.delete_message(chat_id, draft_data['wizard_message_id'])
             self.bot.answer_callback_query(call.id, text="Settlement draft cancelled.")
 
-    def handle_toggle_payee(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payee_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            logger.debug(f"handle_toggle_payee: active_draft={active_draft}")
-            if active_draft and active_draft['type'] == 'settlement' and active_draft['step'] == 1:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                
-                draft_data['payee'] = payee_id
-                current_step += 1 # Auto-advance to next step
+    def handle_toggle_payee(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payee_id: int, suggested: bool = False):
+        active_draft = get_active_draft(chat_id, user_id)
+        logger.debug(f"handle_toggle_payee: active_draft={active_draft}")
+        if active_draft and active_draft['type'] == 'settlement' and active_draft['step'] == 1:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            
+            draft_data['payee'] = payee_id
+            # Only a payee picked from the simplified transfers is settled along the debt chain
+            draft_data['suggested_payee'] = suggested
+            current_step += 1 # Auto-advance to next step
 
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, current_step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='settlement',
-                    draft_data=draft_data,
-                    current_step=current_step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id)
-            else:
-                self.bot.answer_callback_query(call.id)
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, current_step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='settlement',
+                draft_data=draft_data,
+                current_step=current_step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+            self.bot.answer_callback_query(call.id)
+        else:
+            self.bot.answer_callback_query(call.id)
 
     def handle_settle_edit_step(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, step: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'settlement':
-                draft_id, draft_data = active_draft['id'], json.loads(active_draft['data_json'])
-                
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='settlement',
-                    draft_data=draft_data,
-                    current_step=step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                self.bot.answer_callback_query(call.id)
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'settlement':
+            draft_id, draft_data = active_draft['id'], json.loads(active_draft['data_json'])
+            
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='settlement',
+                draft_data=draft_data,
+                current_step=step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+            self.bot.answer_callback_query(call.id)
 
     def handle_settle_full_amount(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'settlement' and active_draft['step'] == 2:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                
-                if 'payee' in draft_data:
-                    owed_amount = get_owed_amount(user_id, draft_data['payee'])
-                    if owed_amount > 0:
-                        owed_amount_decimal = Decimal(owed_amount) / Decimal(100000)
-                        draft_data['amount'] = float(owed_amount_decimal)
-                        draft_data['amount_u5'] = owed_amount
-                        current_step += 1
-                        expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                        update_draft(draft_id, draft_data, current_step, expires_at)
-                        editor_name = get_user_display_name(user_id)
-                        wizard_text, wizard_keyboard = render_wizard(
-                            wizard_type='settlement',
-                            draft_data=draft_data,
-                            current_step=current_step,
-                            chat_id=chat_id,
-                            user_id=user_id,
-                            editor_name=editor_name
-                        )
-                        self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                        self.bot.answer_callback_query(call.id)
-                    else:
-                        self.bot.answer_callback_query(call.id, text="❗ You don't owe any money to this person.", show_alert=True)
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'settlement' and active_draft['step'] == 2:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            
+            if 'payee' in draft_data:
+                owed_amount = get_payable_amount(chat_id, user_id, draft_data['payee'])
+                if owed_amount > 0:
+                    owed_amount_decimal = Decimal(owed_amount) / Decimal(100000)
+                    draft_data['amount'] = float(owed_amount_decimal)
+                    draft_data['amount_u5'] = owed_amount
+                    current_step += 1
+                    expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+                    update_draft(draft_id, draft_data, current_step, expires_at)
+                    editor_name = get_user_display_name(user_id)
+                    wizard_text, wizard_keyboard = render_wizard(
+                        wizard_type='settlement',
+                        draft_data=draft_data,
+                        current_step=current_step,
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        editor_name=editor_name
+                    )
+                    self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+                    self.bot.answer_callback_query(call.id)
                 else:
-                    self.bot.answer_callback_query(call.id, text="❗ Please select a payee first.", show_alert=True)
+                    self.bot.answer_callback_query(call.id, text="❗ You don't owe any money to this person.", show_alert=True)
+            else:
+                self.bot.answer_callback_query(call.id, text="❗ Please select a payee first.", show_alert=True)
 
     def handle_settle_no_proof(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if active_draft and active_draft['type'] == 'settlement' and active_draft['step'] == 3:
-                draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-                
-                draft_data['no_proof'] = True
-                current_step += 1
-                expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-                update_draft(draft_id, draft_data, current_step, expires_at)
-                editor_name = get_user_display_name(user_id)
-                wizard_text, wizard_keyboard = render_wizard(
-                    wizard_type='settlement',
-                    draft_data=draft_data,
-                    current_step=current_step,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    editor_name=editor_name
-                )
-                try:
-                    self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                except telebot.apihelper.ApiTelegramException as e:
-                    if "message is not modified" in str(e):
-                        logger.warning("Message not modified, trying to send a new one.")
-                        self.bot.delete_message(chat_id, draft_data['wizard_message_id'])
-                        new_message = self.bot.send_message(chat_id, wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
-                        draft_data['wizard_message_id'] = new_message.message_id
-                        update_draft(draft_id, draft_data, current_step, expires_at)
-                    else:
-                        raise
-                self.bot.answer_callback_query(call.id)
+        active_draft = get_active_draft(chat_id, user_id)
+        if active_draft and active_draft['type'] == 'settlement' and active_draft['step'] == 3:
+            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+            
+            draft_data['no_proof'] = True
+            current_step += 1
+            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+            update_draft(draft_id, draft_data, current_step, expires_at)
+            editor_name = get_user_display_name(user_id)
+            wizard_text, wizard_keyboard = render_wizard(
+                wizard_type='settlement',
+                draft_data=draft_data,
+                current_step=current_step,
+                chat_id=chat_id,
+                user_id=user_id,
+                editor_name=editor_name
+            )
+            try:
+                self.bot.edit_message_text(chat_id=chat_id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+            except telebot.apihelper.ApiTelegramException as e:
+                if "message is not modified" in str(e):
+                    logger.warning("Message not modified, trying to send a new one.")
+                    self.delete_message(chat_id, draft_data['wizard_message_id'])
+                    new_message = self.bot.send_message(chat_id, wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
+                    draft_data['wizard_message_id'] = new_message.message_id
+                    update_draft(draft_id, draft_data, current_step, expires_at)
+                else:
+                    raise
+            self.bot.answer_callback_query(call.id)
 
     def handle_settle_confirm(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int):
-        with get_connection() as conn:
-            active_draft = get_active_draft(chat_id, user_id)
-            if not active_draft or active_draft['type'] != 'settlement':
-                self.bot.answer_callback_query(call.id, text="❗ Your draft has expired or is invalid.", show_alert=True)
-                return
+        active_draft = get_active_draft(chat_id, user_id)
+        if not active_draft or active_draft['type'] != 'settlement':
+            self.bot.answer_callback_query(call.id, text="❗ Your draft has expired or is invalid.", show_alert=True)
+            return
 
-            draft_data = json.loads(active_draft['data_json'])
-            
-            if 'payee' not in draft_data or 'amount' not in draft_data or (not draft_data.get('files') and not draft_data.get('no_proof')):
-                self.bot.answer_callback_query(call.id, text="❗ Please fill in all the required fields.", show_alert=True)
-                return
+        draft_data = json.loads(active_draft['data_json'])
+        
+        if 'payee' not in draft_data or 'amount' not in draft_data or (not draft_data.get('files') and not draft_data.get('no_proof')):
+            self.bot.answer_callback_query(call.id, text="❗ Please fill in all the required fields.", show_alert=True)
+            return
 
-            from_user_id = active_draft['user_id']
-            to_user_id = draft_data['payee']
-            amount_u5 = draft_data['amount_u5']
-            files = draft_data.get('files', [])
+        from_user_id = active_draft['user_id']
+        to_user_id = draft_data['payee']
+        amount_u5 = draft_data['amount_u5']
+        files = draft_data.get('files', [])
 
-            try:
-                current_debt = get_owed_amount(from_user_id, to_user_id)
-                settlement_id = create_settlement(chat_id, from_user_id, to_user_id, amount_u5)
+        try:
+            current_debt = get_payable_amount(chat_id, from_user_id, to_user_id)
 
-                settings = get_group_settings(chat_id)
-                auto_confirm_users = settings.get('auto_confirm_settlement_users', [])
+            settings = get_group_settings(chat_id)
+            auto_confirm_users = settings.get('auto_confirm_settlement_users', [])
+            auto_confirm = to_user_id in auto_confirm_users
 
-                if to_user_id in auto_confirm_users:
-                    update_settlement_status(settlement_id, 'confirmed')
-                    upsert_debt(to_user_id, from_user_id, amount_u5)
-                    
-                    # Show updated balance
-                    new_balance = get_debt_between_users(from_user_id, to_user_id)
-                    if new_balance == 0:
-                        balance_message = f"✅ {get_user_display_name(from_user_id)} and {get_user_display_name(to_user_id)} are now settled up."
-                    elif new_balance > 0:
-                        balance_message = f"💰 Balance: {get_user_display_name(from_user_id)} owes {get_user_display_name(to_user_id)} {format_amount(new_balance / 100000)}."
-                    else: # new_balance < 0
-                        balance_message = f"💰 Balance: {get_user_display_name(to_user_id)} owes {get_user_display_name(from_user_id)} {format_amount(abs(new_balance) / 100000)}."
-                    
-                    threading.Timer(1.0, self.bot.send_message, [chat_id, balance_message]).start()
+            settlement_id = publish_settlement(chat_id, from_user_id, to_user_id, amount_u5, files, active_draft['id'], auto_confirm, draft_data.get('suggested_payee', False))
 
-                for file_info in files:
-                    update_file_relation(file_info['file_row_id'], "settlement", settlement_id)
-                
-                with get_connection() as conn:
-                    conn.execute("DELETE FROM drafts WHERE id = ?", (active_draft['id'],))
+            if auto_confirm:
+                # Show updated balance
+                balance_message = self.get_balance_message(chat_id, from_user_id, to_user_id)
+                schedule(1.0, submit_nowait, self.bot, "send_message", chat_id, balance_message)
 
-                
-                self.bot.delete_message(chat_id, draft_data['wizard_message_id'])
-                
-                settlement = get_settlement(settlement_id)
-                from_user_name = get_user_display_name(from_user_id)
-                to_user_name = get_user_display_name(to_user_id)
+            self.delete_message(chat_id, draft_data['wizard_message_id'])
+            
+            settlement = get_settlement(settlement_id)
+            from_user_name = get_user_display_name(from_user_id)
+            to_user_name = get_user_display_name(to_user_id)
 
-                new_balance = current_debt - amount_u5
-                is_overpayment = new_balance < 0
+            new_balance = current_debt - amount_u5
+            is_overpayment = new_balance < 0
 
-                text, keyboard = render_settlement_message(settlement, from_user_name, to_user_name, files, new_balance, is_overpayment)
-                
-                sent_message = self.bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
-                update_settlement_message_id(settlement_id, sent_message.message_id)
-                
-                self.bot.answer_callback_query(call.id, text="✅ Settlement published!")
+            text, keyboard = render_settlement_message(settlement, from_user_name, to_user_name, files, new_balance, is_overpayment)
+            
+            sent_message = self.bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
+            update_settlement_message_id(settlement_id, sent_message.message_id)
+            
+            self.bot.answer_callback_query(call.id, text="✅ Settlement published!")
 
-            except Exception as e:
-                logger.error(f"Error creating settlement: {e}")
-                self.bot.answer_callback_query(call.id, text="❗ An error occurred while creating the settlement.", show_alert=True)
+        except Exception as e:
+            logger.error(f"Error creating settlement: {e}")
+            self.bot.answer_callback_query(call.id, text="❗ An error occurred while creating the settlement.", show_alert=True)
+
+    def get_balance_message(self, chat_id: int, from_user_id: int, to_user_id: int) -> str:
+        """The message posted after a settlement, showing what is left between the two users."""
+        new_balance = get_debt_between_users(chat_id, from_user_id, to_user_id)
+        from_user_name = get_user_display_name(from_user_id)
+        to_user_name = get_user_display_name(to_user_id)
+        if new_balance == 0:
+            return f"✅ {from_user_name} and {to_user_name} are now settled up."
+        elif new_balance > 0:
+            return f"💰 Balance: {from_user_name} owes {to_user_name} {format_amount(new_balance / 100000)}."
+        else: # new_balance < 0
+            return f"💰 Balance: {to_user_name} owes {from_user_name} {format_amount(abs(new_balance) / 100000)}."
 
     def handle_confirm_settlement(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payload: str):
         try:
@@ -1920,48 +1962,41 @@ class Bot:
             self.bot.answer_callback_query(call.id, text="❗ Invalid callback data.", show_alert=True)
             return
 
-        with get_connection() as conn:
-            settlement = get_settlement(settlement_id)
-            if not settlement:
-                self.bot.answer_callback_query(call.id, text="❗ This settlement does not exist.", show_alert=True)
-                return
+        settlement = get_settlement(settlement_id)
+        if not settlement:
+            self.bot.answer_callback_query(call.id, text="❗ This settlement does not exist.", show_alert=True)
+            return
 
-            if settlement['to_user_id'] != user_id:
-                self.bot.answer_callback_query(call.id, text="❗ You are not authorized to confirm this settlement.", show_alert=True)
-                return
+        if settlement['to_user_id'] != user_id:
+            self.bot.answer_callback_query(call.id, text="❗ You are not authorized to confirm this settlement.", show_alert=True)
+            return
+
+        if settlement['status'] != 'pending':
+            self.bot.answer_callback_query(call.id, text="❗ This settlement is not pending.", show_alert=True)
+            return
 
-            if settlement['status'] != 'pending':
+        try:
+            if not confirm_settlement(settlement):
                 self.bot.answer_callback_query(call.id, text="❗ This settlement is not pending.", show_alert=True)
                 return
 
-            try:
-                update_settlement_status(settlement_id, 'confirmed')
-                upsert_debt(settlement['to_user_id'], settlement['from_user_id'], settlement['amount_u5'])
-                
-                settlement = get_settlement(settlement_id)
-                from_user_name = get_user_display_name(settlement['from_user_id'])
-                to_user_name = get_user_display_name(settlement['to_user_id'])
-                files = get_settlement_files(settlement_id)
-                text, keyboard = render_settlement_message(settlement, from_user_name, to_user_name, files)
+            settlement = get_settlement(settlement_id)
+            from_user_name = get_user_display_name(settlement['from_user_id'])
+            to_user_name = get_user_display_name(settlement['to_user_id'])
+            files = get_settlement_files(settlement_id)
+            text, keyboard = render_settlement_message(settlement, from_user_name, to_user_name, files)
 
-                self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
-                
-                self.bot.answer_callback_query(call.id, text="✅ Settlement confirmed!")
+            self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
+            
+            self.bot.answer_callback_query(call.id, text="✅ Settlement confirmed!")
 
-                # Show updated balance
-                new_balance = get_debt_between_users(settlement['from_user_id'], settlement['to_user_id'])
-                if new_balance == 0:
-                    balance_message = f"✅ {from_user_name} and {to_user_name} are now settled up."
-                elif new_balance > 0:
-                    balance_message = f"💰 Balance: {get_user_display_name(settlement['from_user_id'])} owes {get_user_display_name(settlement['to_user_id'])} {format_amount(new_balance / 100000)}."
-                else: # new_balance < 0
-                    balance_message = f"💰 Balance: {get_user_display_name(settlement['to_user_id'])} owes {get_user_display_name(settlement['from_user_id'])} {format_amount(abs(new_balance) / 100000)}."
-                
-                threading.Timer(1.0, self.bot.send_message, [chat_id, balance_message]).start()
+            # Show updated balance
+            balance_message = self.get_balance_message(chat_id, settlement['from_user_id'], settlement['to_user_id'])
+            schedule(1.0, submit_nowait, self.bot, "send_message", chat_id, balance_message)
 
-            except Exception as e:
-                logger.error(f"Error confirming settlement: {e}")
-                self.bot.answer_callback_query(call.id, text="❗ An error occurred while confirming the settlement.", show_alert=True)
+        except Exception as e:
+            logger.error(f"Error confirming settlement: {e}")
+            self.bot.answer_callback_query(call.id, text="❗ An error occurred while confirming the settlement.", show_alert=True)
 
     def handle_reject_settlement(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payload: str):
         try:
@@ -1970,36 +2005,35 @@ class Bot:
             self.bot.answer_callback_query(call.id, text="❗ Invalid callback data.", show_alert=True)
             return
 
-        with get_connection() as conn:
-            settlement = get_settlement(settlement_id)
-            if not settlement:
-                self.bot.answer_callback_query(call.id, text="❗ This settlement does not exist.", show_alert=True)
-                return
+        settlement = get_settlement(settlement_id)
+        if not settlement:
+            self.bot.answer_callback_query(call.id, text="❗ This settlement does not exist.", show_alert=True)
+            return
 
-            if settlement['to_user_id'] != user_id:
-                self.bot.answer_callback_query(call.id, text="❗ You are not authorized to reject this settlement.", show_alert=True)
-                return
+        if settlement['to_user_id'] != user_id:
+            self.bot.answer_callback_query(call.id, text="❗ You are not authorized to reject this settlement.", show_alert=True)
+            return
 
-            if settlement['status'] != 'pending':
-                self.bot.answer_callback_query(call.id, text="❗ This settlement is not pending.", show_alert=True)
-                return
+        if settlement['status'] != 'pending':
+            self.bot.answer_callback_query(call.id, text="❗ This settlement is not pending.", show_alert=True)
+            return
 
-            try:
-                update_settlement_status(settlement_id, 'rejected')
-                
-                settlement = get_settlement(settlement_id)
-                from_user_name = get_user_display_name(settlement['from_user_id'])
-                to_user_name = get_user_display_name(settlement['to_user_id'])
-                files = get_settlement_files(settlement_id)
-                text, keyboard = render_settlement_message(settlement, from_user_name, to_user_name, files)
+        try:
+            update_settlement_status(settlement_id, 'rejected')
+            
+            settlement = get_settlement(settlement_id)
+            from_user_name = get_user_display_name(settlement['from_user_id'])
+            to_user_name = get_user_display_name(settlement['to_user_id'])
+            files = get_settlement_files(settlement_id)
+            text, keyboard = render_settlement_message(settlement, from_user_name, to_user_name, files)
 
-                self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
-                
-                self.bot.answer_callback_query(call.id, text="❌ Settlement rejected!")
+            self.bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML')
+            
+            self.bot.answer_callback_query(call.id, text="❌ Settlement rejected!")
 
-            except Exception as e:
-                logger.error(f"Error rejecting settlement: {e}")
-                self.bot.answer_callback_query(call.id, text="❗ An error occurred while rejecting the settlement.", show_alert=True)
+        except Exception as e:
+            logger.error(f"Error rejecting settlement: {e}")
+            self.bot.answer_callback_query(call.id, text="❗ An error occurred while rejecting the settlement.", show_alert=True)
 
     def handle_delete_settlement(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payload: str):
         try:
@@ -2008,27 +2042,23 @@ class Bot:
             self.bot.answer_callback_query(call.id, text="❗ Invalid callback data.", show_alert=True)
             return
 
-        with get_connection() as conn:
-            settlement = get_settlement(settlement_id)
-            if not settlement:
-                self.bot.answer_callback_query(call.id, text="❗ This settlement does not exist.", show_alert=True)
-                return
+        settlement = get_settlement(settlement_id)
+        if not settlement:
+            self.bot.answer_callback_query(call.id, text="❗ This settlement does not exist.", show_alert=True)
+            return
 
-            if settlement['from_user_id'] != user_id:
-                self.bot.answer_callback_query(call.id, text="❗ You are not authorized to delete this settlement.", show_alert=True)
-                return
+        if settlement['from_user_id'] != user_id:
+            self.bot.answer_callback_query(call.id, text="❗ You are not authorized to delete this settlement.", show_alert=True)
+            return
 
-            files = get_settlement_files(settlement_id)
-            for file_info in files:
-                try:
-                    self.bot.delete_message(FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
-                except Exception as e:
-                    logger.error(f"Error deleting file from channel: {e}")
-                delete_file_by_id(file_info['file_row_id'])
+        files = get_settlement_files(settlement_id)
+        for file_info in files:
+            self.delete_message(FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
+            delete_file_by_id(file_info['file_row_id'])
 
-            delete_settlement(settlement_id)
-            self.bot.delete_message(chat_id, call.message.message_id)
-            self.bot.answer_callback_query(call.id, text="✅ Settlement deleted!")
+        delete_settlement(settlement_id)
+        self.delete_message(chat_id, call.message.message_id)
+        self.bot.answer_callback_query(call.id, text="✅ Settlement deleted!")
 
     def handle_edit_settlement(self, call: telebot.types.CallbackQuery, chat_id: int, user_id: int, payload: str):
         try:
@@ -2062,7 +2092,7 @@ class Bot:
         delete_settlement(settlement_id)
 
         # Delete the old settlement message
-        self.bot.delete_message(chat_id, call.message.message_id)
+        self.delete_message(chat_id, call.message.message_id)
 
         # Start the wizard
         wizard_text, wizard_keyboard = render_wizard(
@@ -0,0 +1,208 @@
+"""asyncio runtime for the bot, built on AsyncTeleBot.
+
+Updates are received and Telegram calls are made on one event loop. The
+existing synchronous handlers of Bot run unchanged on its chat shards and
+get an AsyncBotFacade as their `bot`. The facade's TeleBot-style methods
+schedule the call on the loop and wait for it. A busy process therefore
+holds a fixed number of threads (CHAT_SHARDS plus ASYNC_HANDLER_WORKERS),
+however many chats are active. Sends, edits and deletes pass through an
+AsyncOutboundDispatcher, with the same rate limits as RateLimitedTeleBot.
+
+Hot paths can be ported to native coroutines that await Telegram calls
+concurrently and only send their repo work to the pool; confirming a
+settlement is the first.
+"""
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import telebot
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from bot.app import Bot
+from bot.config import (
+    ASYNC_HANDLER_WORKERS,
+    BOT_TOKEN,
+    CHAT_SHARDS,
+    DB_POOL_SIZE,
+    SCHEDULER_WORKERS,
+    TELEGRAM_API_URL,
+    TELEGRAM_CHAT_RATE_PER_MINUTE,
+    TELEGRAM_GLOBAL_RATE_PER_SECOND,
+    TELEGRAM_MAX_RETRIES,
+)
+from bot.db.repos import (
+    add_user_to_group_if_not_exists,
+    create_user_if_not_exists,
+    get_group_settings,
+    get_settlement,
+    get_settlement_files,
+    get_user_display_name,
+    update_group_last_activity,
+)
+from bot.logger import get_logger
+from bot.outbound import ROUTED_METHODS, AsyncOutboundDispatcher, route_call
+from bot.services.accounting import confirm_settlement
+from bot.ui.renderers import render_settlement_message
+
+logger = get_logger(__name__)
+
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL
+
+CONFIRM_SETTLEMENT_PREFIX = "dm:confirm_settlement:"
+
+def _to_sync_exception(error: asyncio_helper.ApiTelegramException) -> telebot.apihelper.ApiTelegramException:
+    # The handlers catch the sync exception class; the async one is unrelated to it.
+    return telebot.apihelper.ApiTelegramException(error.function_name, error.result, error.result_json)
+
+class AsyncBotFacade:
+    """Synchronous TeleBot-like view of an AsyncTeleBot, for handlers running in the pool.
+
+    Coroutine methods block the calling thread until the loop has finished
+    the call. Handler registration wraps the synchronous callbacks so they
+    run in the pool.
+    """
+
+    def __init__(self, async_bot: AsyncTeleBot, loop: asyncio.AbstractEventLoop, executor: ThreadPoolExecutor, outbound: AsyncOutboundDispatcher):
+        self.async_bot = async_bot
+        self.loop = loop
+        self.executor = executor
+        self.outbound = outbound
+        # Created on the loop's thread, which must never wait on the loop
+        self.loop_thread = threading.current_thread()
+
+    async def call(self, method_name: str, /, *args, **kwargs):
+        """Awaits a Telegram call; sends, edits and deletes wait for the outbound rate limits."""
+        method = getattr(self.async_bot, method_name)
+        try:
+            if method_name not in ROUTED_METHODS:
+                return await method(*args, **kwargs)
+            priority, chat_id, limit_chat = route_call(method_name, args, kwargs)
+            return await self.outbound.call(priority, chat_id, limit_chat, method, *args, **kwargs)
+        except asyncio_helper.ApiTelegramException as e:
+            raise _to_sync_exception(e) from e
+
+    def submit(self, method_name: str, /, *args, **kwargs) -> Future:
+        """Schedules a Telegram call on the loop and returns a Future for its result."""
+        return asyncio.run_coroutine_threadsafe(self.call(method_name, *args, **kwargs), self.loop)
+
+    def __getattr__(self, name):
+        method = getattr(self.async_bot, name)
+        if not inspect.iscoroutinefunction(method):
+            return method
+
+        def call(*args, **kwargs):
+            if threading.current_thread() is self.loop_thread:
+                raise RuntimeError(f"{name} would block the event loop; await the AsyncTeleBot method instead.")
+            return self.submit(name, *args, **kwargs).result()
+        return call
+
+    def _in_executor(self, callback):
+        async def handler(update):
+            await self.loop.run_in_executor(self.executor, callback, update)
+        return handler
+
+    def register_message_handler(self, callback, **kwargs):
+        self.async_bot.register_message_handler(self._in_executor(callback), **kwargs)
+
+    def register_callback_query_handler(self, callback, **kwargs):
+        self.async_bot.register_callback_query_handler(self._in_executor(callback), **kwargs)
+
+class AsyncBot:
+    def __init__(self, token: str, workers: int):
+        self.async_bot = AsyncTeleBot(token)
+        # Every handler worker, chat shard and scheduler worker may hold a pooled
+        # connection, and so may the records cleanup thread and the writer
+        pool_budget = max(DB_POOL_SIZE - CHAT_SHARDS - SCHEDULER_WORKERS - 2, 1)
+        if workers > pool_budget:
+            logger.warning(f"ASYNC_HANDLER_WORKERS={workers} exceeds what DB_POOL_SIZE={DB_POOL_SIZE} leaves after {CHAT_SHARDS} chat shard(s), {SCHEDULER_WORKERS} scheduler worker(s), the cleanup thread and the writer; using {pool_budget}.")
+            workers = pool_budget
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self.outbound = AsyncOutboundDispatcher(TELEGRAM_GLOBAL_RATE_PER_SECOND, TELEGRAM_CHAT_RATE_PER_MINUTE, TELEGRAM_MAX_RETRIES)
+        self.facade = None
+        self.sync_bot = None
+
+    async def run_db(self, func, *args):
+        """Runs blocking repo work in the handler pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _confirm_settlement_work(self, call: telebot.types.CallbackQuery, settlement_id: int):
+        """Repo side of confirming a settlement; returns (alert text, None) or (None, result)."""
+        chat_id = call.message.chat.id
+        update_group_last_activity.submit(chat_id)
+        user_id = create_user_if_not_exists(call.from_user.id, call.from_user.username, call.from_user.full_name)
+        add_user_to_group_if_not_exists(user_id, chat_id)
+        if user_id in get_group_settings(chat_id).get('excluded_members', []):
+            return "", None
+
+        settlement = get_settlement(settlement_id)
+        if not settlement:
+            return "❗ This settlement does not exist.", None
+        if settlement['to_user_id'] != user_id:
+            return "❗ You are not authorized to confirm this settlement.", None
+        if settlement['status'] != 'pending':
+            return "❗ This settlement is not pending.", None
+
+        if not confirm_settlement(settlement):
+            return "❗ This settlement is not pending.", None
+        settlement = get_settlement(settlement_id)
+        from_user_name = get_user_display_name(settlement['from_user_id'])
+        to_user_name = get_user_display_name(settlement['to_user_id'])
+        text, keyboard = render_settlement_message(settlement, from_user_name, to_user_name, get_settlement_files(settlement_id))
+        balance_message = self.sync_bot.get_balance_message(chat_id, settlement['from_user_id'], settlement['to_user_id'])
+        return None, (text, keyboard, balance_message)
+
+    async def handle_confirm_settlement(self, call: telebot.types.CallbackQuery):
+        if call.message.chat.type == 'private':
+            await self.facade.call("answer_callback_query", call.id, text="I only work in group chats.", show_alert=True)
+            return
+        try:
+            settlement_id = int(call.data[len(CONFIRM_SETTLEMENT_PREFIX):])
+        except ValueError:
+            await self.facade.call("answer_callback_query", call.id, text="❗ Invalid callback data.", show_alert=True)
+            return
+
+        chat_id = call.message.chat.id
+        try:
+            alert, result = await self.run_db(self._confirm_settlement_work, call, settlement_id)
+            if result is None:
+                await self.facade.call("answer_callback_query", call.id, text=alert or None, show_alert=bool(alert))
+                return
+        except Exception as e:
+            logger.error(f"Error confirming settlement: {e}")
+            await self.facade.call("answer_callback_query", call.id, text="❗ An error occurred while confirming the settlement.", show_alert=True)
+            return
+
+        # The callback is answered in here, so a failed edit or send is only logged
+        text, keyboard, balance_message = result
+        results = await asyncio.gather(
+            self.facade.call("edit_message_text", chat_id=chat_id, message_id=call.message.message_id, text=text, reply_markup=keyboard, parse_mode='HTML'),
+            self.facade.call("answer_callback_query", call.id, text="✅ Settlement confirmed!"),
+            self.facade.call("send_message", chat_id, balance_message),
+            return_exceptions=True,
+        )
+        for error in results:
+            if isinstance(error, Exception):
+                logger.error(f"Error updating chat {chat_id} after confirming settlement {settlement_id}: {error}")
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.facade = facade = AsyncBotFacade(self.async_bot, loop, self.executor, self.outbound)
+
+        # Registered before the Bot handlers so it wins over the generic dm: router
+        self.async_bot.register_callback_query_handler(self.handle_confirm_settlement, func=lambda call: call.data.startswith(CONFIRM_SETTLEMENT_PREFIX))
+        # Bot's constructor makes Telegram calls through the facade, so it has to run off the loop
+        self.sync_bot = await loop.run_in_executor(self.executor, Bot, facade)
+        await loop.run_in_executor(self.executor, self.sync_bot.start_background_tasks)
+
+        await self.async_bot.remove_webhook()
+        logger.info(f"Starting async bot polling with {self.workers} handler worker(s)...")
+        try:
+            await self.async_bot.infinity_polling()
+        finally:
+            await self.async_bot.close_session()
+
+def run() -> None:
+    asyncio.run(AsyncBot(BOT_TOKEN, ASYNC_HANDLER_WORKERS).run())
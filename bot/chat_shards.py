@@ -0,0 +1,105 @@
+"""Per-chat sharded execution of update handlers.
+
+Every chat is mapped to one of a fixed number of shards, and each shard
+has one worker thread. Updates from the same chat are therefore handled one
+at a time and in order, and different chats are handled in parallel. A slow
+upload in one group only holds up the groups that share its shard.
+
+Shard queues are bounded. When a shard is full, submit() blocks the
+thread that receives updates until the shard catches up. In webhook mode
+the webhook queue then fills and the server answers 503, so Telegram
+retries later instead of the backlog growing in memory.
+"""
+import queue
+import threading
+import time
+import telebot
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+def update_chat_id(update) -> int | None:
+    """Chat a message or callback query belongs to."""
+    if isinstance(update, telebot.types.CallbackQuery):
+        return update.message.chat.id if update.message else update.from_user.id
+    chat = getattr(update, "chat", None)
+    return chat.id if chat is not None else None
+
+class _Shard:
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.metrics = {
+            "submitted": 0,
+            "processed": 0,
+            "failed": 0,
+            "queue_depth_max": 0,
+            "full": 0,
+            "blocked_seconds_total": 0.0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "busy_seconds_total": 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name=f"chat-shard-{index}", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            func, args, queued_at = self.queue.get()
+            started = time.monotonic()
+            failed = False
+            try:
+                func(*args)
+            except Exception as e:
+                failed = True
+                logger.error(f"Error in {getattr(func, '__name__', func)} on chat shard {self.index}: {e}", exc_info=True)
+            finished = time.monotonic()
+            with self.lock:
+                self.metrics["failed" if failed else "processed"] += 1
+                self.metrics["wait_seconds_total"] += started - queued_at
+                self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], started - queued_at)
+                self.metrics["busy_seconds_total"] += finished - started
+
+class ChatShardedExecutor:
+    def __init__(self, shards: int, queue_size: int):
+        self._shards = [_Shard(i, queue_size) for i in range(shards)]
+        logger.info(f"Chat shard executor started with {shards} shard(s) of up to {queue_size} queued update(s).")
+
+    def submit(self, chat_id: int | None, func, *args) -> None:
+        """Queues func(*args) on the shard that owns chat_id, waiting while the shard is full."""
+        shard = self._shards[hash(chat_id) % len(self._shards)]
+        blocked_seconds = 0.0
+        try:
+            shard.queue.put_nowait((func, args, time.monotonic()))
+        except queue.Full:
+            started = time.monotonic()
+            shard.queue.put((func, args, started))
+            blocked_seconds = time.monotonic() - started
+        depth = shard.queue.qsize()
+        with shard.lock:
+            shard.metrics["submitted"] += 1
+            if blocked_seconds:
+                shard.metrics["full"] += 1
+                shard.metrics["blocked_seconds_total"] += blocked_seconds
+            shard.metrics["queue_depth_max"] = max(shard.metrics["queue_depth_max"], depth)
+
+    def wrap(self, handler):
+        """Returns a telebot handler that queues handler(update) on the update's shard."""
+        def dispatch(update):
+            self.submit(update_chat_id(update), handler, update)
+        dispatch.__name__ = getattr(handler, "__name__", "dispatch")
+        return dispatch
+
+    def get_metrics(self) -> list[dict]:
+        """One dict per shard."""
+        metrics = []
+        for shard in self._shards:
+            with shard.lock:
+                shard_metrics = dict(shard.metrics)
+            shard_metrics["shard"] = shard.index
+            shard_metrics["queue_depth"] = shard.queue.qsize()
+            handled = shard_metrics["processed"] + shard_metrics["failed"]
+            shard_metrics["wait_seconds_avg"] = shard_metrics["wait_seconds_total"] / handled if handled else 0.0
+            metrics.append(shard_metrics)
+        return metrics
@@ -12,3 +12,34 @@ REJECTED_TTL_SECONDS = int(os.environ.get('REJECTED_TTL_SECONDS', 3600))
 PENDING_TTL_SECONDS = int(os.environ.get('PENDING_TTL_SECONDS', 86400))
 CURRENCY = os.environ.get("CURRENCY", "UZS")
 DB_TIMEZONE_OFFSET = os.environ.get('DB_TIMEZONE_OFFSET', '+5 hours')
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 16))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 10))
+DB_CONN_MAX_AGE_SECONDS = int(os.environ.get("DB_CONN_MAX_AGE_SECONDS", 3600))
+DB_WRITE_BATCH_MAX = int(os.environ.get("DB_WRITE_BATCH_MAX", 64))
+DB_WRITE_TIMEOUT_SECONDS = float(os.environ.get("DB_WRITE_TIMEOUT_SECONDS", 30))
+DEBT_SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get("DEBT_SNAPSHOT_INTERVAL_SECONDS", 86400))
+LEDGER_VERIFY_BATCH_SIZE = int(os.environ.get("LEDGER_VERIFY_BATCH_SIZE", 1000))
+BALANCE_CACHE_MAX_CHATS = int(os.environ.get("BALANCE_CACHE_MAX_CHATS", 1024))
+BALANCE_CACHE_RECHECK_SECONDS = float(os.environ.get("BALANCE_CACHE_RECHECK_SECONDS", 30))
+CHAT_TITLE_TTL_SECONDS = int(os.environ.get("CHAT_TITLE_TTL_SECONDS", 86400))
+BOT_MODE = os.environ.get("BOT_MODE", "polling")  # polling|webhook
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000))
+TELEGRAM_GLOBAL_RATE_PER_SECOND = float(os.environ.get("TELEGRAM_GLOBAL_RATE_PER_SECOND", 30))
+TELEGRAM_CHAT_RATE_PER_MINUTE = float(os.environ.get("TELEGRAM_CHAT_RATE_PER_MINUTE", 20))
+TELEGRAM_OUTBOUND_WORKERS = int(os.environ.get("TELEGRAM_OUTBOUND_WORKERS", 4))
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", 5))
+# Bot API endpoint format, e.g. http://127.0.0.1:8081/bot{0}/{1} for bot/testing/fake_bot_api.py; empty means api.telegram.org
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "")
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", 4))
+ASYNC_HANDLER_WORKERS = int(os.environ.get("ASYNC_HANDLER_WORKERS", 2))
+CHAT_SHARDS = int(os.environ.get("CHAT_SHARDS", 8))
+CHAT_SHARD_QUEUE_SIZE = int(os.environ.get("CHAT_SHARD_QUEUE_SIZE", 100))
+EDIT_DEBOUNCE_SECONDS = float(os.environ.get("EDIT_DEBOUNCE_SECONDS", 0.7))
+ALBUM_QUIET_SECONDS = float(os.environ.get("ALBUM_QUIET_SECONDS", 1.0))
+ALBUM_MAX_WAIT_SECONDS = float(os.environ.get("ALBUM_MAX_WAIT_SECONDS", 10))
+ALBUM_MAX_PENDING = int(os.environ.get("ALBUM_MAX_PENDING", 1000))
@@ -1,24 +1,256 @@
-
 import sqlite3
 import contextlib
-from bot.config import DB_PATH
-from bot.db.migrations import run_migrations
+import contextvars
+import itertools
+import queue
+import threading
+import time
+from bot.config import DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT_SECONDS, DB_CONN_MAX_AGE_SECONDS
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Per-connection cache of compiled statements. Repo queries are static strings,
+# so a warm connection skips re-preparing them.
+STATEMENT_CACHE_SIZE = 256
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection that remembers when it was opened."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened_at = time.monotonic()
+
+class ConnectionPool:
+    """A bounded pool of SQLite connections shared by all bot threads.
+
+    PRAGMAs run once when a connection is opened. Idle connections are handed
+    out most-recently-used first, health-checked on checkout and recycled once
+    they are older than max_age seconds.
+    """
+
+    def __init__(self, db_path: str, max_size: int, timeout: float, max_age: float):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "checkouts": 0,
+            "checkout_timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "opened": 0,
+            "recycled": 0,
+            "in_use": 0,
+        }
+
+    def _connect(self) -> PooledConnection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=10,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=PooledConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        with self._metrics_lock:
+            self._metrics["opened"] += 1
+        return conn
+
+    def _is_healthy(self, conn: PooledConnection) -> bool:
+        if time.monotonic() - conn.opened_at > self.max_age:
+            return False
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return not conn.in_transaction
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: PooledConnection) -> None:
+        with self._metrics_lock:
+            self._metrics["recycled"] += 1
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Error closing recycled connection to {self.db_path}: {e}")
+
+    def acquire(self) -> PooledConnection:
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._metrics_lock:
+                self._metrics["checkout_timeouts"] += 1
+            raise sqlite3.OperationalError(f"Timed out after {self.timeout}s waiting for a connection to {self.db_path}.")
+        waited = time.perf_counter() - started
+
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    candidate = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                    break
+                if self._is_healthy(candidate):
+                    conn = candidate
+                else:
+                    self._discard(candidate)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._metrics_lock:
+            self._metrics["checkouts"] += 1
+            self._metrics["in_use"] += 1
+            self._metrics["wait_seconds_total"] += waited
+            self._metrics["wait_seconds_max"] = max(self._metrics["wait_seconds_max"], waited)
+        return conn
+
+    def release(self, conn: PooledConnection, broken: bool = False) -> None:
+        try:
+            if broken:
+                self._discard(conn)
+            else:
+                self._idle.put(conn)
+        finally:
+            with self._metrics_lock:
+                self._metrics["in_use"] -= 1
+            self._slots.release()
+
+    def get_metrics(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["idle"] = self._idle.qsize()
+        metrics["max_size"] = self.max_size
+        metrics["wait_seconds_avg"] = metrics["wait_seconds_total"] / metrics["checkouts"] if metrics["checkouts"] else 0.0
+        return metrics
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path=None) -> ConnectionPool:
+    path_to_use = db_path if db_path else DB_PATH
+    with _pools_lock:
+        pool = _pools.get(path_to_use)
+        if pool is None:
+            pool = ConnectionPool(path_to_use, DB_POOL_SIZE, DB_POOL_TIMEOUT_SECONDS, DB_CONN_MAX_AGE_SECONDS)
+            _pools[path_to_use] = pool
+        return pool
+
+def get_pool_metrics(db_path=None) -> dict:
+    return get_pool(db_path).get_metrics()
+
+# Connection of the unit of work running in the current thread/context, if any.
+_current_connection = contextvars.ContextVar("current_connection", default=None)
+# Callbacks to run once that unit of work has committed.
+_commit_callbacks = contextvars.ContextVar("commit_callbacks", default=None)
+_savepoint_ids = itertools.count(1)
+
+def in_transaction() -> bool:
+    return _current_connection.get() is not None
+
+def on_commit(callback) -> None:
+    """Runs callback after the enclosing transaction commits, or right away outside one.
+
+    Callbacks registered inside a savepoint that is rolled back are dropped.
+    """
+    callbacks = _commit_callbacks.get()
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+def _run_commit_callbacks(callbacks: list) -> None:
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Error in on_commit callback {callback!r}: {e}", exc_info=True)
+
+@contextlib.contextmanager
+def transaction(db_path=None) -> sqlite3.Connection:
+    """Runs the enclosed block as a single unit of work.
+
+    Repo functions called inside the block join this transaction instead of
+    committing on their own, so everything is applied with one commit or not at
+    all. A nested transaction() becomes a savepoint of the outer one.
+    """
+    ambient = _current_connection.get()
+    if ambient is not None:
+        savepoint = f"sp_{next(_savepoint_ids)}"
+        callbacks = _commit_callbacks.get()
+        registered = len(callbacks)
+        ambient.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield ambient
+        except Exception:
+            del callbacks[registered:]
+            ambient.execute(f"ROLLBACK TO {savepoint}")
+            ambient.execute(f"RELEASE {savepoint}")
+            raise
+        ambient.execute(f"RELEASE {savepoint}")
+        return
+
+    pool = get_pool(db_path)
+    conn = pool.acquire()
+    token = _current_connection.set(conn)
+    callbacks = []
+    callbacks_token = _commit_callbacks.set(callbacks)
+    broken = False
+    try:
+        # Take the write lock up front; upgrading a deferred read transaction
+        # later can fail with SQLITE_BUSY without waiting for the timeout.
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except Exception as e:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            broken = True
+        raise e
+    finally:
+        _commit_callbacks.reset(callbacks_token)
+        _current_connection.reset(token)
+        pool.release(conn, broken=broken)
+    _run_commit_callbacks(callbacks)
 
 @contextlib.contextmanager
 def get_connection(db_path=None) -> sqlite3.Connection:
-    """Establishes a connection to the SQLite database."""
-    path_to_use = db_path if db_path else DB_PATH
-    conn = sqlite3.connect(path_to_use, timeout=10)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA journal_mode = WAL;")
-    conn.execute("PRAGMA synchronous = NORMAL;")
-    run_migrations(conn)
+    """Checks a connection out of the pool and commits or rolls back on exit.
+
+    Inside a transaction() block the ambient connection is returned instead and
+    committing is left to the enclosing unit of work.
+    """
+    ambient = _current_connection.get()
+    if ambient is not None:
+        yield ambient
+        return
+
+    pool = get_pool(db_path)
+    conn = pool.acquire()
+    broken = False
     try:
         yield conn
         conn.commit()
     except Exception as e:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            broken = True
         raise e
     finally:
-        conn.close()
+        pool.release(conn, broken=broken)
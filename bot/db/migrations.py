@@ -1,13 +1,12 @@
 import sqlite3
+import time
 from bot.config import DB_TIMEZONE_OFFSET
+from bot.logger import get_logger
 
-def run_migrations(conn: sqlite3.Connection):
-    cursor = conn.cursor()
-
-    # Migration 001: Initial schema
-    cursor.executescript(f"""
-        PRAGMA foreign_keys = ON;
+logger = get_logger(__name__)
 
+# Migration 001: Initial schema
+MIGRATION_001_INITIAL_SCHEMA = f"""
         CREATE TABLE IF NOT EXISTS groups (
           chat_id INTEGER PRIMARY KEY,
           menu_message_id INTEGER,
@@ -135,6 +134,478 @@ def run_migrations(conn: sqlite3.Connection):
           size INTEGER,
           FOREIGN KEY(uploader_user_id) REFERENCES users(id)
         );
+"""
+
+# Migration 002: Indexes for the history, cleanup and draft-expiry queries
+MIGRATION_002_HOT_QUERY_INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_expenses_chat_created ON expenses(chat_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_settlements_chat_status_created ON settlements(chat_id, status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_settlements_status_created ON settlements(status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_settlements_status_status_at ON settlements(status, status_at);
+        CREATE INDEX IF NOT EXISTS idx_expense_debtors_status_status_at ON expense_debtors(status, status_at);
+        CREATE INDEX IF NOT EXISTS idx_drafts_expires_at ON drafts(expires_at);
+        CREATE INDEX IF NOT EXISTS idx_files_related ON files(related_type, related_id);
+"""
+
+# Migration 003: Maintained expense status so reports don't have to look for
+# pending debtors. Kept in sync by the expense repo functions.
+MIGRATION_003_EXPENSE_STATUS = """
+        ALTER TABLE expenses ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'; -- pending|confirmed|rejected
+
+        UPDATE expenses SET status = CASE
+            WHEN rejected = 1 THEN 'rejected'
+            WHEN EXISTS (SELECT 1 FROM expense_debtors ed WHERE ed.expense_id = expenses.id AND ed.status = 'pending') THEN 'pending'
+            ELSE 'confirmed'
+        END;
+
+        CREATE INDEX IF NOT EXISTS idx_expenses_chat_status_created ON expenses(chat_id, status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_expenses_status_created ON expenses(status, created_at);
+"""
+
+# Migration 004: Indexed copy of draft data_json.wizard_message_id, used to
+# find the owner of a wizard message on every callback.
+MIGRATION_004_DRAFT_WIZARD_MESSAGE_ID = """
+        ALTER TABLE drafts ADD COLUMN wizard_message_id INTEGER;
+
+        UPDATE drafts SET wizard_message_id = json_extract(data_json, '$.wizard_message_id');
+
+        CREATE INDEX IF NOT EXISTS idx_drafts_chat_wizard_message ON drafts(chat_id, wizard_message_id);
+"""
+
+# Migration 005: Debts keyed by chat. The old table only knew user pairs, so
+# balances of users sharing several groups were merged across chats.
+MIGRATION_005_CHAT_SCOPED_DEBTS_TABLE = f"""
+        CREATE TABLE debts_by_chat (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          chat_id INTEGER NOT NULL,
+          from_user_id INTEGER NOT NULL,
+          to_user_id INTEGER NOT NULL,
+          amount_u5 INTEGER NOT NULL DEFAULT 0, -- Scaled by 100,000 to avoid floating point errors
+          updated_at TEXT DEFAULT (datetime('now', '{DB_TIMEZONE_OFFSET}')),
+          UNIQUE(chat_id, from_user_id, to_user_id),
+          FOREIGN KEY(chat_id) REFERENCES groups(chat_id),
+          FOREIGN KEY(from_user_id) REFERENCES users(id),
+          FOREIGN KEY(to_user_id) REFERENCES users(id)
+        )
+"""
+
+def _add_pair_amount(nets: dict, chat_id: int, from_user_id: int, to_user_id: int, amount_u5: int) -> None:
+    # Nets are kept per unordered pair; positive means the lower user id owes the higher one.
+    if from_user_id == to_user_id:
+        return
+    if from_user_id < to_user_id:
+        key, signed = (chat_id, from_user_id, to_user_id), amount_u5
+    else:
+        key, signed = (chat_id, to_user_id, from_user_id), -amount_u5
+    nets[key] = nets.get(key, 0) + signed
+
+def migrate_chat_scoped_debts(conn: sqlite3.Connection) -> None:
+    """Rebuilds debts per chat from confirmed expenses and settlements.
+
+    Whatever the replay does not explain (e.g. manually cleared debts) is the
+    residual between the old pair totals and the replayed ones. It is booked in
+    the group the pair shares, or the most recently active one if they share
+    several.
+    """
+    nets = {}
+    for row in conn.execute("""
+        SELECT e.chat_id, ed.debtor_id, e.payer_id, ed.share_u5
+        FROM expenses e JOIN expense_debtors ed ON ed.expense_id = e.id
+        WHERE e.status = 'confirmed'
+    """):
+        _add_pair_amount(nets, row[0], row[1], row[2], row[3])
+    # A confirmed settlement credits the payer: it is a debt from the payee back to them.
+    for row in conn.execute("SELECT chat_id, to_user_id, from_user_id, amount_u5 FROM settlements WHERE status = 'confirmed'"):
+        _add_pair_amount(nets, row[0], row[1], row[2], row[3])
+
+    old_totals = {}
+    for row in conn.execute("SELECT from_user_id, to_user_id, amount_u5 FROM debts"):
+        _add_pair_amount(old_totals, None, row[0], row[1], row[2])
+    replayed_totals = {}
+    for (chat_id, user_lo, user_hi), amount_u5 in nets.items():
+        replayed_totals[(None, user_lo, user_hi)] = replayed_totals.get((None, user_lo, user_hi), 0) + amount_u5
+
+    for key in old_totals.keys() | replayed_totals.keys():
+        residual = old_totals.get(key, 0) - replayed_totals.get(key, 0)
+        if residual == 0:
+            continue
+        _, user_lo, user_hi = key
+        shared_chats = conn.execute("""
+            SELECT g.chat_id FROM groups g
+            JOIN group_users a ON a.chat_id = g.chat_id AND a.user_id = ?
+            JOIN group_users b ON b.chat_id = g.chat_id AND b.user_id = ?
+            ORDER BY g.last_activity_at DESC
+        """, (user_lo, user_hi)).fetchall()
+        if not shared_chats:
+            logger.warning(f"Dropping debt residual {residual} between users {user_lo} and {user_hi}: they share no group.")
+            continue
+        if len(shared_chats) > 1:
+            logger.warning(f"Users {user_lo} and {user_hi} share {len(shared_chats)} groups; booking debt residual {residual} in the most recently active one ({shared_chats[0][0]}).")
+        _add_pair_amount(nets, shared_chats[0][0], user_lo, user_hi, residual)
+
+    # Plain execute() keeps the DDL inside the migration's transaction;
+    # executescript() would commit it first.
+    conn.execute(MIGRATION_005_CHAT_SCOPED_DEBTS_TABLE)
+    rows = []
+    for (chat_id, user_lo, user_hi), amount_u5 in nets.items():
+        if amount_u5 > 0:
+            rows.append((chat_id, user_lo, user_hi, amount_u5))
+        elif amount_u5 < 0:
+            rows.append((chat_id, user_hi, user_lo, -amount_u5))
+    conn.executemany("INSERT INTO debts_by_chat (chat_id, from_user_id, to_user_id, amount_u5) VALUES (?, ?, ?, ?)", rows)
+    conn.execute("DROP TABLE debts")
+    conn.execute("ALTER TABLE debts_by_chat RENAME TO debts")
+    conn.execute("CREATE INDEX idx_debts_chat_to_user ON debts(chat_id, to_user_id)")
+    logger.info(f"Rebuilt {len(rows)} chat-scoped debt(s).")
+
+# Migration 006: Append-only journal of debt movements, plus periodic
+# snapshots of the materialized debts so replays can start from a checkpoint.
+MIGRATION_006_DEBT_JOURNAL_TABLES = [
+    f"""
+        CREATE TABLE IF NOT EXISTS debt_journal (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          chat_id INTEGER NOT NULL,
+          from_user_id INTEGER NOT NULL,
+          to_user_id INTEGER NOT NULL,
+          amount_u5 INTEGER NOT NULL,
+          source_type TEXT NOT NULL, -- expense|settlement|settlement_cycle|clear_debt|migration
+          source_id INTEGER,
+          created_at TEXT DEFAULT (datetime('now', '{DB_TIMEZONE_OFFSET}'))
+        )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_debt_journal_chat_id ON debt_journal(chat_id, id)",
+    f"""
+        CREATE TABLE IF NOT EXISTS debt_snapshots (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          chat_id INTEGER NOT NULL,
+          journal_id INTEGER NOT NULL, -- last debt_journal entry included
+          created_at TEXT DEFAULT (datetime('now', '{DB_TIMEZONE_OFFSET}'))
+        )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_debt_snapshots_chat_journal ON debt_snapshots(chat_id, journal_id)",
+    """
+        CREATE TABLE IF NOT EXISTS debt_snapshot_balances (
+          snapshot_id INTEGER NOT NULL,
+          from_user_id INTEGER NOT NULL,
+          to_user_id INTEGER NOT NULL,
+          amount_u5 INTEGER NOT NULL,
+          PRIMARY KEY(snapshot_id, from_user_id, to_user_id),
+          FOREIGN KEY(snapshot_id) REFERENCES debt_snapshots(id) ON DELETE CASCADE
+        )
+    """,
+]
+
+def migrate_debt_journal(conn: sqlite3.Connection) -> None:
+    """Creates the journal and seeds it from the confirmed history.
+
+    Entries the history does not explain (e.g. manual clears made before the
+    journal existed) are added as 'migration' entries, so replaying the
+    journal gives exactly the current debts.
+    """
+    for statement in MIGRATION_006_DEBT_JOURNAL_TABLES:
+        conn.execute(statement)
+
+    # Entries are dated when the debt became effective: an expense when its last
+    # debtor confirmed, a settlement when it was confirmed. Those status times are
+    # stored in UTC, while created_at and the journal use DB_TIMEZONE_OFFSET.
+    conn.execute("""
+        INSERT INTO debt_journal (chat_id, from_user_id, to_user_id, amount_u5, source_type, source_id, created_at)
+        SELECT chat_id, from_user_id, to_user_id, amount_u5, source_type, source_id, created_at FROM (
+            SELECT e.chat_id, ed.debtor_id AS from_user_id, e.payer_id AS to_user_id, ed.share_u5 AS amount_u5,
+                   'expense' AS source_type, e.id AS source_id, COALESCE(datetime(c.confirmed_at, ?), e.created_at) AS created_at
+            FROM expenses e
+            JOIN expense_debtors ed ON ed.expense_id = e.id
+            JOIN (SELECT expense_id, MAX(status_at) AS confirmed_at FROM expense_debtors GROUP BY expense_id) c ON c.expense_id = e.id
+            WHERE e.status = 'confirmed' AND ed.debtor_id != e.payer_id
+            UNION ALL
+            SELECT chat_id, to_user_id, from_user_id, amount_u5,
+                   'settlement', id, COALESCE(datetime(COALESCE(confirmed_at, status_at), ?), created_at)
+            FROM settlements
+            WHERE status = 'confirmed' AND from_user_id != to_user_id
+        )
+        ORDER BY created_at, source_type, source_id
+    """, (DB_TIMEZONE_OFFSET, DB_TIMEZONE_OFFSET))
+
+    replayed = {}
+    for row in conn.execute("SELECT chat_id, from_user_id, to_user_id, amount_u5 FROM debt_journal"):
+        _add_pair_amount(replayed, row[0], row[1], row[2], row[3])
+    current = {}
+    for row in conn.execute("SELECT chat_id, from_user_id, to_user_id, amount_u5 FROM debts"):
+        _add_pair_amount(current, row[0], row[1], row[2], row[3])
+
+    rows = []
+    for key in current.keys() | replayed.keys():
+        residual = current.get(key, 0) - replayed.get(key, 0)
+        chat_id, user_lo, user_hi = key
+        if residual > 0:
+            rows.append((chat_id, user_lo, user_hi, residual))
+        elif residual < 0:
+            rows.append((chat_id, user_hi, user_lo, -residual))
+    conn.executemany("""
+        INSERT INTO debt_journal (chat_id, from_user_id, to_user_id, amount_u5, source_type)
+        VALUES (?, ?, ?, ?, 'migration')
+    """, rows)
+    logger.info(f"Seeded the debt journal with {len(rows)} migration entries on top of the confirmed history.")
+
+# Migration 007: Per-group counter bumped on every debt write, so derived
+# views of a group's debts can be cached until the ledger changes.
+MIGRATION_007_LEDGER_VERSION = """
+        ALTER TABLE groups ADD COLUMN ledger_version INTEGER NOT NULL DEFAULT 0;
+"""
+
+# Migration 008: One signed amount per canonical (user_lo, user_hi) pair, so
+# netting a debt is a single upsert. The old shape stays readable through the
+# debts view.
+MIGRATION_008_CANONICAL_DEBT_PAIRS = f"""
+        CREATE TABLE debt_pairs (
+          chat_id INTEGER NOT NULL,
+          user_lo INTEGER NOT NULL,
+          user_hi INTEGER NOT NULL,
+          amount_u5 INTEGER NOT NULL DEFAULT 0, -- > 0: user_lo owes user_hi, < 0: user_hi owes user_lo
+          updated_at TEXT DEFAULT (datetime('now', '{DB_TIMEZONE_OFFSET}')),
+          PRIMARY KEY (chat_id, user_lo, user_hi),
+          CHECK (user_lo < user_hi),
+          FOREIGN KEY(chat_id) REFERENCES groups(chat_id),
+          FOREIGN KEY(user_lo) REFERENCES users(id),
+          FOREIGN KEY(user_hi) REFERENCES users(id)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_debt_pairs_chat_user_hi ON debt_pairs(chat_id, user_hi);
+
+        INSERT INTO debt_pairs (chat_id, user_lo, user_hi, amount_u5, updated_at)
+        SELECT chat_id, MIN(from_user_id, to_user_id), MAX(from_user_id, to_user_id),
+               SUM(CASE WHEN from_user_id < to_user_id THEN amount_u5 ELSE -amount_u5 END), MAX(updated_at)
+        FROM debts
+        WHERE from_user_id != to_user_id
+        GROUP BY chat_id, MIN(from_user_id, to_user_id), MAX(from_user_id, to_user_id);
+
+        DROP TABLE debts;
+
+        CREATE VIEW debts AS
+        SELECT chat_id, user_lo AS from_user_id, user_hi AS to_user_id, amount_u5, updated_at
+        FROM debt_pairs WHERE amount_u5 > 0
+        UNION ALL
+        SELECT chat_id, user_hi AS from_user_id, user_lo AS to_user_id, -amount_u5 AS amount_u5, updated_at
+        FROM debt_pairs WHERE amount_u5 < 0;
+"""
+
+# Migration 009: Per-member totals kept in step with debt_pairs by triggers,
+# so a member's balance summary is a primary-key read. Each pair contributes
+# its positive side to the debtor's owed_u5 and the creditor's owed_to_u5;
+# the triggers apply the difference between the old and new contributions.
+MIGRATION_009_MEMBER_BALANCES = """
+        CREATE TABLE member_balances (
+          chat_id INTEGER NOT NULL,
+          user_id INTEGER NOT NULL,
+          owed_u5 INTEGER NOT NULL DEFAULT 0, -- what user_id owes others in the chat
+          owed_to_u5 INTEGER NOT NULL DEFAULT 0, -- what others in the chat owe user_id
+          PRIMARY KEY (chat_id, user_id),
+          FOREIGN KEY(chat_id) REFERENCES groups(chat_id),
+          FOREIGN KEY(user_id) REFERENCES users(id)
+        ) WITHOUT ROWID;
+
+        INSERT INTO member_balances (chat_id, user_id, owed_u5, owed_to_u5)
+        SELECT chat_id, user_id, SUM(owed_u5), SUM(owed_to_u5) FROM (
+          SELECT chat_id, user_lo AS user_id, MAX(amount_u5, 0) AS owed_u5, MAX(-amount_u5, 0) AS owed_to_u5 FROM debt_pairs
+          UNION ALL
+          SELECT chat_id, user_hi AS user_id, MAX(-amount_u5, 0) AS owed_u5, MAX(amount_u5, 0) AS owed_to_u5 FROM debt_pairs
+        )
+        GROUP BY chat_id, user_id;
+
+        CREATE TRIGGER trg_debt_pairs_member_balances_insert
+        AFTER INSERT ON debt_pairs
+        BEGIN
+            INSERT INTO member_balances (chat_id, user_id, owed_u5, owed_to_u5)
+            VALUES (NEW.chat_id, NEW.user_lo, MAX(NEW.amount_u5, 0), MAX(-NEW.amount_u5, 0))
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+              owed_u5 = owed_u5 + excluded.owed_u5,
+              owed_to_u5 = owed_to_u5 + excluded.owed_to_u5;
+            INSERT INTO member_balances (chat_id, user_id, owed_u5, owed_to_u5)
+            VALUES (NEW.chat_id, NEW.user_hi, MAX(-NEW.amount_u5, 0), MAX(NEW.amount_u5, 0))
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+              owed_u5 = owed_u5 + excluded.owed_u5,
+              owed_to_u5 = owed_to_u5 + excluded.owed_to_u5;
+        END;
+
+        CREATE TRIGGER trg_debt_pairs_member_balances_update
+        AFTER UPDATE OF amount_u5 ON debt_pairs
+        BEGIN
+            INSERT INTO member_balances (chat_id, user_id, owed_u5, owed_to_u5)
+            VALUES (NEW.chat_id, NEW.user_lo, MAX(NEW.amount_u5, 0) - MAX(OLD.amount_u5, 0), MAX(-NEW.amount_u5, 0) - MAX(-OLD.amount_u5, 0))
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+              owed_u5 = owed_u5 + excluded.owed_u5,
+              owed_to_u5 = owed_to_u5 + excluded.owed_to_u5;
+            INSERT INTO member_balances (chat_id, user_id, owed_u5, owed_to_u5)
+            VALUES (NEW.chat_id, NEW.user_hi, MAX(-NEW.amount_u5, 0) - MAX(-OLD.amount_u5, 0), MAX(NEW.amount_u5, 0) - MAX(OLD.amount_u5, 0))
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+              owed_u5 = owed_u5 + excluded.owed_u5,
+              owed_to_u5 = owed_to_u5 + excluded.owed_to_u5;
+        END;
+
+        CREATE TRIGGER trg_debt_pairs_member_balances_delete
+        AFTER DELETE ON debt_pairs
+        BEGIN
+            INSERT INTO member_balances (chat_id, user_id, owed_u5, owed_to_u5)
+            VALUES (OLD.chat_id, OLD.user_lo, -MAX(OLD.amount_u5, 0), -MAX(-OLD.amount_u5, 0))
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+              owed_u5 = owed_u5 + excluded.owed_u5,
+              owed_to_u5 = owed_to_u5 + excluded.owed_to_u5;
+            INSERT INTO member_balances (chat_id, user_id, owed_u5, owed_to_u5)
+            VALUES (OLD.chat_id, OLD.user_hi, -MAX(-OLD.amount_u5, 0), -MAX(OLD.amount_u5, 0))
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+              owed_u5 = owed_u5 + excluded.owed_u5,
+              owed_to_u5 = owed_to_u5 + excluded.owed_to_u5;
+        END;
+"""
+
+# Migration 010: Checkpoints for the ledger verifier. A checkpoint holds the
+# pair balances recomputed from the expenses, settlements and manual journal
+# entries up to its low-water marks, so later runs only stream newer rows.
+# Deleting or re-statusing a confirmed record below a mark drops the checkpoint.
+MIGRATION_010_LEDGER_CHECKPOINTS = f"""
+        CREATE TABLE ledger_checkpoints (
+          chat_id INTEGER PRIMARY KEY,
+          expense_id INTEGER NOT NULL, -- expenses with id <= this are covered
+          settlement_id INTEGER NOT NULL, -- settlements with id <= this are covered
+          journal_id INTEGER NOT NULL, -- manual debt_journal entries with id <= this are covered
+          updated_at TEXT DEFAULT (datetime('now', '{DB_TIMEZONE_OFFSET}')),
+          FOREIGN KEY(chat_id) REFERENCES groups(chat_id)
+        );
+
+        CREATE TABLE ledger_checkpoint_balances (
+          chat_id INTEGER NOT NULL,
+          user_lo INTEGER NOT NULL,
+          user_hi INTEGER NOT NULL,
+          amount_u5 INTEGER NOT NULL, -- same sign convention as debt_pairs
+          PRIMARY KEY (chat_id, user_lo, user_hi),
+          FOREIGN KEY(chat_id) REFERENCES ledger_checkpoints(chat_id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_expenses_chat_id ON expenses(chat_id);
+        CREATE INDEX IF NOT EXISTS idx_settlements_chat_id ON settlements(chat_id);
+
+        CREATE TRIGGER trg_expenses_ledger_checkpoint_delete
+        AFTER DELETE ON expenses
+        WHEN OLD.status = 'confirmed'
+        BEGIN
+            DELETE FROM ledger_checkpoints WHERE chat_id = OLD.chat_id AND expense_id >= OLD.id;
+        END;
+
+        CREATE TRIGGER trg_expenses_ledger_checkpoint_status
+        AFTER UPDATE OF status ON expenses
+        WHEN OLD.status IS NOT NEW.status AND 'confirmed' IN (OLD.status, NEW.status)
+        BEGIN
+            DELETE FROM ledger_checkpoints WHERE chat_id = NEW.chat_id AND expense_id >= NEW.id;
+        END;
+
+        CREATE TRIGGER trg_settlements_ledger_checkpoint_delete
+        AFTER DELETE ON settlements
+        WHEN OLD.status = 'confirmed'
+        BEGIN
+            DELETE FROM ledger_checkpoints WHERE chat_id = OLD.chat_id AND settlement_id >= OLD.id;
+        END;
+
+        CREATE TRIGGER trg_settlements_ledger_checkpoint_status
+        AFTER UPDATE OF status ON settlements
+        WHEN OLD.status IS NOT NEW.status AND 'confirmed' IN (OLD.status, NEW.status)
+        BEGIN
+            DELETE FROM ledger_checkpoints WHERE chat_id = NEW.chat_id AND settlement_id >= NEW.id;
+        END;
+"""
+
+# Migration 011: Finds the last journal entry at a point in time, so balances
+# "as of" a date replay from the nearest snapshot with index lookups only.
+MIGRATION_011_DEBT_JOURNAL_CREATED_AT = """
+        CREATE INDEX IF NOT EXISTS idx_debt_journal_chat_created ON debt_journal(chat_id, created_at);
+"""
+
+# Migration 012: The group's title, kept current from new_chat_title messages
+# so menus and reports can render their header without a getChat request.
+MIGRATION_012_GROUP_TITLE = """
+        ALTER TABLE groups ADD COLUMN title TEXT;
+"""
+
+# Migration 013: Message deletions waiting in the scheduler, so they still
+# happen after a restart. run_at is unix time.
+MIGRATION_013_SCHEDULED_DELETIONS = """
+        CREATE TABLE IF NOT EXISTS scheduled_deletions (
+          chat_id INTEGER NOT NULL,
+          message_id INTEGER NOT NULL,
+          run_at REAL NOT NULL,
+          PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID;
+"""
+
+# Migration 014: Whether the payer picked the payee from the simplified
+# ("Suggested") transfers. Only those settlements are booked along the chain
+# of debts they replace; any other settlement nets into its own pair.
+MIGRATION_014_SETTLEMENT_SUGGESTED_PAYEE = """
+        ALTER TABLE settlements ADD COLUMN suggested_payee INTEGER NOT NULL DEFAULT 0;
+"""
+
+# Ordered list of (version, name, step). A step is either an SQL script or a
+# callable taking the connection. Never edit a released step; append a new one.
+MIGRATIONS = [
+    (1, "initial_schema", MIGRATION_001_INITIAL_SCHEMA),
+    (2, "hot_query_indexes", MIGRATION_002_HOT_QUERY_INDEXES),
+    (3, "expense_status", MIGRATION_003_EXPENSE_STATUS),
+    (4, "draft_wizard_message_id", MIGRATION_004_DRAFT_WIZARD_MESSAGE_ID),
+    (5, "chat_scoped_debts", migrate_chat_scoped_debts),
+    (6, "debt_journal", migrate_debt_journal),
+    (7, "ledger_version", MIGRATION_007_LEDGER_VERSION),
+    (8, "canonical_debt_pairs", MIGRATION_008_CANONICAL_DEBT_PAIRS),
+    (9, "member_balances", MIGRATION_009_MEMBER_BALANCES),
+    (10, "ledger_checkpoints", MIGRATION_010_LEDGER_CHECKPOINTS),
+    (11, "debt_journal_created_at", MIGRATION_011_DEBT_JOURNAL_CREATED_AT),
+    (12, "group_title", MIGRATION_012_GROUP_TITLE),
+    (13, "scheduled_deletions", MIGRATION_013_SCHEDULED_DELETIONS),
+    (14, "settlement_suggested_payee", MIGRATION_014_SETTLEMENT_SUGGESTED_PAYEE),
+]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Applies pending migration steps and returns how many were applied.
+
+    Meant to be called once at startup; each step runs in its own transaction
+    together with its schema_version row.
+    """
+    started = time.perf_counter()
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS schema_version (
+          version INTEGER PRIMARY KEY,
+          name TEXT NOT NULL,
+          applied_at TEXT DEFAULT (datetime('now', '{DB_TIMEZONE_OFFSET}'))
+        )
+    """)
+    conn.commit()
 
+    current_version = get_schema_version(conn)
+    applied = 0
+    for version, name, step in MIGRATIONS:
+        if version <= current_version:
+            continue
+        step_started = time.perf_counter()
+        try:
+            if callable(step):
+                conn.execute("BEGIN")
+                step(conn)
+            else:
+                # executescript() commits any open transaction first, so the
+                # BEGIN has to be part of the script itself.
+                conn.executescript(f"BEGIN;\n{step}")
+            conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Migration {version:03d} ({name}) failed. Schema left at version {current_version}.")
+            raise
+        current_version = version
+        applied += 1
+        logger.info(f"Applied migration {version:03d} ({name}) in {(time.perf_counter() - step_started) * 1000:.1f} ms.")
 
-    """)
\ No newline at end of file
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Schema at version {current_version}; applied {applied} migration(s) in {elapsed_ms:.1f} ms.")
+    return applied
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""EXPLAIN QUERY PLAN regression check for the queries in bot/db/repos.py.
+
+Every repo function is called against a scratch database inside one
+transaction while the executed SQL is traced. Each traced statement is then
+run through EXPLAIN QUERY PLAN, and a full scan of a table fails the check
+unless the function is listed in ALLOWED_FULL_SCANS.
+
+Run it with `python -m bot.db.query_plans`; it exits with status 1 on failure.
+"""
+import inspect
+import os
+import re
+import sys
+import tempfile
+from bot.db import repos
+from bot.db.connection import get_connection, transaction
+from bot.db.migrations import run_migrations
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+CHAT_ID = -1001
+USER_ID = 1
+OTHER_USER_ID = 2
+
+# (repo function name, args). Every public function in repos must be listed.
+REPO_CALLS = [
+    ("create_group_if_not_exists", (CHAT_ID,)),
+    ("get_group", (CHAT_ID,)),
+    ("get_group_settings", (CHAT_ID,)),
+    ("update_group_settings", (CHAT_ID, {})),
+    ("get_group_title", (CHAT_ID,)),
+    ("set_group_title", (CHAT_ID, "Flatmates")),
+    ("create_or_update_group_menu", (CHAT_ID, 10)),
+    ("update_group_last_activity", (CHAT_ID,)),
+    ("get_groups_with_old_menus", (60,)),
+    ("set_menu_message_id", (CHAT_ID, None)),
+    ("create_user_if_not_exists", (100, "user", "User")),
+    ("create_draft", (CHAT_ID, USER_ID, "expense", "2100-01-01 00:00:00")),
+    ("get_draft_by_id", (1,)),
+    ("get_draft_owner_by_message_id", (CHAT_ID, 10)),
+    ("get_active_draft", (CHAT_ID, USER_ID)),
+    ("get_active_drafts_by_user", (CHAT_ID, USER_ID)),
+    ("update_draft", (1, {"wizard_message_id": 10}, 1, "2100-01-01 00:00:00")),
+    ("delete_draft", (1,)),
+    ("add_user_to_group_if_not_exists", (USER_ID, CHAT_ID)),
+    ("get_group_members", (CHAT_ID, USER_ID)),
+    ("get_user_display_name", (USER_ID,)),
+    ("get_user", (USER_ID,)),
+    ("get_user_display_names", ([USER_ID, OTHER_USER_ID],)),
+    ("set_active_wizard_user_id", (CHAT_ID, USER_ID)),
+    ("set_settings_editor_id", (CHAT_ID, USER_ID)),
+    ("delete_file_by_id", (1,)),
+    ("create_expense", (CHAT_ID, USER_ID, 100000, "test", "Food")),
+    ("create_expense_debtors", (1, [OTHER_USER_ID], 50000)),
+    ("get_expense", (1,)),
+    ("get_expense_debtors", (1,)),
+    ("get_expense_files", (1,)),
+    ("update_file_relation", (1, "expense", 1)),
+    ("update_file_relations", ([1], "expense", 1)),
+    ("update_debtor_status", (1, OTHER_USER_ID, "confirmed")),
+    ("reject_expense", (1,)),
+    ("upsert_debt", (CHAT_ID, OTHER_USER_ID, USER_ID, 50000, "clear_debt")),
+    ("upsert_debts", (CHAT_ID, [(OTHER_USER_ID, USER_ID, 50000)], "expense", 1)),
+    ("get_ledger_version", (CHAT_ID,)),
+    ("get_committed_ledger_version", (CHAT_ID,)),
+    ("get_debt_graph", (CHAT_ID,)),
+    ("create_debt_snapshot", (CHAT_ID,)),
+    ("get_chats_with_unsnapshotted_debts", ()),
+    ("get_latest_debt_snapshot", (CHAT_ID, 10)),
+    ("get_debt_snapshot_balances", (1,)),
+    ("get_debt_journal", (CHAT_ID, 0, 10, 100)),
+    ("get_last_debt_journal_id_at", (CHAT_ID, "2100-01-01 00:00:00")),
+    ("get_debt_pairs", (CHAT_ID,)),
+    ("get_chat_ids_after", (CHAT_ID - 1, 100)),
+    ("get_expenses_after", (CHAT_ID, 0, 100)),
+    ("get_debtor_shares", ([1],)),
+    ("get_settlements_after", (CHAT_ID, 0, 100)),
+    ("save_ledger_checkpoint", (CHAT_ID, 1, 0, 1, {(USER_ID, OTHER_USER_ID): -50000})),
+    ("get_ledger_checkpoint", (CHAT_ID,)),
+    ("get_debts_for_group", (CHAT_ID,)),
+    ("get_user_balance_summary", (USER_ID, CHAT_ID)),
+    ("find_member_balance_mismatches", (CHAT_ID,)),
+    ("get_group_history", (CHAT_ID,)),
+    ("get_full_group_history", (CHAT_ID,)),
+    ("create_settlement", (CHAT_ID, OTHER_USER_ID, USER_ID, 10000)),
+    ("get_settlement", (1,)),
+    ("update_settlement_status", (1, "confirmed")),
+    ("get_settlement_files", (1,)),
+    ("update_expense_message_id", (1, 11)),
+    ("update_settlement_message_id", (1, 12)),
+    ("get_debt_between_users", (CHAT_ID, USER_ID, OTHER_USER_ID)),
+    ("get_users_owed_by_user", (OTHER_USER_ID, CHAT_ID)),
+    ("get_owed_amount", (CHAT_ID, OTHER_USER_ID, USER_ID)),
+    ("get_spending_by_category", (CHAT_ID,)),
+    ("get_spending_by_user_by_period", (CHAT_ID, 30)),
+    ("get_old_stale_drafts", ()),
+    ("get_old_rejected_expenses", (60,)),
+    ("get_old_rejected_settlements", (60,)),
+    ("get_old_pending_expenses", (60,)),
+    ("get_old_pending_settlements", (60,)),
+    ("delete_settlement", (1,)),
+    ("delete_expense", (1,)),
+    ("add_scheduled_deletion", (CHAT_ID, 10, 0.0)),
+    ("get_scheduled_deletions", ()),
+    ("delete_scheduled_deletion", (CHAT_ID, 10)),
+]
+
+# Functions that may scan a table, with the reason. Keep this list short.
+ALLOWED_FULL_SCANS = {
+    "get_groups_with_old_menus": "cold path: the menu cleanup thread is disabled",
+    "get_scheduled_deletions": "startup only: every pending deletion is resumed",
+}
+
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIASES = {"where", "on", "join", "left", "inner", "cross", "set", "group", "order", "limit", "union", "using", "values"}
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+def _table_aliases(sql: str, tables: set[str]) -> dict[str, str]:
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        if table.lower() not in tables:
+            continue
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in _NOT_ALIASES:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+def _trace_repo_calls(conn) -> list[tuple[str, str]]:
+    statements = []
+    current = {"name": None}
+    conn.set_trace_callback(lambda sql: statements.append((current["name"], sql)))
+    try:
+        for name, args in REPO_CALLS:
+            current["name"] = name
+            getattr(repos, name)(*args)
+    finally:
+        conn.set_trace_callback(None)
+    return statements
+
+def find_full_scans(db_path: str) -> list[dict]:
+    """Returns one entry per traced statement whose plan scans a whole table."""
+    with get_connection(db_path) as conn:
+        run_migrations(conn)
+
+    problems = []
+    with transaction(db_path) as conn:
+        tables = {row[0].lower() for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        conn.execute("INSERT INTO users (id, tg_id, display_name) VALUES (?, 1, 'A'), (?, 2, 'B')", (USER_ID, OTHER_USER_ID))
+        statements = _trace_repo_calls(conn)
+
+        for name, sql in statements:
+            verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+            if verb not in ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT"):
+                continue
+            aliases = _table_aliases(sql, tables)
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                match = _FULL_SCAN.match(row[3])
+                if not match or name in ALLOWED_FULL_SCANS:
+                    continue
+                # Tables read through a view show up under their own name.
+                scanned = match.group(1).lower()
+                table = aliases.get(scanned) or (scanned if scanned in tables else None)
+                if table is None:
+                    continue
+                problems.append({"function": name, "table": table, "sql": " ".join(sql.split())})
+    return problems
+
+def check_query_plans() -> bool:
+    listed = {name for name, _ in REPO_CALLS}
+    public = {name for name, obj in inspect.getmembers(repos, inspect.isfunction) if obj.__module__ == repos.__name__ and not name.startswith("_")}
+    missing = sorted(public - listed)
+    if missing:
+        logger.error(f"Repo functions missing from REPO_CALLS: {', '.join(missing)}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        problems = find_full_scans(os.path.join(tmp_dir, "query_plans.db"))
+    for problem in problems:
+        logger.error(f"{problem['function']}: full scan of {problem['table']} in: {problem['sql']}")
+
+    ok = not missing and not problems
+    if ok:
+        logger.info(f"Checked {len(REPO_CALLS)} repo functions; no unexpected full table scans.")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if check_query_plans() else 1)
@@ -1,10 +1,13 @@
 
 import sqlite3
 import json
-from bot.db.connection import get_connection
+import threading
+from bot.db.connection import get_connection, on_commit
+from bot.db.writer import writes
 from bot.logger import get_logger
 logger = get_logger(__name__)
 
+@writes
 def create_group_if_not_exists(chat_id: int):
     with get_connection() as conn:
         conn.execute("INSERT OR IGNORE INTO groups (chat_id, last_activity_at) VALUES (?, datetime('now'))", (chat_id,))
@@ -25,11 +28,28 @@ def get_group_settings(chat_id: int) -> dict:
             return json.loads(row['settings_json'])
         return {}
 
+@writes
 def update_group_settings(chat_id: int, settings: dict) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE groups SET settings_json = ? WHERE chat_id = ?", (json.dumps(settings), chat_id))
 
+def get_group_title(chat_id: int) -> str | None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT title FROM groups WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+        return row['title'] if row else None
+
+@writes
+def set_group_title(chat_id: int, title: str | None) -> None:
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO groups (chat_id, title, last_activity_at) VALUES (?, ?, datetime('now'))
+            ON CONFLICT(chat_id) DO UPDATE SET title = excluded.title
+        """, (chat_id, title))
+
+@writes
 def create_or_update_group_menu(chat_id: int, message_id: int) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -42,6 +62,7 @@ def create_or_update_group_menu(chat_id: int, message_id: int) -> None:
                 last_activity_at = datetime('now')
         """, (chat_id, message_id))
 
+@writes
 def update_group_last_activity(chat_id: int) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -57,11 +78,13 @@ def get_groups_with_old_menus(timeout_seconds: int) -> list[dict]:
         """, (timeout_seconds,))
         return [dict(row) for row in cursor.fetchall()]
 
+@writes
 def set_menu_message_id(chat_id: int, menu_message_id: int | None) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE groups SET menu_message_id = ? WHERE chat_id = ?", (menu_message_id, chat_id))
 
+@writes
 def create_user_if_not_exists(tg_id: int, username: str | None, display_name: str | None) -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -72,6 +95,7 @@ def create_user_if_not_exists(tg_id: int, username: str | None, display_name: st
         user_id = cursor.fetchone()[0]
         return user_id
 
+@writes
 def create_draft(chat_id: int, user_id: int, draft_type: str, expires_at: str) -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -92,7 +116,7 @@ def get_draft_owner_by_message_id(chat_id: int, message_id: int) -> int | None:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT user_id FROM drafts
-            WHERE chat_id = ? AND json_extract(data_json, '$.wizard_message_id') = ?
+            WHERE chat_id = ? AND wizard_message_id = ?
         """, (chat_id, message_id))
         row = cursor.fetchone()
         return row['user_id'] if row else None
@@ -153,13 +177,21 @@ def get_active_drafts_by_user(chat_id: int, user_id: int):
 
 
 
+@writes
 def update_draft(draft_id: int, data_json: dict, step: int, expires_at: str) -> None:
     logger.debug(f"Updating draft {draft_id} with data: {data_json}")
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE drafts SET data_json = ?, step = ?, expires_at = ?, updated_at = datetime('now') WHERE id = ?",
-                       (json.dumps(data_json), step, expires_at, draft_id))
+        # wizard_message_id is mirrored into its own indexed column for get_draft_owner_by_message_id.
+        cursor.execute("UPDATE drafts SET data_json = ?, wizard_message_id = ?, step = ?, expires_at = ?, updated_at = datetime('now') WHERE id = ?",
+                       (json.dumps(data_json), data_json.get('wizard_message_id'), step, expires_at, draft_id))
 
+@writes
+def delete_draft(draft_id: int) -> None:
+    with get_connection() as conn:
+        conn.execute("DELETE FROM drafts WHERE id = ?", (draft_id,))
+
+@writes
 def add_user_to_group_if_not_exists(user_id: int, chat_id: int) -> None:
     if chat_id > 0:
         return
@@ -168,14 +200,15 @@ def add_user_to_group_if_not_exists(user_id: int, chat_id: int) -> None:
         cursor.execute("INSERT OR IGNORE INTO group_users (user_id, chat_id) VALUES (?, ?)", (user_id, chat_id))
 
 def get_group_members(chat_id: int, exclude_user_id: int | None = None, exclude_from_settings: bool = True) -> list[dict]:
+    # Read before checking out a connection, so the call never holds two pool slots at once
+    excluded_members = []
+    if exclude_from_settings:
+        settings = get_group_settings(chat_id)
+        excluded_members = settings.get('excluded_members', [])
+
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        excluded_members = []
-        if exclude_from_settings:
-            settings = get_group_settings(chat_id)
-            excluded_members = settings.get('excluded_members', [])
-        
         logger.info(f"Fetching group members for chat_id: {chat_id}, excluding: {excluded_members}")
         
         query = """
@@ -206,6 +239,12 @@ def get_user_display_name(user_id: int) -> str | None:
         row = cursor.fetchone()
         return row['display_name'] if row else None
 
+def get_user_display_names(user_ids: list[int]) -> dict[int, str]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, display_name FROM users WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(user_ids),))
+        return {row['id']: row['display_name'] for row in cursor.fetchall()}
+
 def get_user(user_id: int) -> dict | None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -213,6 +252,7 @@ def get_user(user_id: int) -> dict | None:
         row = cursor.fetchone()
         return dict(row) if row else None
 
+@writes
 def set_active_wizard_user_id(chat_id: int, user_id: int | None) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -221,6 +261,7 @@ def set_active_wizard_user_id(chat_id: int, user_id: int | None) -> None:
         else:
             cursor.execute("UPDATE groups SET active_wizard_user_id = NULL, active_wizard_locked_at = NULL WHERE chat_id = ?", (chat_id,))
 
+@writes
 def set_settings_editor_id(chat_id: int, user_id: int | None) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -229,11 +270,13 @@ def set_settings_editor_id(chat_id: int, user_id: int | None) -> None:
         else:
             cursor.execute("UPDATE groups SET settings_editor_id = NULL, settings_locked_at = NULL WHERE chat_id = ?", (chat_id,))
 
+@writes
 def delete_file_by_id(file_row_id: int) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM files WHERE id = ?", (file_row_id,))
 
+@writes
 def create_expense(chat_id, payer_id, amount_u5, description, category) -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -246,17 +289,38 @@ def create_expense(chat_id, payer_id, amount_u5, description, category) -> int:
         )
         return cursor.lastrowid
 
-def create_expense_debtors(expense_id, debtors, share_u5) -> None:
+def _refresh_expense_status(cursor, expense_id: int) -> None:
+    """Recomputes expenses.status from the rejected flag and the debtor shares."""
+    cursor.execute(
+        """
+        UPDATE expenses SET status = CASE
+            WHEN rejected = 1 THEN 'rejected'
+            WHEN EXISTS (SELECT 1 FROM expense_debtors WHERE expense_id = expenses.id AND status = 'pending') THEN 'pending'
+            ELSE 'confirmed'
+        END
+        WHERE id = ?
+        """,
+        (expense_id,),
+    )
+
+@writes
+def create_expense_debtors(expense_id, debtors, share_u5, confirmed_debtors=()) -> None:
+    # Debtors in confirmed_debtors (e.g. auto-confirm users) are inserted as
+    # already confirmed, so no follow-up status updates are needed.
+    confirmed_debtors = set(confirmed_debtors)
+    rows = []
+    for debtor_id in debtors:
+        status = 'confirmed' if debtor_id in confirmed_debtors else 'pending'
+        rows.append((expense_id, debtor_id, share_u5, status, status))
     with get_connection() as conn:
-        cursor = conn.cursor()
-        for debtor_id in debtors:
-            cursor.execute(
-                """
-                INSERT INTO expense_debtors (expense_id, debtor_id, share_u5)
-                VALUES (?, ?, ?)
-                """,
-                (expense_id, debtor_id, share_u5),
-            )
+        conn.executemany(
+            """
+            INSERT INTO expense_debtors (expense_id, debtor_id, share_u5, status, status_at)
+            VALUES (?, ?, ?, ?, CASE WHEN ? = 'confirmed' THEN datetime('now') END)
+            """,
+            rows,
+        )
+        _refresh_expense_status(conn.cursor(), expense_id)
 
 def get_expense(expense_id: int) -> dict | None:
     with get_connection() as conn:
@@ -280,6 +344,7 @@ def get_expense_files(expense_id: int) -> list[dict]:
         )
         return [dict(row) for row in cursor.fetchall()]
 
+@writes
 def update_file_relation(file_row_id: int, related_type: str, related_id: int) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -288,6 +353,17 @@ def update_file_relation(file_row_id: int, related_type: str, related_id: int) -
             (related_type, str(related_id), file_row_id),
         )
 
+@writes
+def update_file_relations(file_row_ids: list[int], related_type: str, related_id: int) -> None:
+    if not file_row_ids:
+        return
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE files SET related_type = ?, related_id = ? WHERE id = ?",
+            [(related_type, str(related_id), file_row_id) for file_row_id in file_row_ids],
+        )
+
+@writes
 def update_debtor_status(expense_id: int, debtor_id: int, status: str) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -295,46 +371,260 @@ def update_debtor_status(expense_id: int, debtor_id: int, status: str) -> None:
             "UPDATE expense_debtors SET status = ?, status_at = datetime('now') WHERE expense_id = ? AND debtor_id = ?",
             (status, expense_id, debtor_id),
         )
+        _refresh_expense_status(cursor, expense_id)
 
+@writes
 def reject_expense(expense_id: int) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "UPDATE expenses SET rejected = 1, rejected_at = datetime('now') WHERE id = ?",
+            "UPDATE expenses SET rejected = 1, rejected_at = datetime('now'), status = 'rejected' WHERE id = ?",
             (expense_id,),
         )
         
+@writes
 def delete_expense(expense_id: int) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
 
 
-def upsert_debt(from_user_id: int, to_user_id: int, amount_u5: int) -> None:
+def _canonical_debt(from_user_id: int, to_user_id: int, amount_u5: int) -> tuple[int, int, int]:
+    # debt_pairs keeps one row per (user_lo, user_hi); a positive amount means user_lo owes user_hi.
+    if from_user_id < to_user_id:
+        return from_user_id, to_user_id, amount_u5
+    return to_user_id, from_user_id, -amount_u5
+
+def _apply_debts(cursor: sqlite3.Cursor, chat_id: int, debts: list[tuple[int, int, int]]) -> None:
+    """Nets all (from_user_id, to_user_id, amount_u5) debts into debt_pairs with one statement."""
+    deltas = [_canonical_debt(*debt) for debt in debts if debt[0] != debt[1]]
+    if not deltas:
+        return
+    # "WHERE true" keeps SQLite from reading ON CONFLICT as part of the SELECT.
+    cursor.execute(
+        """
+        INSERT INTO debt_pairs (chat_id, user_lo, user_hi, amount_u5)
+        SELECT ?, json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]')
+        FROM json_each(?) WHERE true
+        ON CONFLICT (chat_id, user_lo, user_hi)
+        DO UPDATE SET amount_u5 = amount_u5 + excluded.amount_u5, updated_at = datetime('now')
+        """,
+        (chat_id, json.dumps(deltas)),
+    )
+
+def _journal_debts(cursor: sqlite3.Cursor, chat_id: int, debts: list[tuple[int, int, int]], source_type: str, source_id: int | None) -> None:
+    cursor.executemany(
+        """
+        INSERT INTO debt_journal (chat_id, from_user_id, to_user_id, amount_u5, source_type, source_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [(chat_id, from_user_id, to_user_id, amount_u5, source_type, source_id) for from_user_id, to_user_id, amount_u5 in debts],
+    )
+
+# Last committed groups.ledger_version per chat, as seen by this process.
+# Lets in-process caches check for debt changes without querying SQLite.
+_committed_ledger_versions = {}
+_committed_ledger_versions_lock = threading.Lock()
+
+def _set_committed_ledger_version(chat_id: int, ledger_version: int) -> None:
+    with _committed_ledger_versions_lock:
+        if ledger_version > _committed_ledger_versions.get(chat_id, -1):
+            _committed_ledger_versions[chat_id] = ledger_version
+
+def _bump_ledger_version(cursor: sqlite3.Cursor, chat_id: int) -> None:
+    cursor.execute("UPDATE groups SET ledger_version = ledger_version + 1 WHERE chat_id = ? RETURNING ledger_version", (chat_id,))
+    row = cursor.fetchone()
+    if row:
+        ledger_version = row['ledger_version']
+        on_commit(lambda: _set_committed_ledger_version(chat_id, ledger_version))
+
+def get_committed_ledger_version(chat_id: int) -> int | None:
+    """The chat's ledger version after the last debt write this process committed, if any."""
+    with _committed_ledger_versions_lock:
+        return _committed_ledger_versions.get(chat_id)
+
+def get_ledger_version(chat_id: int) -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
-        # Netting logic from idea.md
-        # 1. Get existing debt from_user -> to_user
-        cursor.execute("SELECT amount_u5 FROM debts WHERE from_user_id = ? AND to_user_id = ?", (from_user_id, to_user_id))
-        debt_xy = cursor.fetchone()
-        if debt_xy:
-            new_amount = debt_xy[0] + amount_u5
-            cursor.execute("UPDATE debts SET amount_u5 = ?, updated_at = datetime('now') WHERE from_user_id = ? AND to_user_id = ?", (new_amount, from_user_id, to_user_id))
-        else:
-            # 2. Get existing debt to_user -> from_user
-            cursor.execute("SELECT amount_u5 FROM debts WHERE from_user_id = ? AND to_user_id = ?", (to_user_id, from_user_id))
-            debt_yx = cursor.fetchone()
-            if debt_yx:
-                if amount_u5 >= debt_yx[0]:
-                    new_amount = amount_u5 - debt_yx[0]
-                    cursor.execute("DELETE FROM debts WHERE from_user_id = ? AND to_user_id = ?", (to_user_id, from_user_id))
-                    if new_amount > 0:
-                        cursor.execute("INSERT INTO debts (from_user_id, to_user_id, amount_u5) VALUES (?, ?, ?)", (from_user_id, to_user_id, new_amount))
-                else:
-                    new_amount = debt_yx[0] - amount_u5
-                    cursor.execute("UPDATE debts SET amount_u5 = ?, updated_at = datetime('now') WHERE from_user_id = ? AND to_user_id = ?", (new_amount, to_user_id, from_user_id))
-            else:
-                cursor.execute("INSERT INTO debts (from_user_id, to_user_id, amount_u5) VALUES (?, ?, ?)", (from_user_id, to_user_id, amount_u5))
+        cursor.execute("SELECT ledger_version FROM groups WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+        return row['ledger_version'] if row else 0
+
+@writes
+def upsert_debt(chat_id: int, from_user_id: int, to_user_id: int, amount_u5: int, source_type: str, source_id: int | None = None) -> None:
+    """Records a debt movement in the journal and nets it into its debt pair."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        _journal_debts(cursor, chat_id, [(from_user_id, to_user_id, amount_u5)], source_type, source_id)
+        _apply_debts(cursor, chat_id, [(from_user_id, to_user_id, amount_u5)])
+        _bump_ledger_version(cursor, chat_id)
+
+@writes
+def upsert_debts(chat_id: int, debts: list[tuple[int, int, int]], source_type: str, source_id: int | None = None) -> None:
+    """Journals many (from_user_id, to_user_id, amount_u5) debts in one chat and nets them in one statement."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        _journal_debts(cursor, chat_id, debts, source_type, source_id)
+        _apply_debts(cursor, chat_id, debts)
+        _bump_ledger_version(cursor, chat_id)
+
+@writes
+def create_debt_snapshot(chat_id: int) -> int | None:
+    """Copies the chat's current debts into a snapshot tagged with the last journal entry.
+
+    Returns the snapshot id, or None if nothing was journaled since the last snapshot.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM debt_journal WHERE chat_id = ?", (chat_id,))
+        journal_id = cursor.fetchone()[0]
+        if journal_id is None:
+            return None
+        cursor.execute("SELECT MAX(journal_id) FROM debt_snapshots WHERE chat_id = ?", (chat_id,))
+        last_snapshot_journal_id = cursor.fetchone()[0]
+        if last_snapshot_journal_id is not None and last_snapshot_journal_id >= journal_id:
+            return None
+
+        cursor.execute("INSERT INTO debt_snapshots (chat_id, journal_id) VALUES (?, ?)", (chat_id, journal_id))
+        snapshot_id = cursor.lastrowid
+        cursor.execute(
+            """
+            INSERT INTO debt_snapshot_balances (snapshot_id, from_user_id, to_user_id, amount_u5)
+            SELECT ?, from_user_id, to_user_id, amount_u5 FROM debts WHERE chat_id = ? AND amount_u5 != 0
+            """,
+            (snapshot_id, chat_id),
+        )
+        return snapshot_id
+
+def get_chats_with_unsnapshotted_debts() -> list[int]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT j.chat_id
+            FROM (SELECT chat_id, MAX(id) AS journal_id FROM debt_journal GROUP BY chat_id) j
+            LEFT JOIN (SELECT chat_id, MAX(journal_id) AS journal_id FROM debt_snapshots GROUP BY chat_id) s ON s.chat_id = j.chat_id
+            WHERE s.journal_id IS NULL OR s.journal_id < j.journal_id
+            """
+        )
+        return [row['chat_id'] for row in cursor.fetchall()]
+
+def get_latest_debt_snapshot(chat_id: int, max_journal_id: int | None = None) -> dict | None:
+    """Returns the newest snapshot of the chat covering at most max_journal_id."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT * FROM debt_snapshots
+            WHERE chat_id = ? AND journal_id <= COALESCE(?, journal_id)
+            ORDER BY journal_id DESC
+            LIMIT 1
+            """,
+            (chat_id, max_journal_id),
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def get_debt_snapshot_balances(snapshot_id: int) -> list[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT from_user_id, to_user_id, amount_u5 FROM debt_snapshot_balances WHERE snapshot_id = ?", (snapshot_id,))
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_debt_journal(chat_id: int, after_id: int = 0, up_to_id: int | None = None, limit: int = -1) -> list[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT * FROM debt_journal
+            WHERE chat_id = ? AND id > ? AND id <= COALESCE(?, id)
+            ORDER BY id
+            LIMIT ?
+            """,
+            (chat_id, after_id, up_to_id, limit),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_last_debt_journal_id_at(chat_id: int, timestamp: str) -> int | None:
+    """Returns the id of the chat's last journal entry created at or before timestamp."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id FROM debt_journal WHERE chat_id = ? AND created_at <= ? ORDER BY created_at DESC, id DESC LIMIT 1",
+            (chat_id, timestamp),
+        )
+        row = cursor.fetchone()
+        return row['id'] if row else None
+
+def get_debt_pairs(chat_id: int) -> list[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_lo, user_hi, amount_u5 FROM debt_pairs WHERE chat_id = ?", (chat_id,))
+        return [dict(row) for row in cursor.fetchall()]
+
+# Keyset pagination helpers for the ledger verifier: each returns the next
+# `limit` rows after the given id, so callers never hold a whole table.
+
+def get_chat_ids_after(after_chat_id: int, limit: int) -> list[int]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT chat_id FROM groups WHERE chat_id > ? ORDER BY chat_id LIMIT ?", (after_chat_id, limit))
+        return [row['chat_id'] for row in cursor.fetchall()]
+
+def get_expenses_after(chat_id: int, after_id: int, limit: int) -> list[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, payer_id, status FROM expenses WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (chat_id, after_id, limit),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_debtor_shares(expense_ids: list[int]) -> list[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT expense_id, debtor_id, share_u5 FROM expense_debtors WHERE expense_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(expense_ids),),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_settlements_after(chat_id: int, after_id: int, limit: int) -> list[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, from_user_id, to_user_id, amount_u5, status FROM settlements WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (chat_id, after_id, limit),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_ledger_checkpoint(chat_id: int) -> dict | None:
+    """Returns the chat's verifier checkpoint with its balances keyed by (user_lo, user_hi)."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM ledger_checkpoints WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        checkpoint = dict(row)
+        cursor.execute("SELECT user_lo, user_hi, amount_u5 FROM ledger_checkpoint_balances WHERE chat_id = ?", (chat_id,))
+        checkpoint['balances'] = {(r['user_lo'], r['user_hi']): r['amount_u5'] for r in cursor.fetchall()}
+        return checkpoint
+
+@writes
+def save_ledger_checkpoint(chat_id: int, expense_id: int, settlement_id: int, journal_id: int, balances: dict[tuple[int, int], int]) -> None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Deleting first also clears the old balances through ON DELETE CASCADE
+        cursor.execute("DELETE FROM ledger_checkpoints WHERE chat_id = ?", (chat_id,))
+        cursor.execute(
+            "INSERT INTO ledger_checkpoints (chat_id, expense_id, settlement_id, journal_id) VALUES (?, ?, ?, ?)",
+            (chat_id, expense_id, settlement_id, journal_id),
+        )
+        cursor.executemany(
+            "INSERT INTO ledger_checkpoint_balances (chat_id, user_lo, user_hi, amount_u5) VALUES (?, ?, ?, ?)",
+            [(chat_id, user_lo, user_hi, amount_u5) for (user_lo, user_hi), amount_u5 in balances.items() if amount_u5 != 0],
+        )
 
 def get_debts_for_group(chat_id: int) -> list[dict]:
     with get_connection() as conn:
@@ -353,42 +643,60 @@ def get_debts_for_group(chat_id: int) -> list[dict]:
                 users u_from ON d.from_user_id = u_from.id
             JOIN
                 users u_to ON d.to_user_id = u_to.id
-            JOIN
-                group_users gu_from ON d.from_user_id = gu_from.user_id
-            JOIN
-                group_users gu_to ON d.to_user_id = gu_to.user_id
             WHERE
-                gu_from.chat_id = ? AND gu_to.chat_id = ? AND d.amount_u5 >= 100
+                d.chat_id = ? AND d.amount_u5 >= 100
             """,
-            (chat_id, chat_id)
+            (chat_id,)
         )
         result = [dict(row) for row in cursor.fetchall()]
         logger.debug(f"get_debts_for_group result: {result}")
         return result
 
-def get_user_balance_summary(user_id: int, chat_id: int) -> dict:
+def get_debt_graph(chat_id: int) -> dict:
+    """Returns the chat's ledger version, all of its non-zero debts (dust included) and each member's totals.
+
+    totals maps user_id to (owed_u5, owed_to_u5), as kept in member_balances.
+    """
     with get_connection() as conn:
         cursor = conn.cursor()
-
-        # Get total owed and total owed to user
+        cursor.execute("SELECT ledger_version FROM groups WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+        ledger_version = row['ledger_version'] if row else 0
         cursor.execute(
             """
             SELECT
-                IFNULL(SUM(CASE WHEN d.from_user_id = ? THEN d.amount_u5 ELSE 0 END), 0) AS total_owed,
-                IFNULL(SUM(CASE WHEN d.to_user_id = ? THEN d.amount_u5 ELSE 0 END), 0) AS total_owed_to_user
+                d.from_user_id,
+                u_from.display_name AS from_user_display_name,
+                d.to_user_id,
+                u_to.display_name AS to_user_display_name,
+                d.amount_u5
             FROM
                 debts d
             JOIN
-                group_users gu_from ON d.from_user_id = gu_from.user_id
+                users u_from ON d.from_user_id = u_from.id
             JOIN
-                group_users gu_to ON d.to_user_id = gu_to.user_id
+                users u_to ON d.to_user_id = u_to.id
             WHERE
-                (d.from_user_id = ? OR d.to_user_id = ?)
-                AND gu_from.chat_id = ? AND gu_to.chat_id = ?;
+                d.chat_id = ?
             """,
-            (user_id, user_id, user_id, user_id, chat_id, chat_id)
+            (chat_id,)
         )
-        summary = dict(cursor.fetchone())
+        debts = [dict(row) for row in cursor.fetchall()]
+        cursor.execute("SELECT user_id, owed_u5, owed_to_u5 FROM member_balances WHERE chat_id = ?", (chat_id,))
+        totals = {row['user_id']: (row['owed_u5'], row['owed_to_u5']) for row in cursor.fetchall()}
+        return {'ledger_version': ledger_version, 'debts': debts, 'totals': totals}
+
+def get_user_balance_summary(user_id: int, chat_id: int) -> dict:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        # Totals are maintained per member by triggers on debt_pairs
+        cursor.execute(
+            "SELECT owed_u5 AS total_owed, owed_to_u5 AS total_owed_to_user FROM member_balances WHERE chat_id = ? AND user_id = ?",
+            (chat_id, user_id)
+        )
+        row = cursor.fetchone()
+        summary = dict(row) if row else {'total_owed': 0, 'total_owed_to_user': 0}
 
         # Get detailed debts involving the user
         cursor.execute(
@@ -405,15 +713,10 @@ def get_user_balance_summary(user_id: int, chat_id: int) -> dict:
                 users u_from ON d.from_user_id = u_from.id
             JOIN
                 users u_to ON d.to_user_id = u_to.id
-            JOIN
-                group_users gu_from ON d.from_user_id = gu_from.user_id
-            JOIN
-                group_users gu_to ON d.to_user_id = gu_to.user_id
             WHERE
-                (d.from_user_id = ? OR d.to_user_id = ?)
-                AND gu_from.chat_id = ? AND gu_to.chat_id = ? AND d.amount_u5 >= 100;
+                d.chat_id = ? AND (d.from_user_id = ? OR d.to_user_id = ?) AND d.amount_u5 >= 100;
             """,
-            (user_id, user_id, chat_id, chat_id)
+            (chat_id, user_id, user_id)
         )
         detailed_debts = [dict(row) for row in cursor.fetchall()]
         logger.debug(f"get_user_balance_summary detailed_debts: {detailed_debts}")
@@ -421,6 +724,50 @@ def get_user_balance_summary(user_id: int, chat_id: int) -> dict:
         summary['detailed_debts'] = detailed_debts
         return summary
 
+def find_member_balance_mismatches(chat_id: int | None = None) -> list[dict]:
+    """Compares member_balances against totals recomputed from debt_pairs.
+
+    Returns one entry per member whose stored totals differ, for one chat or
+    for all of them.
+    """
+    chat_filter = "WHERE chat_id = ?" if chat_id is not None else ""
+    params = (chat_id,) if chat_id is not None else ()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT chat_id, user_id, SUM(owed_u5) AS owed_u5, SUM(owed_to_u5) AS owed_to_u5 FROM (
+                SELECT chat_id, user_lo AS user_id, MAX(amount_u5, 0) AS owed_u5, MAX(-amount_u5, 0) AS owed_to_u5
+                FROM debt_pairs {chat_filter}
+                UNION ALL
+                SELECT chat_id, user_hi AS user_id, MAX(-amount_u5, 0) AS owed_u5, MAX(amount_u5, 0) AS owed_to_u5
+                FROM debt_pairs {chat_filter}
+            )
+            GROUP BY chat_id, user_id
+            """,
+            params * 2
+        )
+        expected = {(row['chat_id'], row['user_id']): (row['owed_u5'], row['owed_to_u5']) for row in cursor.fetchall()}
+        cursor.execute(f"SELECT chat_id, user_id, owed_u5, owed_to_u5 FROM member_balances {chat_filter}", params)
+        stored = {(row['chat_id'], row['user_id']): (row['owed_u5'], row['owed_to_u5']) for row in cursor.fetchall()}
+
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        expected_totals = expected.get(key, (0, 0))
+        stored_totals = stored.get(key, (0, 0))
+        if expected_totals != stored_totals:
+            mismatches.append({
+                'chat_id': key[0],
+                'user_id': key[1],
+                'owed_u5': stored_totals[0],
+                'owed_to_u5': stored_totals[1],
+                'expected_owed_u5': expected_totals[0],
+                'expected_owed_to_u5': expected_totals[1],
+            })
+    if mismatches:
+        logger.warning(f"Found {len(mismatches)} member balance(s) out of step with the debt ledger.")
+    return mismatches
+
 def get_group_history(chat_id: int, limit: int = 10, offset: int = 0) -> list[dict]:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -437,9 +784,7 @@ def get_group_history(chat_id: int, limit: int = 10, offset: int = 0) -> list[di
                 NULL as to_user_name
             FROM expenses e
             JOIN users p ON e.payer_id = p.id
-            WHERE e.chat_id = ? AND e.rejected = 0 AND e.id NOT IN (
-                SELECT DISTINCT expense_id FROM expense_debtors WHERE status = 'pending'
-            )
+            WHERE e.chat_id = ? AND e.status = 'confirmed'
             UNION ALL
             SELECT
                 'settlement' as type,
@@ -477,9 +822,7 @@ def get_full_group_history(chat_id: int) -> list[dict]:
                 NULL as to_user_name
             FROM expenses e
             JOIN users p ON e.payer_id = p.id
-            WHERE e.chat_id = ? AND e.rejected = 0 AND e.id NOT IN (
-                SELECT DISTINCT expense_id FROM expense_debtors WHERE status = 'pending'
-            )
+            WHERE e.chat_id = ? AND e.status = 'confirmed'
             UNION ALL
             SELECT
                 'settlement' as type,
@@ -501,15 +844,16 @@ def get_full_group_history(chat_id: int) -> list[dict]:
         """, (chat_id, chat_id))
         return [dict(row) for row in cursor.fetchall()]
 
-def create_settlement(chat_id: int, from_user_id: int, to_user_id: int, amount_u5: int) -> int:
+@writes
+def create_settlement(chat_id: int, from_user_id: int, to_user_id: int, amount_u5: int, suggested_payee: bool = False) -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
-            INSERT INTO settlements (chat_id, from_user_id, to_user_id, amount_u5)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO settlements (chat_id, from_user_id, to_user_id, amount_u5, suggested_payee)
+            VALUES (?, ?, ?, ?, ?)
             """,
-            (chat_id, from_user_id, to_user_id, amount_u5),
+            (chat_id, from_user_id, to_user_id, amount_u5, int(suggested_payee)),
         )
         return cursor.lastrowid
 
@@ -520,6 +864,7 @@ def get_settlement(settlement_id: int) -> dict | None:
         row = cursor.fetchone()
         return dict(row) if row else None
 
+@writes
 def update_settlement_status(settlement_id: int, status: str) -> None:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -538,32 +883,29 @@ def get_settlement_files(settlement_id: int) -> list[dict]:
         )
         return [dict(row) for row in cursor.fetchall()]
 
+@writes
 def delete_settlement(settlement_id: int):
     with get_connection() as conn:
         conn.execute("DELETE FROM settlements WHERE id = ?", (settlement_id,))
 
+@writes
 def update_expense_message_id(expense_id: int, message_id: int):
     with get_connection() as conn:
         conn.execute("UPDATE expenses SET message_id = ? WHERE id = ?", (message_id, expense_id))
 
+@writes
 def update_settlement_message_id(settlement_id: int, message_id: int):
     with get_connection() as conn:
         conn.execute("UPDATE settlements SET message_id = ? WHERE id = ?", (message_id, settlement_id))
 
-def get_debt_between_users(user1_id: int, user2_id: int) -> int:
+def get_debt_between_users(chat_id: int, user1_id: int, user2_id: int) -> int:
+    """Returns what user1 owes user2; negative if user2 owes user1."""
+    user_lo, user_hi, sign = (user1_id, user2_id, 1) if user1_id < user2_id else (user2_id, user1_id, -1)
     with get_connection() as conn:
         cursor = conn.cursor()
-        # Debt from user1 to user2
-        cursor.execute("SELECT amount_u5 FROM debts WHERE from_user_id = ? AND to_user_id = ?", (user1_id, user2_id))
-        debt1 = cursor.fetchone()
-        # Debt from user2 to user1
-        cursor.execute("SELECT amount_u5 FROM debts WHERE from_user_id = ? AND to_user_id = ?", (user2_id, user1_id))
-        debt2 = cursor.fetchone()
-
-        debt1_amount = debt1[0] if debt1 else 0
-        debt2_amount = debt2[0] if debt2 else 0
-
-        return debt1_amount - debt2_amount
+        cursor.execute("SELECT amount_u5 FROM debt_pairs WHERE chat_id = ? AND user_lo = ? AND user_hi = ?", (chat_id, user_lo, user_hi))
+        row = cursor.fetchone()
+        return sign * row['amount_u5'] if row else 0
 
 def get_users_owed_by_user(user_id: int, chat_id: int) -> list[dict]:
     with get_connection() as conn:
@@ -578,21 +920,15 @@ def get_users_owed_by_user(user_id: int, chat_id: int) -> list[dict]:
                 debts d
             JOIN
                 users u ON d.to_user_id = u.id
-            JOIN
-                group_users gu ON d.to_user_id = gu.user_id
             WHERE
-                d.from_user_id = ? AND gu.chat_id = ? AND d.amount_u5 >= 100;
+                d.chat_id = ? AND d.from_user_id = ? AND d.amount_u5 >= 100;
             """,
-            (user_id, chat_id)
+            (chat_id, user_id)
         )
         return [dict(row) for row in cursor.fetchall()]
 
-def get_owed_amount(from_user_id: int, to_user_id: int) -> int:
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT amount_u5 FROM debts WHERE from_user_id = ? AND to_user_id = ?", (from_user_id, to_user_id))
-        row = cursor.fetchone()
-        return row['amount_u5'] if row else 0
+def get_owed_amount(chat_id: int, from_user_id: int, to_user_id: int) -> int:
+    return max(get_debt_between_users(chat_id, from_user_id, to_user_id), 0)
 
 def get_spending_by_category(chat_id: int) -> list[dict]:
     with get_connection() as conn:
@@ -600,9 +936,7 @@ def get_spending_by_category(chat_id: int) -> list[dict]:
         cursor.execute("""
             SELECT category, SUM(amount_u5) as total_amount
             FROM expenses
-            WHERE chat_id = ? AND rejected = 0 AND id NOT IN (
-                SELECT DISTINCT expense_id FROM expense_debtors WHERE status = 'pending'
-            )
+            WHERE chat_id = ? AND status = 'confirmed'
             GROUP BY category
             ORDER BY total_amount DESC
         """, (chat_id,))
@@ -642,11 +976,11 @@ def get_old_pending_expenses(seconds: int) -> list[dict]:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(f"""
-            SELECT DISTINCT e.id, e.chat_id, e.message_id
+            SELECT e.id, e.chat_id, e.message_id
             FROM expenses e
-            JOIN expense_debtors ed ON e.id = ed.expense_id
-            WHERE ed.status = 'pending'
+            WHERE e.status IN ('pending', 'rejected')
             AND e.created_at < datetime('now', '-' || ? || ' seconds')
+            AND EXISTS (SELECT 1 FROM expense_debtors ed WHERE ed.expense_id = e.id AND ed.status = 'pending')
         """, (seconds,))
         return [dict(row) for row in cursor.fetchall()]
 
@@ -686,8 +1020,7 @@ def get_spending_by_user_by_period(chat_id: int, days: int) -> list[dict]:
                 LEFT JOIN DebtorShares ds ON e.id = ds.expense_id
                 WHERE e.chat_id = ?
                   AND e.created_at >= date('now', '-' || ? || ' days')
-                  AND e.rejected = 0
-                  AND e.id NOT IN (SELECT DISTINCT expense_id FROM expense_debtors WHERE status = 'pending')
+                  AND e.status = 'confirmed'
             ),
             DebtorExpenses AS (
                 SELECT
@@ -697,8 +1030,7 @@ def get_spending_by_user_by_period(chat_id: int, days: int) -> list[dict]:
                 JOIN expenses e ON ed.expense_id = e.id
                 WHERE e.chat_id = ? 
                   AND e.created_at >= date('now', '-' || ? || ' days')
-                  AND e.rejected = 0 
-                  AND e.id NOT IN (SELECT DISTINCT expense_id FROM expense_debtors WHERE status = 'pending')
+                  AND e.status = 'confirmed'
             ),
             ExpenseParticipants AS (
                 SELECT * FROM PayerExpenses
@@ -717,3 +1049,22 @@ def get_spending_by_user_by_period(chat_id: int, days: int) -> list[dict]:
         
         cursor.execute(query, params)
         return [dict(row) for row in cursor.fetchall()]
+
+@writes
+def add_scheduled_deletion(chat_id: int, message_id: int, run_at: float) -> None:
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO scheduled_deletions (chat_id, message_id, run_at) VALUES (?, ?, ?)
+            ON CONFLICT(chat_id, message_id) DO UPDATE SET run_at = excluded.run_at
+        """, (chat_id, message_id, run_at))
+
+@writes
+def delete_scheduled_deletion(chat_id: int, message_id: int) -> None:
+    with get_connection() as conn:
+        conn.execute("DELETE FROM scheduled_deletions WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+
+def get_scheduled_deletions() -> list[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT chat_id, message_id, run_at FROM scheduled_deletions ORDER BY run_at")
+        return [dict(row) for row in cursor.fetchall()]
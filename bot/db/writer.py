@@ -0,0 +1,157 @@
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from bot.config import DB_PATH, DB_WRITE_BATCH_MAX, DB_WRITE_TIMEOUT_SECONDS
+from bot.db.connection import in_transaction, transaction
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+class DatabaseWriter:
+    """Runs all database writes on one dedicated thread.
+
+    Queued operations are drained in batches and each batch is applied in a
+    single transaction (group commit). Every operation runs in its own
+    savepoint, so a failing operation is rolled back alone. Callers get a
+    Future that resolves once the batch has committed.
+    """
+
+    def __init__(self, db_path: str, batch_max: int):
+        self.db_path = db_path
+        self.batch_max = batch_max
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "queue_depth_max": 0,
+            "batches": 0,
+            "operations": 0,
+            "failed_operations": 0,
+            "failed_commits": 0,
+            "batch_size_last": 0,
+            "batch_size_max": 0,
+            "commit_seconds_total": 0.0,
+            "commit_seconds_max": 0.0,
+        }
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+                logger.info(f"Database writer started for {self.db_path} (batch max {self.batch_max}).")
+
+    def is_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        self.start()
+        future = Future()
+        self._queue.put((func, args, kwargs, future))
+        depth = self._queue.qsize()
+        with self._metrics_lock:
+            self._metrics["queue_depth_max"] = max(self._metrics["queue_depth_max"], depth)
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._execute(batch)
+            except Exception as e:
+                logger.error(f"Unexpected error in database writer: {e}", exc_info=True)
+
+    def _execute(self, batch: list) -> None:
+        outcomes = []
+        started = time.perf_counter()
+        try:
+            with transaction(self.db_path):
+                for func, args, kwargs, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction():
+                            outcomes.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            logger.error(f"Failed to commit a batch of {len(batch)} write(s): {e}")
+            with self._metrics_lock:
+                self._metrics["failed_commits"] += 1
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is not None:
+                failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        with self._metrics_lock:
+            self._metrics["batches"] += 1
+            self._metrics["operations"] += len(outcomes)
+            self._metrics["failed_operations"] += failed
+            self._metrics["batch_size_last"] = len(batch)
+            self._metrics["batch_size_max"] = max(self._metrics["batch_size_max"], len(batch))
+            self._metrics["commit_seconds_total"] += elapsed
+            self._metrics["commit_seconds_max"] = max(self._metrics["commit_seconds_max"], elapsed)
+
+    def get_metrics(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["batch_size_avg"] = metrics["operations"] / metrics["batches"] if metrics["batches"] else 0.0
+        metrics["commit_seconds_avg"] = metrics["commit_seconds_total"] / metrics["batches"] if metrics["batches"] else 0.0
+        return metrics
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> DatabaseWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DatabaseWriter(DB_PATH, DB_WRITE_BATCH_MAX)
+        return _writer
+
+def get_writer_metrics() -> dict:
+    return get_writer().get_metrics()
+
+def _log_failed_write(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Queued database write failed: {future.exception()}")
+
+def writes(func):
+    """Routes calls of a write function through the database writer thread.
+
+    The caller blocks until the write has committed and gets its return value
+    or exception. Calls made inside an open transaction (including everything
+    running on the writer thread) run directly so they join it.
+    `func.submit(...)` queues the call without waiting and returns its Future.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if in_transaction():
+            return func(*args, **kwargs)
+        return get_writer().submit(func, *args, **kwargs).result(timeout=DB_WRITE_TIMEOUT_SECONDS)
+
+    def submit(*args, **kwargs) -> Future:
+        future = get_writer().submit(func, *args, **kwargs)
+        future.add_done_callback(_log_failed_write)
+        return future
+
+    wrapper.submit = submit
+    return wrapper
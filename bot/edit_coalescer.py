@@ -0,0 +1,72 @@
+"""Debounced message edits for toggle buttons.
+
+Toggle handlers (debtors, categories, excluded members) answer the callback
+and save the new state right away, then hand the re-rendered message to
+EditCoalescer.edit(). The first edit of a message opens a short window;
+edits arriving within it replace the pending one, and only the latest is
+sent when the window closes. Fast tapping therefore costs one API call per
+window instead of one per tap, and the keyboard never replays stale states.
+
+The flush runs on the chat's shard, so it is ordered with the chat's other
+updates. Any other callback on the same message discards the pending edit
+first, so a stale toggle view never overwrites the next wizard step.
+"""
+import threading
+import telebot
+from bot.chat_shards import ChatShardedExecutor
+from bot.logger import get_logger
+from bot.services.scheduler import cancel, schedule
+
+logger = get_logger(__name__)
+
+class EditCoalescer:
+    def __init__(self, bot: telebot.TeleBot, chat_shards: ChatShardedExecutor, debounce_seconds: float):
+        self.bot = bot
+        self.chat_shards = chat_shards
+        self.debounce_seconds = debounce_seconds
+        # (chat_id, message_id) -> edit_message_text kwargs of the latest render
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._metrics = {"requested": 0, "sent": 0, "superseded": 0, "discarded": 0, "failed": 0}
+
+    def edit(self, chat_id: int, message_id: int, **kwargs) -> None:
+        """Queues an edit_message_text of the message, replacing any edit still pending for it."""
+        with self._lock:
+            superseded = (chat_id, message_id) in self._pending
+            self._pending[(chat_id, message_id)] = kwargs
+            self._metrics["requested"] += 1
+            if superseded:
+                self._metrics["superseded"] += 1
+        if not superseded:
+            schedule(self.debounce_seconds, self.chat_shards.submit, chat_id, self.flush, chat_id, message_id, key=("coalesced_edit", chat_id, message_id))
+
+    def discard(self, chat_id: int, message_id: int) -> bool:
+        with self._lock:
+            if self._pending.pop((chat_id, message_id), None) is None:
+                return False
+            self._metrics["discarded"] += 1
+        cancel(("coalesced_edit", chat_id, message_id))
+        return True
+
+    def flush(self, chat_id: int, message_id: int) -> None:
+        with self._lock:
+            kwargs = self._pending.pop((chat_id, message_id), None)
+        if kwargs is None:
+            return
+        try:
+            self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, **kwargs)
+        except telebot.apihelper.ApiTelegramException as e:
+            if "message is not modified" in str(e).lower():
+                return
+            with self._lock:
+                self._metrics["failed"] += 1
+            logger.error(f"Error applying the coalesced edit of message {message_id} in chat {chat_id}: {e}")
+            return
+        with self._lock:
+            self._metrics["sent"] += 1
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["pending"] = len(self._pending)
+        return metrics
@@ -0,0 +1,363 @@
+"""Rate-limited outbound Telegram API calls.
+
+RateLimitedTeleBot queues message sends, edits and deletes for a small pool
+of worker threads instead of calling the API from the handler thread. The
+workers keep to a global token bucket (about 30 calls per second) and
+a per-chat bucket for new messages (about 20 per minute per group). They
+honor the retry_after of 429 responses, and they serve interactive edits
+before sends and sends before cleanup deletes.
+
+The usual methods (send_message, edit_message_text, ...) still block and
+return the API result. submit() returns a Future instead, and
+submit_nowait() is for sends and deletes whose result nobody reads, so a
+chat that is being held back does not stall the handler.
+
+AsyncOutboundDispatcher applies the same limits to the asyncio runtime.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import telebot
+from bot.config import TELEGRAM_GLOBAL_RATE_PER_SECOND, TELEGRAM_CHAT_RATE_PER_MINUTE, TELEGRAM_OUTBOUND_WORKERS, TELEGRAM_MAX_RETRIES
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+PRIORITY_EDIT = 0
+PRIORITY_SEND = 1
+PRIORITY_DELETE = 2
+PRIORITY_NAMES = ("edit", "send", "delete")
+
+# method name -> (priority, whether it counts against the per-chat bucket, position of chat_id in its arguments)
+ROUTED_METHODS = {
+    "edit_message_text": (PRIORITY_EDIT, False, 1),
+    "edit_message_reply_markup": (PRIORITY_EDIT, False, 0),
+    "send_message": (PRIORITY_SEND, True, 0),
+    "send_document": (PRIORITY_SEND, True, 0),
+    "forward_message": (PRIORITY_SEND, True, 0),
+    "forward_messages": (PRIORITY_SEND, True, 0),
+    "delete_message": (PRIORITY_DELETE, False, 0),
+    "delete_messages": (PRIORITY_DELETE, False, 0),
+}
+
+# Idle per-chat buckets are dropped once there are more than this many.
+MAX_CHAT_BUCKETS = 10000
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class _Call:
+    __slots__ = ("func", "args", "kwargs", "future", "chat_id", "limit_chat", "priority", "queued_at", "attempts")
+
+    def __init__(self, func, args, kwargs, chat_id, limit_chat, priority, future=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future() if future is None else future
+        self.chat_id = chat_id
+        self.limit_chat = limit_chat
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+def route_call(method_name: str, args: tuple, kwargs: dict) -> tuple[int, object, bool]:
+    """Returns (priority, chat_id, whether it counts against the per-chat bucket) for a routed method."""
+    priority, limit_chat, position = ROUTED_METHODS[method_name]
+    chat_id = kwargs.get("chat_id", args[position] if len(args) > position else None)
+    return priority, chat_id, limit_chat
+
+def _retry_after(error: Exception) -> float | None:
+    # The sync and the asyncio ApiTelegramException both carry error_code and result_json
+    if getattr(error, "error_code", None) != 429:
+        return None
+    return ((getattr(error, "result_json", None) or {}).get("parameters") or {}).get("retry_after", 1)
+
+class _RateLimits:
+    """Queues and buckets shared by the thread and the asyncio dispatcher; the caller serializes access."""
+
+    def __init__(self, global_rate: float, chat_rate_per_minute: float, max_retries: int):
+        self.chat_rate_per_minute = chat_rate_per_minute
+        self.max_retries = max_retries
+        self._queues = [deque() for _ in PRIORITY_NAMES]
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        # chat_id -> monotonic time until which a 429 told us to wait
+        self._paused_until = {}
+        self._metrics = {
+            "calls": 0,
+            "failed": 0,
+            "retries_429": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if not value.is_full(now)}
+            bucket = TokenBucket(self.chat_rate_per_minute / 60, self.chat_rate_per_minute)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _call_delay(self, call: _Call, now: float) -> float:
+        delay = self._paused_until.get(call.chat_id, 0.0) - now
+        if call.limit_chat:
+            delay = max(delay, self._chat_bucket(call.chat_id, now).delay(now))
+        return delay
+
+    def _take_call(self, now: float) -> tuple[_Call | None, float | None]:
+        """Takes the highest-priority call that may run now, or returns how long to wait for one."""
+        wait = self._global_bucket.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for calls in self._queues:
+            for index, call in enumerate(calls):
+                delay = self._call_delay(call, now)
+                if delay <= 0:
+                    del calls[index]
+                    self._global_bucket.take(now)
+                    if call.limit_chat:
+                        self._chat_bucket(call.chat_id, now).take(now)
+                    return call, None
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _requeue(self, call: _Call, retry_after: float) -> None:
+        name = getattr(call.func, "__name__", call.func)
+        logger.warning(f"Telegram asked to retry {name} in chat {call.chat_id} after {retry_after}s (attempt {call.attempts}).")
+        now = time.monotonic()
+        self._paused_until = {chat_id: until for chat_id, until in self._paused_until.items() if until > now}
+        self._paused_until[call.chat_id] = max(self._paused_until.get(call.chat_id, 0.0), now + retry_after)
+        self._queues[call.priority].appendleft(call)
+        self._metrics["retries_429"] += 1
+
+    def _count(self, waited: float, failed: bool) -> None:
+        self._metrics["calls"] += 1
+        self._metrics["wait_seconds_total"] += waited
+        self._metrics["wait_seconds_max"] = max(self._metrics["wait_seconds_max"], waited)
+        if failed:
+            self._metrics["failed"] += 1
+
+    def _snapshot_metrics(self) -> dict:
+        metrics = dict(self._metrics)
+        for name, calls in zip(PRIORITY_NAMES, self._queues):
+            metrics[f"queued_{name}"] = len(calls)
+        metrics["paused_chats"] = sum(1 for until in self._paused_until.values() if until > time.monotonic())
+        metrics["wait_seconds_avg"] = metrics["wait_seconds_total"] / metrics["calls"] if metrics["calls"] else 0.0
+        return metrics
+
+class OutboundDispatcher(_RateLimits):
+    def __init__(self, global_rate: float, chat_rate_per_minute: float, workers: int, max_retries: int):
+        super().__init__(global_rate, chat_rate_per_minute, max_retries)
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._threads = []
+        self._worker_idents = set()
+
+    def _start(self) -> None:
+        # Called with self._cond held
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"telegram-outbound-{i}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        logger.info(f"Outbound Telegram dispatcher started with {self.workers} worker(s).")
+
+    def is_worker_thread(self) -> bool:
+        return threading.get_ident() in self._worker_idents
+
+    def submit(self, priority: int, chat_id, limit_chat: bool, func, /, *args, **kwargs) -> Future:
+        call = _Call(func, args, kwargs, chat_id, limit_chat, priority)
+        with self._cond:
+            self._start()
+            self._queues[priority].append(call)
+            self._cond.notify()
+        return call.future
+
+    def _next_call(self) -> _Call:
+        """Blocks until the highest-priority call that may run now is found and takes its tokens."""
+        with self._cond:
+            while True:
+                call, wait = self._take_call(time.monotonic())
+                if call is not None:
+                    return call
+                self._cond.wait(timeout=wait)
+
+    def _run(self) -> None:
+        self._worker_idents.add(threading.get_ident())
+        while True:
+            call = self._next_call()
+            if call.attempts == 0 and not call.future.set_running_or_notify_cancel():
+                continue
+            waited = time.monotonic() - call.queued_at
+            call.attempts += 1
+            try:
+                result = call.func(*call.args, **call.kwargs)
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is not None and call.attempts <= self.max_retries:
+                    with self._cond:
+                        self._requeue(call, retry_after)
+                        self._cond.notify()
+                    continue
+                self._finish(call, waited, error=e)
+            else:
+                self._finish(call, waited, result=result)
+
+    def _finish(self, call: _Call, waited: float, result=None, error: Exception | None = None) -> None:
+        with self._cond:
+            self._count(waited, error is not None)
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    def get_metrics(self) -> dict:
+        with self._cond:
+            return self._snapshot_metrics()
+
+class AsyncOutboundDispatcher(_RateLimits):
+    """The same limits for coroutine API calls, e.g. AsyncTeleBot's.
+
+    Lives on one event loop, which serializes access. A call starts as its
+    own task as soon as the buckets allow it, so no worker count is needed.
+    """
+
+    def __init__(self, global_rate: float, chat_rate_per_minute: float, max_retries: int):
+        super().__init__(global_rate, chat_rate_per_minute, max_retries)
+        self._wakeup = None
+        self._task = None
+        self._running = set()
+
+    async def call(self, priority: int, chat_id, limit_chat: bool, func, /, *args, **kwargs):
+        """Awaits the coroutine function func(*args, **kwargs) once the limits allow it."""
+        loop = asyncio.get_running_loop()
+        call = _Call(func, args, kwargs, chat_id, limit_chat, priority, loop.create_future())
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+            logger.info("Async outbound Telegram dispatcher started.")
+        self._queues[priority].append(call)
+        self._wakeup.set()
+        return await call.future
+
+    async def _run(self) -> None:
+        while True:
+            call, wait = self._take_call(time.monotonic())
+            if call is not None:
+                if not call.future.done():
+                    task = asyncio.get_running_loop().create_task(self._execute(call))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, call: _Call) -> None:
+        waited = time.monotonic() - call.queued_at
+        call.attempts += 1
+        try:
+            result = await call.func(*call.args, **call.kwargs)
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None and call.attempts <= self.max_retries:
+                self._requeue(call, retry_after)
+                self._wakeup.set()
+                return
+            self._count(waited, True)
+            if not call.future.done():
+                call.future.set_exception(e)
+        else:
+            self._count(waited, False)
+            if not call.future.done():
+                call.future.set_result(result)
+
+    def get_metrics(self) -> dict:
+        return self._snapshot_metrics()
+
+def submit_nowait(bot, method_name: str, /, *args, **kwargs) -> Future:
+    """Queues a routed call on a RateLimitedTeleBot or AsyncBotFacade for a caller that doesn't need its result.
+
+    Failures are only logged; deleting a message that is already gone is not one.
+    """
+    def log_error(future: Future) -> None:
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        if ROUTED_METHODS[method_name][0] == PRIORITY_DELETE and getattr(error, "error_code", None) in (400, 403):
+            logger.info(f"Skipped {method_name}{args}: {error}")
+        else:
+            logger.error(f"Error in {method_name}{args}: {error}")
+    future = bot.submit(method_name, *args, **kwargs)
+    future.add_done_callback(log_error)
+    return future
+
+class RateLimitedTeleBot(telebot.TeleBot):
+    def __init__(self, token: str, *args, **kwargs):
+        super().__init__(token, *args, **kwargs)
+        self.outbound = OutboundDispatcher(TELEGRAM_GLOBAL_RATE_PER_SECOND, TELEGRAM_CHAT_RATE_PER_MINUTE, TELEGRAM_OUTBOUND_WORKERS, TELEGRAM_MAX_RETRIES)
+
+    def submit(self, method_name: str, /, *args, **kwargs) -> Future:
+        """Queues a routed API call and returns a Future for its result (e.g. the sent Message)."""
+        priority, chat_id, limit_chat = route_call(method_name, args, kwargs)
+        return self.outbound.submit(priority, chat_id, limit_chat, getattr(super(), method_name), *args, **kwargs)
+
+    def _call(self, method_name: str, *args, **kwargs):
+        # A routed method that calls another one from a worker runs it directly,
+        # so a worker never waits on its own queue.
+        if self.outbound.is_worker_thread():
+            return getattr(super(), method_name)(*args, **kwargs)
+        return self.submit(method_name, *args, **kwargs).result()
+
+    def send_message(self, *args, **kwargs):
+        return self._call("send_message", *args, **kwargs)
+
+    def send_document(self, *args, **kwargs):
+        return self._call("send_document", *args, **kwargs)
+
+    def forward_message(self, *args, **kwargs):
+        return self._call("forward_message", *args, **kwargs)
+
+    def forward_messages(self, *args, **kwargs):
+        return self._call("forward_messages", *args, **kwargs)
+
+    def edit_message_text(self, *args, **kwargs):
+        return self._call("edit_message_text", *args, **kwargs)
+
+    def edit_message_reply_markup(self, *args, **kwargs):
+        return self._call("edit_message_reply_markup", *args, **kwargs)
+
+    def delete_message(self, *args, **kwargs):
+        return self._call("delete_message", *args, **kwargs)
+
+    def delete_messages(self, *args, **kwargs):
+        return self._call("delete_messages", *args, **kwargs)
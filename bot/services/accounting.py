@@ -1,4 +1,30 @@
-from bot.db.repos import get_debts_for_group, get_user_balance_summary
+from collections import deque
+from datetime import date, datetime, time, timedelta
+from bot.db.connection import transaction
+from bot.db.writer import writes
+from bot.db.repos import (
+    create_expense,
+    create_expense_debtors,
+    get_expense_debtors,
+    update_debtor_status,
+    reject_expense,
+    upsert_debt,
+    upsert_debts,
+    update_file_relations,
+    delete_draft,
+    create_settlement,
+    get_settlement,
+    update_settlement_status,
+    create_debt_snapshot,
+    get_chats_with_unsnapshotted_debts,
+    get_latest_debt_snapshot,
+    get_debt_snapshot_balances,
+    get_debt_journal,
+    get_debt_pairs,
+    get_last_debt_journal_id_at,
+    get_user_display_names,
+)
+from bot.services.balance_cache import get_debts_for_group, get_user_balance_summary
 from bot.logger import get_logger
 
 logger = get_logger(__name__)
@@ -10,3 +36,200 @@ def get_all_balances(chat_id: int) -> list[dict]:
 def get_my_balance(user_id: int, chat_id: int) -> dict:
     logger.info(f"Fetching balance summary for user {user_id} in chat {chat_id}")
     return get_user_balance_summary(user_id, chat_id)
+
+def _net_pair(nets: dict, from_user_id: int, to_user_id: int, amount_u5: int) -> None:
+    # Same netting as the debts table: one signed amount per unordered pair.
+    if from_user_id == to_user_id:
+        return
+    if from_user_id < to_user_id:
+        nets[(from_user_id, to_user_id)] = nets.get((from_user_id, to_user_id), 0) + amount_u5
+    else:
+        nets[(to_user_id, from_user_id)] = nets.get((to_user_id, from_user_id), 0) - amount_u5
+
+def replay_debts(chat_id: int, up_to_journal_id: int | None = None) -> list[dict]:
+    """Rebuilds the chat's debts from the journal, starting at the nearest snapshot.
+
+    Returns rows shaped like the debts table as of up_to_journal_id, or as of
+    the latest journal entry when it is None.
+    """
+    nets = {}
+    after_id = 0
+    snapshot = get_latest_debt_snapshot(chat_id, up_to_journal_id)
+    if snapshot:
+        after_id = snapshot['journal_id']
+        for row in get_debt_snapshot_balances(snapshot['id']):
+            _net_pair(nets, row['from_user_id'], row['to_user_id'], row['amount_u5'])
+    for entry in get_debt_journal(chat_id, after_id, up_to_journal_id):
+        _net_pair(nets, entry['from_user_id'], entry['to_user_id'], entry['amount_u5'])
+
+    debts = []
+    for (user_lo, user_hi), amount_u5 in nets.items():
+        if amount_u5 > 0:
+            debts.append({'from_user_id': user_lo, 'to_user_id': user_hi, 'amount_u5': amount_u5})
+        elif amount_u5 < 0:
+            debts.append({'from_user_id': user_hi, 'to_user_id': user_lo, 'amount_u5': -amount_u5})
+    return debts
+
+def get_balances_as_of(chat_id: int, ts: datetime) -> list[dict]:
+    """Returns the chat's debts as they stood at ts, in the configured timezone.
+
+    The last journal entry at ts is found by index, and the debts are replayed
+    from the nearest snapshot before it. Rows are shaped like get_all_balances.
+    """
+    journal_id = get_last_debt_journal_id_at(chat_id, ts.strftime('%Y-%m-%d %H:%M:%S'))
+    if journal_id is None:
+        return []
+    debts = replay_debts(chat_id, journal_id)
+    names = get_user_display_names(list({debt['from_user_id'] for debt in debts} | {debt['to_user_id'] for debt in debts}))
+    for debt in debts:
+        debt['from_user_display_name'] = names.get(debt['from_user_id'])
+        debt['to_user_display_name'] = names.get(debt['to_user_id'])
+    return debts
+
+def get_month_end_balances(chat_id: int, year: int, month: int) -> list[dict]:
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return get_balances_as_of(chat_id, datetime.combine(next_month, time.min) - timedelta(seconds=1))
+
+def snapshot_debts() -> int:
+    """Snapshots every chat whose journal moved since its last snapshot."""
+    created = 0
+    for chat_id in get_chats_with_unsnapshotted_debts():
+        if create_debt_snapshot(chat_id) is not None:
+            created += 1
+    if created:
+        logger.info(f"Created debt snapshots for {created} chat(s).")
+    return created
+
+def _find_debt_path(owes: dict, from_user_id: int, to_user_id: int) -> list[tuple[int, int]] | None:
+    """Shortest chain of debts leading from from_user_id to to_user_id, as (debtor, creditor) edges."""
+    previous = {from_user_id: None}
+    queue = deque([from_user_id])
+    while queue:
+        user_id = queue.popleft()
+        if user_id == to_user_id:
+            path = []
+            while previous[user_id] is not None:
+                path.append((previous[user_id], user_id))
+                user_id = previous[user_id]
+            return path[::-1]
+        for creditor_id in owes.get(user_id, {}):
+            if creditor_id not in previous:
+                previous[creditor_id] = user_id
+                queue.append(creditor_id)
+    return None
+
+def _cancel_settlement_cycles(chat_id: int, from_user_id: int, to_user_id: int, settlement_id: int) -> None:
+    """Books a settlement with a suggested payee along the chain of debts it replaces.
+
+    Paying a suggested payee (A owes B, B owes C, A pays C) leaves C owing A,
+    which closes a cycle with the chain the payment replaced. Each cycle is
+    cancelled with 'settlement_cycle' journal entries that move nobody's net
+    position. Only settlements made through the Suggested button get here;
+    any other payment is recorded between payer and payee only.
+    Must run inside the settlement's transaction.
+    """
+    owes = {}
+    for pair in get_debt_pairs(chat_id):
+        if pair['amount_u5'] > 0:
+            owes.setdefault(pair['user_lo'], {})[pair['user_hi']] = pair['amount_u5']
+        elif pair['amount_u5'] < 0:
+            owes.setdefault(pair['user_hi'], {})[pair['user_lo']] = -pair['amount_u5']
+
+    excess_u5 = owes.get(to_user_id, {}).get(from_user_id, 0)
+    entries = []
+    while excess_u5 > 0:
+        path = _find_debt_path(owes, from_user_id, to_user_id)
+        if not path:
+            break
+        amount_u5 = min(excess_u5, *(owes[debtor_id][creditor_id] for debtor_id, creditor_id in path))
+        for debtor_id, creditor_id in path:
+            owes[debtor_id][creditor_id] -= amount_u5
+            if not owes[debtor_id][creditor_id]:
+                del owes[debtor_id][creditor_id]
+            entries.append((creditor_id, debtor_id, amount_u5))
+        entries.append((from_user_id, to_user_id, amount_u5))
+        excess_u5 -= amount_u5
+    if entries:
+        upsert_debts(chat_id, entries, 'settlement_cycle', settlement_id)
+        logger.info(f"Cancelled {len(entries)} cycle entries after settlement {settlement_id} in chat {chat_id}.")
+
+# The functions below are units of work: every repo call they make joins one
+# transaction, so each of them is applied with a single commit or not at all.
+
+@writes
+def publish_expense(chat_id: int, payer_id: int, amount_u5: int, description: str | None, category: str, debtors: list[int], share_u5: int, files: list[dict], draft_id: int, auto_confirm_users: list[int]) -> int:
+    confirmed_debtors = [debtor_id for debtor_id in debtors if debtor_id in auto_confirm_users]
+    with transaction():
+        expense_id = create_expense(chat_id, payer_id, amount_u5, description, category)
+        create_expense_debtors(expense_id, debtors, share_u5, confirmed_debtors)
+
+        # Create the debts right away if every debtor was auto-confirmed
+        if len(confirmed_debtors) == len(debtors):
+            upsert_debts(chat_id, [(debtor_id, payer_id, share_u5) for debtor_id in debtors], 'expense', expense_id)
+
+        update_file_relations([file_info['file_row_id'] for file_info in files], "expense", expense_id)
+        delete_draft(draft_id)
+    logger.info(f"Published expense {expense_id} in chat {chat_id} with {len(debtors)} debtors.")
+    return expense_id
+
+@writes
+def confirm_expense_debtor(expense: dict, debtor_id: int) -> list[dict] | None:
+    """Confirms one debtor's share and creates the debts once everyone has confirmed.
+
+    Returns the refreshed debtors, or None if the share was no longer pending.
+    """
+    with transaction():
+        expense_id = expense['id']
+        expense_debtors = get_expense_debtors(expense_id)
+        debtor = next((d for d in expense_debtors if d['debtor_id'] == debtor_id), None)
+        if not debtor or debtor['status'] != 'pending':
+            return None
+
+        update_debtor_status(expense_id, debtor_id, 'confirmed')
+        debtor['status'] = 'confirmed'
+        if all(d['status'] == 'confirmed' for d in expense_debtors):
+            upsert_debts(expense['chat_id'], [(d['debtor_id'], expense['payer_id'], d['share_u5']) for d in expense_debtors], 'expense', expense_id)
+        return expense_debtors
+
+@writes
+def reject_expense_debtor(expense_id: int, debtor_id: int) -> None:
+    with transaction():
+        update_debtor_status(expense_id, debtor_id, 'rejected')
+        reject_expense(expense_id)
+
+@writes
+def publish_settlement(chat_id: int, from_user_id: int, to_user_id: int, amount_u5: int, files: list[dict], draft_id: int, auto_confirm: bool, suggested_payee: bool = False) -> int:
+    with transaction():
+        settlement_id = create_settlement(chat_id, from_user_id, to_user_id, amount_u5, suggested_payee)
+        if auto_confirm:
+            update_settlement_status(settlement_id, 'confirmed')
+            upsert_debt(chat_id, to_user_id, from_user_id, amount_u5, 'settlement', settlement_id)
+            if suggested_payee:
+                _cancel_settlement_cycles(chat_id, from_user_id, to_user_id, settlement_id)
+
+        update_file_relations([file_info['file_row_id'] for file_info in files], "settlement", settlement_id)
+
+        delete_draft(draft_id)
+    logger.info(f"Published settlement {settlement_id} in chat {chat_id} (auto-confirmed: {auto_confirm}).")
+    return settlement_id
+
+@writes
+def confirm_settlement(settlement: dict) -> bool:
+    """Confirms a pending settlement; returns False if it was no longer pending."""
+    with transaction():
+        # Re-read inside the transaction, so a double tap cannot book it twice
+        current = get_settlement(settlement['id'])
+        if not current or current['status'] != 'pending':
+            return False
+        update_settlement_status(settlement['id'], 'confirmed')
+        upsert_debt(settlement['chat_id'], settlement['to_user_id'], settlement['from_user_id'], settlement['amount_u5'], 'settlement', settlement['id'])
+        if current['suggested_payee']:
+            _cancel_settlement_cycles(settlement['chat_id'], settlement['from_user_id'], settlement['to_user_id'], settlement['id'])
+    return True
+
+@writes
+def clear_debt(chat_id: int, payee_id: int, debtor_id: int, amount_u5: int, draft_id: int) -> None:
+    with transaction():
+        # To clear the debt, we credit the payee from the debtor
+        upsert_debt(chat_id, payee_id, debtor_id, amount_u5, 'clear_debt')
+        delete_draft(draft_id)
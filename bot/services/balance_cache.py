@@ -0,0 +1,136 @@
+"""In-process cache of each chat's debt graph.
+
+Entries are tagged with the chat's ledger version and stay valid until this
+process commits a debt write for the chat, so repeated balance reads in the
+wizards and menus never reach SQLite. Idle chats are evicted least recently
+used first. Debts written by another process (e.g. `verify-ledger --repair`)
+are picked up by comparing the entry with groups.ledger_version once it is
+older than BALANCE_CACHE_RECHECK_SECONDS.
+
+Members' totals come from the trigger-maintained member_balances table,
+read together with the debts when an entry is loaded.
+
+The read functions mirror the signatures of their counterparts in repos.
+"""
+import threading
+import time
+from collections import OrderedDict
+from bot.config import BALANCE_CACHE_MAX_CHATS, BALANCE_CACHE_RECHECK_SECONDS
+from bot.db.repos import get_committed_ledger_version, get_debt_graph, get_ledger_version
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Debts below this are rounding dust and are left out of the balance views.
+DISPLAY_MIN_U5 = 100
+
+class ChatBalances:
+    """One chat's debts and member totals as of a ledger version, indexed by pair and by member."""
+
+    def __init__(self, ledger_version: int, debts: list[dict], totals: dict[int, tuple[int, int]]):
+        self.ledger_version = ledger_version
+        self.debts = debts
+        self.totals = totals
+        # When the ledger version was last confirmed against the database
+        self.checked_at = time.monotonic()
+        self.pairs = {}
+        self.by_user = {}
+        for debt in debts:
+            self.pairs[(debt['from_user_id'], debt['to_user_id'])] = debt['amount_u5']
+            self.by_user.setdefault(debt['from_user_id'], []).append(debt)
+            self.by_user.setdefault(debt['to_user_id'], []).append(debt)
+        # Filled in lazily by bot.services.simplify
+        self.simplified = None
+
+class BalanceCache:
+    def __init__(self, max_chats: int, recheck_seconds: float):
+        self.max_chats = max_chats
+        self.recheck_seconds = recheck_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "evictions": 0, "rechecks": 0}
+
+    def _is_current(self, chat_id: int, entry: ChatBalances) -> bool:
+        # Catches debt writes committed by another process, which this one never sees
+        if time.monotonic() - entry.checked_at < self.recheck_seconds:
+            return True
+        with self._lock:
+            self._metrics["rechecks"] += 1
+        if get_ledger_version(chat_id) > entry.ledger_version:
+            return False
+        entry.checked_at = time.monotonic()
+        return True
+
+    def get(self, chat_id: int) -> ChatBalances:
+        committed_version = get_committed_ledger_version(chat_id)
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None and committed_version is not None and committed_version > entry.ledger_version:
+                entry = None
+        if entry is not None and self._is_current(chat_id, entry):
+            with self._lock:
+                if chat_id in self._entries:
+                    self._entries.move_to_end(chat_id)
+                self._metrics["hits"] += 1
+            return entry
+        with self._lock:
+            self._metrics["misses"] += 1
+
+        # get_debt_graph reads the version before the debts, so a write landing
+        # in between leaves an entry that is already outdated, never a stale one
+        # that looks current.
+        graph = get_debt_graph(chat_id)
+        entry = ChatBalances(graph['ledger_version'], graph['debts'], graph['totals'])
+        with self._lock:
+            current = self._entries.get(chat_id)
+            if current is None or current.ledger_version <= entry.ledger_version:
+                self._entries[chat_id] = entry
+                self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_chats:
+                self._entries.popitem(last=False)
+                self._metrics["evictions"] += 1
+        logger.debug(f"Loaded {len(entry.debts)} debt(s) of chat {chat_id} at ledger version {entry.ledger_version} into the balance cache.")
+        return entry
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["chats"] = len(self._entries)
+        metrics["max_chats"] = self.max_chats
+        return metrics
+
+_cache = BalanceCache(BALANCE_CACHE_MAX_CHATS, BALANCE_CACHE_RECHECK_SECONDS)
+
+def get_chat_balances(chat_id: int) -> ChatBalances:
+    return _cache.get(chat_id)
+
+def get_balance_cache_metrics() -> dict:
+    return _cache.get_metrics()
+
+def get_debts_for_group(chat_id: int) -> list[dict]:
+    return [dict(debt) for debt in get_chat_balances(chat_id).debts if debt['amount_u5'] >= DISPLAY_MIN_U5]
+
+def get_user_balance_summary(user_id: int, chat_id: int) -> dict:
+    balances = get_chat_balances(chat_id)
+    debts = balances.by_user.get(user_id, [])
+    total_owed, total_owed_to_user = balances.totals.get(user_id, (0, 0))
+    return {
+        'total_owed': total_owed,
+        'total_owed_to_user': total_owed_to_user,
+        'detailed_debts': [dict(debt) for debt in debts if debt['amount_u5'] >= DISPLAY_MIN_U5],
+    }
+
+def get_users_owed_by_user(user_id: int, chat_id: int) -> list[dict]:
+    return [
+        {'user_id': debt['to_user_id'], 'display_name': debt['to_user_display_name'], 'amount_u5': debt['amount_u5']}
+        for debt in get_chat_balances(chat_id).by_user.get(user_id, [])
+        if debt['from_user_id'] == user_id and debt['amount_u5'] >= DISPLAY_MIN_U5
+    ]
+
+def get_debt_between_users(chat_id: int, user1_id: int, user2_id: int) -> int:
+    """Returns what user1 owes user2; negative if user2 owes user1."""
+    pairs = get_chat_balances(chat_id).pairs
+    return pairs.get((user1_id, user2_id), 0) - pairs.get((user2_id, user1_id), 0)
+
+def get_owed_amount(chat_id: int, from_user_id: int, to_user_id: int) -> int:
+    return max(get_debt_between_users(chat_id, from_user_id, to_user_id), 0)
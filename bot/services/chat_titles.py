@@ -0,0 +1,63 @@
+"""Group titles for menu and report headers, without a getChat per button press.
+
+Titles are kept in memory for CHAT_TITLE_TTL_SECONDS and persisted in
+groups.title. new_chat_title service messages update both right away; the
+TTL only bounds how long a rename the bot missed stays visible.
+"""
+import threading
+import time
+import telebot
+from bot.config import CHAT_TITLE_TTL_SECONDS
+from bot.db.repos import get_group_title, set_group_title
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_GROUP_NAME = "Your Group Name"
+
+class ChatTitleCache:
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        # chat_id -> (title, monotonic time it was last confirmed)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, bot: telebot.TeleBot, chat_id: int) -> str:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(chat_id)
+        if entry is not None and now - entry[1] < self.ttl_seconds:
+            return entry[0]
+
+        if entry is None:
+            stored = get_group_title(chat_id)
+            if stored:
+                self._remember(chat_id, stored, now)
+                return stored
+
+        try:
+            title = bot.get_chat(chat_id).title
+        except telebot.apihelper.ApiTelegramException as e:
+            logger.warning(f"Could not fetch the title of chat {chat_id}: {e}")
+            return entry[0] if entry is not None else DEFAULT_GROUP_NAME
+        if title and (entry is None or entry[0] != title):
+            set_group_title(chat_id, title)
+        title = title or DEFAULT_GROUP_NAME
+        self._remember(chat_id, title, now)
+        return title
+
+    def set(self, chat_id: int, title: str) -> None:
+        set_group_title(chat_id, title)
+        self._remember(chat_id, title, time.monotonic())
+
+    def _remember(self, chat_id: int, title: str, confirmed_at: float) -> None:
+        with self._lock:
+            self._entries[chat_id] = (title, confirmed_at)
+
+_cache = ChatTitleCache(CHAT_TITLE_TTL_SECONDS)
+
+def get_group_name(bot: telebot.TeleBot, chat_id: int) -> str:
+    return _cache.get(bot, chat_id)
+
+def update_group_name(chat_id: int, title: str) -> None:
+    _cache.set(chat_id, title)
@@ -4,9 +4,11 @@ from datetime import datetime
 from bot.logger import get_logger
 from bot.config import DRAFT_TTL_SECONDS
 from bot.db.connection import get_connection
+from bot.db.writer import writes
 
 logger = get_logger(__name__)
 
+@writes
 def expire_drafts() -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
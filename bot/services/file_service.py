@@ -4,6 +4,8 @@ import telebot
 from bot.logger import get_logger
 from bot.config import FILES_CHANNEL_ID
 from bot.db.connection import get_connection
+from bot.db.writer import writes
+from bot.outbound import submit_nowait
 
 logger = get_logger(__name__)
 
@@ -25,6 +27,39 @@ def forward_to_files_channel(bot: telebot.TeleBot, message: telebot.types.Messag
         logger.error(f"Failed to forward file message {message.message_id} to channel {FILES_CHANNEL_ID}: {e}")
         return None
 
+def forward_album_to_files_channel(bot: telebot.TeleBot, chat_id: int, message_ids: list[int]) -> list[int | None]:
+    """Forwards an album with one forwardMessages call.
+
+    Returns the channel message id of each source message, in order; None
+    where the message could not be forwarded.
+    """
+    if not FILES_CHANNEL_ID:
+        logger.warning("FILES_CHANNEL_ID is not set in config. Skipping file forwarding.")
+        return [None] * len(message_ids)
+
+    try:
+        forwarded = bot.forward_messages(FILES_CHANNEL_ID, chat_id, message_ids)
+    except telebot.apihelper.ApiTelegramException as e:
+        logger.error(f"Failed to forward album messages {message_ids} to channel {FILES_CHANNEL_ID}: {e}")
+        return [None] * len(message_ids)
+    if len(forwarded) == len(message_ids):
+        logger.info(f"Album messages {message_ids} from chat {chat_id} forwarded to channel {FILES_CHANNEL_ID} as {[m.message_id for m in forwarded]}.")
+        return [m.message_id for m in forwarded]
+
+    # Telegram skips messages it cannot forward, so the copies can't be matched
+    # to their sources; drop them and forward one by one instead.
+    logger.warning(f"Only {len(forwarded)} of {len(message_ids)} album messages from chat {chat_id} were forwarded; retrying individually.")
+    submit_nowait(bot, "delete_messages", FILES_CHANNEL_ID, [m.message_id for m in forwarded])
+    channel_message_ids = []
+    for message_id in message_ids:
+        try:
+            channel_message_ids.append(bot.forward_message(FILES_CHANNEL_ID, chat_id, message_id).message_id)
+        except telebot.apihelper.ApiTelegramException as e:
+            logger.error(f"Failed to forward file message {message_id} to channel {FILES_CHANNEL_ID}: {e}")
+            channel_message_ids.append(None)
+    return channel_message_ids
+
+@writes
 def store_file_ref(file_id: str, origin_channel_message_id: int, uploader_user_id: int, related_type: str, related_id: str, mime: str | None, size: int | None) -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -33,3 +68,18 @@ def store_file_ref(file_id: str, origin_channel_message_id: int, uploader_user_i
         file_row_id = cursor.lastrowid
         logger.info(f"Stored file reference with ID: {file_row_id} for file_id: {file_id}.")
         return file_row_id
+
+@writes
+def store_file_refs(refs: list[tuple]) -> list[int]:
+    """Stores several file references in one transaction; each ref has the arguments of store_file_ref.
+
+    Returns the row ids in order.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        file_row_ids = []
+        for ref in refs:
+            cursor.execute("INSERT INTO files (file_id, origin_channel_message_id, uploader_user_id, related_type, related_id, mime, size) VALUES (?, ?, ?, ?, ?, ?, ?)", ref)
+            file_row_ids.append(cursor.lastrowid)
+        logger.info(f"Stored {len(file_row_ids)} file references with IDs: {file_row_ids}.")
+        return file_row_ids
@@ -0,0 +1,177 @@
+"""Rebuilds the debt ledger from its sources and diffs it against debt_pairs.
+
+The expected balance of every pair in a chat is made of:
+- confirmed expenses: each debtor owes the payer their share;
+- confirmed settlements: the payee owes the payer the amount paid back;
+- manual journal entries (MANUAL_SOURCE_TYPES), which have no source record.
+
+Rows are streamed in keyset order, so memory is bounded by the number of
+pairs in one chat. Each run stores a checkpoint per chat covering the rows up
+to the first one that can still change (a pending expense or settlement), and
+the next run resumes from there.
+"""
+import time
+from bot.config import LEDGER_VERIFY_BATCH_SIZE
+from bot.db.connection import transaction
+from bot.db.writer import writes
+from bot.db.repos import (
+    get_chat_ids_after,
+    get_expenses_after,
+    get_debtor_shares,
+    get_settlements_after,
+    get_debt_journal,
+    get_debt_pairs,
+    get_ledger_checkpoint,
+    save_ledger_checkpoint,
+    get_ledger_version,
+    upsert_debts,
+)
+from bot.services.accounting import _net_pair
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Journal sources that change debts without an expense or settlement behind
+# them ('settlement_cycle' entries cancel debt cycles and net to zero). 'repair'
+# entries are corrections of the ledger, not part of the expected balances.
+MANUAL_SOURCE_TYPES = ('clear_debt', 'migration', 'settlement_cycle')
+
+# How often a chat is re-read when its ledger changes during verification.
+CHAT_ATTEMPTS = 3
+
+def _stream_expenses(chat_id: int, after_id: int, stable: dict, recent: dict) -> int:
+    """Nets the chat's confirmed expenses after after_id and returns the new low-water mark."""
+    mark = after_id
+    final = True
+    while True:
+        expenses = get_expenses_after(chat_id, after_id, LEDGER_VERIFY_BATCH_SIZE)
+        if not expenses:
+            return mark
+        shares = {}
+        confirmed_ids = [expense['id'] for expense in expenses if expense['status'] == 'confirmed']
+        for share in get_debtor_shares(confirmed_ids) if confirmed_ids else []:
+            shares.setdefault(share['expense_id'], []).append(share)
+
+        for expense in expenses:
+            final = final and expense['status'] != 'pending'
+            if final:
+                mark = expense['id']
+            nets = stable if final else recent
+            for share in shares.get(expense['id'], []):
+                _net_pair(nets, share['debtor_id'], expense['payer_id'], share['share_u5'])
+        after_id = expenses[-1]['id']
+
+def _stream_settlements(chat_id: int, after_id: int, stable: dict, recent: dict) -> int:
+    """Nets the chat's confirmed settlements after after_id and returns the new low-water mark."""
+    mark = after_id
+    final = True
+    while True:
+        settlements = get_settlements_after(chat_id, after_id, LEDGER_VERIFY_BATCH_SIZE)
+        if not settlements:
+            return mark
+        for settlement in settlements:
+            final = final and settlement['status'] != 'pending'
+            if final:
+                mark = settlement['id']
+            if settlement['status'] == 'confirmed':
+                nets = stable if final else recent
+                _net_pair(nets, settlement['to_user_id'], settlement['from_user_id'], settlement['amount_u5'])
+        after_id = settlements[-1]['id']
+
+def _stream_manual_entries(chat_id: int, after_id: int, stable: dict) -> int:
+    """Nets the chat's manual journal entries after after_id and returns the last id read."""
+    while True:
+        entries = get_debt_journal(chat_id, after_id, limit=LEDGER_VERIFY_BATCH_SIZE)
+        if not entries:
+            return after_id
+        for entry in entries:
+            if entry['source_type'] in MANUAL_SOURCE_TYPES:
+                _net_pair(stable, entry['from_user_id'], entry['to_user_id'], entry['amount_u5'])
+        after_id = entries[-1]['id']
+
+def _rebuild_chat(chat_id: int, full: bool) -> tuple[dict, tuple[int, int, int, dict]]:
+    checkpoint = None if full else get_ledger_checkpoint(chat_id)
+    stable = dict(checkpoint['balances']) if checkpoint else {}
+    recent = {}
+    expense_mark = _stream_expenses(chat_id, checkpoint['expense_id'] if checkpoint else 0, stable, recent)
+    settlement_mark = _stream_settlements(chat_id, checkpoint['settlement_id'] if checkpoint else 0, stable, recent)
+    journal_mark = _stream_manual_entries(chat_id, checkpoint['journal_id'] if checkpoint else 0, stable)
+
+    expected = dict(stable)
+    for pair, amount_u5 in recent.items():
+        expected[pair] = expected.get(pair, 0) + amount_u5
+    return expected, (expense_mark, settlement_mark, journal_mark, stable)
+
+def verify_chat_ledger(chat_id: int, full: bool = False) -> list[dict]:
+    """Returns the pairs whose stored balance differs from the one rebuilt from the sources."""
+    for attempt in range(1, CHAT_ATTEMPTS + 1):
+        ledger_version = get_ledger_version(chat_id)
+        expected, checkpoint = _rebuild_chat(chat_id, full)
+        stored = {(row['user_lo'], row['user_hi']): row['amount_u5'] for row in get_debt_pairs(chat_id)}
+        # A debt written while we were reading makes the comparison meaningless; read again.
+        if get_ledger_version(chat_id) == ledger_version:
+            break
+        logger.info(f"Ledger of chat {chat_id} changed during verification (attempt {attempt}/{CHAT_ATTEMPTS}).")
+    else:
+        logger.warning(f"Skipped chat {chat_id}: its ledger kept changing during verification.")
+        return []
+
+    save_ledger_checkpoint(chat_id, *checkpoint)
+    differences = []
+    for user_lo, user_hi in sorted(expected.keys() | stored.keys()):
+        expected_u5 = expected.get((user_lo, user_hi), 0)
+        stored_u5 = stored.get((user_lo, user_hi), 0)
+        if expected_u5 != stored_u5:
+            differences.append({
+                'chat_id': chat_id,
+                'user_lo': user_lo,
+                'user_hi': user_hi,
+                'expected_u5': expected_u5,
+                'stored_u5': stored_u5,
+            })
+    return differences
+
+def verify_ledger(full: bool = False, chat_id: int | None = None) -> list[dict]:
+    """Verifies one chat or every chat; full=True ignores the stored checkpoints."""
+    started = time.perf_counter()
+    differences = []
+    chats = 0
+    if chat_id is not None:
+        differences = verify_chat_ledger(chat_id, full)
+        chats = 1
+    else:
+        after_chat_id = -2**63
+        while chat_ids := get_chat_ids_after(after_chat_id, LEDGER_VERIFY_BATCH_SIZE):
+            for current_chat_id in chat_ids:
+                differences.extend(verify_chat_ledger(current_chat_id, full))
+            chats += len(chat_ids)
+            after_chat_id = chat_ids[-1]
+    logger.info(f"Verified the ledger of {chats} chat(s) in {time.perf_counter() - started:.2f} s; {len(differences)} pair(s) differ.")
+    return differences
+
+@writes
+def repair_ledger(differences: list[dict]) -> int:
+    """Books the missing amounts as 'repair' journal entries in one transaction.
+
+    Only the drift found by verification is booked, so debts written since
+    then are kept as they are. Returns the number of pairs changed.
+    """
+    by_chat = {}
+    for difference in differences:
+        by_chat.setdefault(difference['chat_id'], []).append(difference)
+    repaired = 0
+    with transaction():
+        for chat_id, chat_differences in by_chat.items():
+            debts = []
+            for difference in chat_differences:
+                user_lo, user_hi = difference['user_lo'], difference['user_hi']
+                delta_u5 = difference['expected_u5'] - difference['stored_u5']
+                if delta_u5 > 0:
+                    debts.append((user_lo, user_hi, delta_u5))
+                elif delta_u5 < 0:
+                    debts.append((user_hi, user_lo, -delta_u5))
+            if debts:
+                upsert_debts(chat_id, debts, 'repair')
+                repaired += len(debts)
+    logger.info(f"Repaired {repaired} debt pair(s) across {len(by_chat)} chat(s).")
+    return repaired
@@ -0,0 +1,191 @@
+"""One scheduler thread for the bot's delayed work.
+
+Jobs sit in a heap ordered by due time. The scheduler thread hands due jobs
+to a small worker pool, so a slow job does not hold up the others. Jobs
+can be given a key: scheduling the same key again replaces the pending job,
+and cancel(key) drops it.
+
+Message deletions are also written to the scheduled_deletions table and
+resumed by start_scheduler(), so a warning that was due to disappear still
+does after a restart.
+"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from bot.config import SCHEDULER_WORKERS
+from bot.db.repos import add_scheduled_deletion, delete_scheduled_deletion, get_scheduled_deletions
+from bot.logger import get_logger
+from bot.outbound import submit_nowait
+
+logger = get_logger(__name__)
+
+# How long a deletion that failed for a transient reason waits before it is tried again
+DELETION_RETRY_SECONDS = 60.0
+
+class _Job:
+    __slots__ = ("key", "due", "func", "args", "kwargs", "cancelled")
+
+    def __init__(self, key, due, func, args, kwargs):
+        self.key = key
+        self.due = due
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+class Scheduler:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._metrics = {
+            "scheduled": 0,
+            "run": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "lag_seconds_total": 0.0,
+            "lag_seconds_max": 0.0,
+        }
+
+    def _start(self) -> None:
+        # Called with self._cond held
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler-job")
+            self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self._thread.start()
+            logger.info(f"Scheduler started with {self.workers} worker(s).")
+
+    def schedule(self, delay: float, func, *args, key=None, **kwargs):
+        """Runs func(*args, **kwargs) after delay seconds and returns the job's key."""
+        with self._cond:
+            self._start()
+            if key is None:
+                key = ("job", next(self._seq))
+            self._cancel(key)
+            job = _Job(key, time.monotonic() + max(delay, 0.0), func, args, kwargs)
+            self._jobs[key] = job
+            heapq.heappush(self._heap, (job.due, next(self._seq), job))
+            self._metrics["scheduled"] += 1
+            self._cond.notify()
+        return key
+
+    def cancel(self, key) -> bool:
+        with self._cond:
+            return self._cancel(key)
+
+    def _cancel(self, key) -> bool:
+        job = self._jobs.pop(key, None)
+        if job is None:
+            return False
+        # Left in the heap and skipped when it comes due
+        job.cancelled = True
+        self._metrics["cancelled"] += 1
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(timeout=wait)
+                _, _, job = heapq.heappop(self._heap)
+                del self._jobs[job.key]
+                lag = time.monotonic() - job.due
+                self._metrics["lag_seconds_total"] += lag
+                self._metrics["lag_seconds_max"] = max(self._metrics["lag_seconds_max"], lag)
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job: _Job) -> None:
+        try:
+            job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            with self._cond:
+                self._metrics["failed"] += 1
+            logger.error(f"Scheduled job {job.key} failed: {e}", exc_info=True)
+            return
+        with self._cond:
+            self._metrics["run"] += 1
+
+    def get_metrics(self) -> dict:
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics["queue_size"] = len(self._jobs)
+            metrics["next_due_seconds"] = max(self._heap[0][0] - time.monotonic(), 0.0) if self._heap else None
+        started = metrics["run"] + metrics["failed"]
+        metrics["lag_seconds_avg"] = metrics["lag_seconds_total"] / started if started else 0.0
+        return metrics
+
+_scheduler = Scheduler(SCHEDULER_WORKERS)
+_deletion_handler = None
+
+def schedule(delay: float, func, *args, key=None, **kwargs):
+    return _scheduler.schedule(delay, func, *args, key=key, **kwargs)
+
+def cancel(key) -> bool:
+    return _scheduler.cancel(key)
+
+def get_scheduler_metrics() -> dict:
+    return _scheduler.get_metrics()
+
+def _finish_deletion(chat_id: int, message_id: int, error: BaseException | None) -> None:
+    # 400/403: the message is already gone or can no longer be deleted, so retrying is pointless
+    if error is None or getattr(error, "error_code", None) in (400, 403):
+        delete_scheduled_deletion.submit(chat_id, message_id)
+        return
+    logger.warning(f"Deleting message {message_id} in chat {chat_id} failed ({error}); retrying in {DELETION_RETRY_SECONDS}s.")
+    _scheduler.schedule(DELETION_RETRY_SECONDS, _run_deletion, chat_id, message_id, key=("delete", chat_id, message_id))
+
+def _run_deletion(chat_id: int, message_id: int) -> None:
+    """Runs the deletion handler and forgets the deletion only once it has gone through.
+
+    The handler may queue the call and return a Future; the row is then kept
+    until the Future is done, so a restart in between still deletes the message.
+    """
+    if _deletion_handler is None:
+        logger.warning(f"No deletion handler registered; message {message_id} in chat {chat_id} stays until the next start.")
+        return
+    try:
+        result = _deletion_handler(chat_id, message_id)
+    except Exception as e:
+        _finish_deletion(chat_id, message_id, e)
+        return
+    if isinstance(result, Future):
+        result.add_done_callback(lambda future: _finish_deletion(chat_id, message_id, future.exception()))
+    else:
+        _finish_deletion(chat_id, message_id, None)
+
+def schedule_deletion(chat_id: int, message_id: int, delay: float) -> None:
+    """Deletes the message after delay seconds, even if the bot restarts in between."""
+    add_scheduled_deletion.submit(chat_id, message_id, time.time() + delay)
+    _scheduler.schedule(delay, _run_deletion, chat_id, message_id, key=("delete", chat_id, message_id))
+
+def send_temporary_message(bot, chat_id: int, text: str, delay: float, **kwargs) -> None:
+    """Queues a message without waiting for it and deletes it delay seconds after it was sent."""
+    def schedule_after_send(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            schedule_deletion(chat_id, future.result().message_id, delay)
+    submit_nowait(bot, "send_message", chat_id, text, **kwargs).add_done_callback(schedule_after_send)
+
+def start_scheduler(deletion_handler) -> None:
+    """Registers the function that deletes messages and resumes the persisted deletions."""
+    global _deletion_handler
+    _deletion_handler = deletion_handler
+    pending = get_scheduled_deletions()
+    now = time.time()
+    for row in pending:
+        _scheduler.schedule(row['run_at'] - now, _run_deletion, row['chat_id'], row['message_id'], key=("delete", row['chat_id'], row['message_id']))
+    if pending:
+        logger.info(f"Resumed {len(pending)} scheduled message deletion(s).")
@@ -0,0 +1,67 @@
+import heapq
+from bot.services.balance_cache import DISPLAY_MIN_U5, get_chat_balances, get_owed_amount
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+def simplify_debts(debts: list[dict]) -> list[dict]:
+    """Turns pairwise debts into a near-minimal list of transfers.
+
+    Each member's debts are netted into one position, then the largest
+    debtor repeatedly pays the largest creditor. Every transfer settles at
+    least one member, so there are at most n - 1 transfers, found in
+    O(n log n).
+    """
+    positions = {}
+    names = {}
+    for debt in debts:
+        positions[debt['from_user_id']] = positions.get(debt['from_user_id'], 0) - debt['amount_u5']
+        positions[debt['to_user_id']] = positions.get(debt['to_user_id'], 0) + debt['amount_u5']
+        names[debt['from_user_id']] = debt.get('from_user_display_name')
+        names[debt['to_user_id']] = debt.get('to_user_display_name')
+
+    # Max-heaps by amount; the user id breaks ties so results are deterministic.
+    creditors = [(-position, user_id) for user_id, position in positions.items() if position > 0]
+    debtors = [(position, user_id) for user_id, position in positions.items() if position < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debit, debtor_id = heapq.heappop(debtors)
+        amount_u5 = min(-credit, -debit)
+        transfers.append({
+            'from_user_id': debtor_id,
+            'from_user_display_name': names[debtor_id],
+            'to_user_id': creditor_id,
+            'to_user_display_name': names[creditor_id],
+            'amount_u5': amount_u5,
+        })
+        if -credit > amount_u5:
+            heapq.heappush(creditors, (credit + amount_u5, creditor_id))
+        if -debit > amount_u5:
+            heapq.heappush(debtors, (debit + amount_u5, debtor_id))
+    return transfers
+
+def get_simplified_debts(chat_id: int) -> list[dict]:
+    """Returns the simplified transfers for a group, cached with its balances until its ledger changes."""
+    balances = get_chat_balances(chat_id)
+    if balances.simplified is None:
+        # Two threads may both compute it; they get the same result.
+        balances.simplified = simplify_debts([debt for debt in balances.debts if debt['amount_u5'] >= DISPLAY_MIN_U5])
+        logger.debug(f"Simplified debts for chat {chat_id} at ledger version {balances.ledger_version} into {len(balances.simplified)} transfer(s).")
+    return balances.simplified
+
+def get_suggested_transfers(chat_id: int, user_id: int) -> list[dict]:
+    return [transfer for transfer in get_simplified_debts(chat_id) if transfer['from_user_id'] == user_id]
+
+def get_payable_amount(chat_id: int, from_user_id: int, to_user_id: int) -> int:
+    """What from_user is expected to pay to_user: their direct debt, else the suggested transfer."""
+    owed_amount = get_owed_amount(chat_id, from_user_id, to_user_id)
+    if owed_amount > 0:
+        return owed_amount
+    for transfer in get_suggested_transfers(chat_id, from_user_id):
+        if transfer['to_user_id'] == to_user_id:
+            return transfer['amount_u5']
+    return 0
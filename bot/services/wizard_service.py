@@ -5,8 +5,8 @@ import json
 from bot.config import DRAFT_TTL_SECONDS, DB_TIMEZONE_OFFSET
 from bot.db.repos import update_draft, get_user_display_name
 from bot.ui.renderers import render_wizard
-import threading
-from bot.db.connection import get_connection
+from bot.outbound import submit_nowait
+from bot.services.scheduler import send_temporary_message
 
 from decimal import Decimal
 
@@ -14,8 +14,7 @@ def handle_amount_input(bot, message, active_draft):
     try:
         amount = Decimal(message.text)
         if not (1 <= amount < 1_000_000_000):
-            warning_msg = bot.send_message(message.chat.id, "❗ Amount must be between 1 and 1,000,000,000.")
-            threading.Timer(5.0, bot.delete_message, [message.chat.id, warning_msg.message_id]).start()
+            send_temporary_message(bot, message.chat.id, "❗ Amount must be between 1 and 1,000,000,000.", 5.0)
             return
 
         draft_id = active_draft['id']
@@ -42,14 +41,13 @@ def handle_amount_input(bot, message, active_draft):
         bot.edit_message_text(chat_id=message.chat.id, message_id=draft_data['wizard_message_id'], text=wizard_text, reply_markup=wizard_keyboard, parse_mode='HTML')
 
     except ValueError:
-        warning_msg = bot.send_message(message.chat.id, "❗ Invalid amount. Please enter a number.")
-        threading.Timer(5.0, bot.delete_message, [message.chat.id, warning_msg.message_id]).start()
+        send_temporary_message(bot, message.chat.id, "❗ Invalid amount. Please enter a number.", 5.0)
     finally:
-        bot.delete_message(message.chat.id, message.message_id)
+        submit_nowait(bot, "delete_message", message.chat.id, message.message_id)
 
 def start_wizard(bot, call, chat_id, user_id, wizard_type):
-    from bot.db.repos import get_group, set_active_wizard_user_id, get_active_drafts_by_user, create_draft, update_draft, get_users_owed_by_user, get_user_display_name, delete_file_by_id
-    from bot.db.connection import get_connection
+    from bot.db.repos import get_group, set_active_wizard_user_id, get_active_drafts_by_user, create_draft, update_draft, delete_draft, get_user_display_name, delete_file_by_id
+    from bot.services.balance_cache import get_users_owed_by_user
     from bot.logger import get_logger
     from bot.config import FILES_CHANNEL_ID
     logger = get_logger(__name__)
@@ -63,17 +61,16 @@ def start_wizard(bot, call, chat_id, user_id, wizard_type):
                 try:
                     draft_data = json.loads(draft['data_json'])
                     if 'wizard_message_id' in draft_data:
-                        bot.delete_message(chat_id, draft_data['wizard_message_id'])
+                        submit_nowait(bot, "delete_message", chat_id, draft_data['wizard_message_id'])
                     
                     # Delete associated files
                     if 'files' in draft_data:
                         for file_info in draft_data['files']:
-                            bot.delete_message(FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
+                            submit_nowait(bot, "delete_message", FILES_CHANNEL_ID, file_info['origin_channel_message_id'])
                             delete_file_by_id(file_info['file_row_id'])
                     
                     # Delete the draft record
-                    with get_connection() as conn:
-                        conn.execute("DELETE FROM drafts WHERE id = ?", (draft['id'],))
+                    delete_draft(draft['id'])
                 except Exception as e:
                     logger.error(f"Error cleaning up old draft {draft['id']}: {e}")
 
@@ -140,52 +137,50 @@ def update_wizard_after_file_processing(bot, chat_id, user_id, draft_data, curre
 def handle_wizard_next(bot, call, chat_id, user_id, wizard_type):
     from bot.db.repos import get_active_draft, update_draft
     
-    with get_connection() as conn:
-        active_draft = get_active_draft(chat_id, user_id)
-        if active_draft and active_draft['type'] == wizard_type:
-            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-
-            if wizard_type == 'expense':
-                if current_step == 1 and 'amount' not in draft_data:
-                    bot.answer_callback_query(call.id, text="❗ Please enter an amount before proceeding.", show_alert=True)
-                    return
-                if current_step == 3 and not draft_data.get('description') and not draft_data.get('categories'):
-                    bot.answer_callback_query(call.id, text="❗ Please add a description or select a category.", show_alert=True)
-                    return
-                if current_step == 4 and not draft_data.get('debtors'):
-                    bot.answer_callback_query(call.id, text="❗ Please select at least one debtor.", show_alert=True)
-                    return
-                if current_step < 6:
-                    current_step += 1
-            elif wizard_type == 'settlement':
-                if current_step == 1 and 'payee' not in draft_data:
-                    bot.answer_callback_query(call.id, text="❗ Please select a payee before proceeding.", show_alert=True)
-                    return
-                if current_step == 2 and 'amount' not in draft_data:
-                    bot.answer_callback_query(call.id, text="❗ Please enter an amount before proceeding.", show_alert=True)
-                    return
-                if current_step == 3 and not draft_data.get('files') and not draft_data.get('no_proof'):
-                    bot.answer_callback_query(call.id, text="❗ Please upload proof of payment or select 'I am paying with cash'.", show_alert=True)
-                    return
-                if current_step < 4:
-                    current_step += 1
-            
-            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-            update_draft(draft_id, draft_data, current_step, expires_at)
-            update_wizard_after_file_processing(bot, chat_id, user_id, draft_data, current_step, wizard_type)
-            bot.answer_callback_query(call.id)
+    active_draft = get_active_draft(chat_id, user_id)
+    if active_draft and active_draft['type'] == wizard_type:
+        draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+
+        if wizard_type == 'expense':
+            if current_step == 1 and 'amount' not in draft_data:
+                bot.answer_callback_query(call.id, text="❗ Please enter an amount before proceeding.", show_alert=True)
+                return
+            if current_step == 3 and not draft_data.get('description') and not draft_data.get('categories'):
+                bot.answer_callback_query(call.id, text="❗ Please add a description or select a category.", show_alert=True)
+                return
+            if current_step == 4 and not draft_data.get('debtors'):
+                bot.answer_callback_query(call.id, text="❗ Please select at least one debtor.", show_alert=True)
+                return
+            if current_step < 6:
+                current_step += 1
+        elif wizard_type == 'settlement':
+            if current_step == 1 and 'payee' not in draft_data:
+                bot.answer_callback_query(call.id, text="❗ Please select a payee before proceeding.", show_alert=True)
+                return
+            if current_step == 2 and 'amount' not in draft_data:
+                bot.answer_callback_query(call.id, text="❗ Please enter an amount before proceeding.", show_alert=True)
+                return
+            if current_step == 3 and not draft_data.get('files') and not draft_data.get('no_proof'):
+                bot.answer_callback_query(call.id, text="❗ Please upload proof of payment or select 'I am paying with cash'.", show_alert=True)
+                return
+            if current_step < 4:
+                current_step += 1
+        
+        expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+        update_draft(draft_id, draft_data, current_step, expires_at)
+        update_wizard_after_file_processing(bot, chat_id, user_id, draft_data, current_step, wizard_type)
+        bot.answer_callback_query(call.id)
 
 def handle_wizard_back(bot, call, chat_id, user_id, wizard_type):
     from bot.db.repos import get_active_draft, update_draft
 
-    with get_connection() as conn:
-        active_draft = get_active_draft(chat_id, user_id)
-        if active_draft and active_draft['type'] == wizard_type:
-            draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
-            if current_step > 1:
-                current_step -= 1
-            expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
-            update_draft(draft_id, draft_data, current_step, expires_at)
-            update_wizard_after_file_processing(bot, chat_id, user_id, draft_data, current_step, wizard_type)
-            bot.answer_callback_query(call.id)
+    active_draft = get_active_draft(chat_id, user_id)
+    if active_draft and active_draft['type'] == wizard_type:
+        draft_id, draft_data, current_step = active_draft['id'], json.loads(active_draft['data_json']), active_draft['step']
+        if current_step > 1:
+            current_step -= 1
+        expires_at = (get_now_in_configured_timezone() + timedelta(seconds=DRAFT_TTL_SECONDS)).isoformat(' ')
+        update_draft(draft_id, draft_data, current_step, expires_at)
+        update_wizard_after_file_processing(bot, chat_id, user_id, draft_data, current_step, wizard_type)
+        bot.answer_callback_query(call.id)
 
@@ -0,0 +1,431 @@
+"""A local stand-in for the Telegram Bot API, for load tests without real Telegram.
+
+Point the bot at it by setting TELEGRAM_API_URL, for example
+`TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1}`, and run:
+
+    python -m bot.testing.fake_bot_api --port 8081 --latency 0.05 --fail-every 100 --replay updates.jsonl
+
+The server keeps the messages it has sent or edited per chat, so edits and
+deletes of unknown messages fail the way Telegram does. Updates come from
+push_update() (or the helpers for text messages and button presses) or from
+a replay file. Each line of a replay file is `{"at": seconds, "update": {...}}`
+and is delivered at that offset after start, without update_id, which is
+assigned here. Every API call can be recorded to a JSONL file.
+
+Requests can be slowed down with a fixed latency plus seeded random jitter.
+Every Nth call of a sending method can get a 429 with retry_after. Both make
+runs reproducible. get_stats() reports calls per method, injected 429s and
+how long the bot took from receiving an update to its first answer in that
+chat.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Methods that count towards --fail-every, like Telegram's flood limits
+RATE_LIMITED_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "forwardMessage", "forwardMessages", "sendDocument"}
+# Parameters that telebot sends JSON-encoded
+JSON_PARAMS = {"reply_markup", "message_ids", "allowed_updates", "commands", "entities"}
+
+class ApiError(Exception):
+    def __init__(self, error_code: int, description: str, parameters: dict | None = None):
+        super().__init__(description)
+        self.error_code = error_code
+        self.description = description
+        self.parameters = parameters
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+class FakeBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency_seconds: float = 0.0, jitter_seconds: float = 0.0,
+                 fail_every: int = 0, retry_after: int = 1, record_path: str | None = None, seed: int = 0):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.fail_every = fail_every
+        self.retry_after = retry_after
+        self.bot_user = {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+        self._random = random.Random(seed)
+        self._lock = threading.Condition()
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        # callback query id -> chat_id, to time the answer of a button press
+        self._callback_chats = {}
+        self._message_ids = {}
+        # (chat_id, message_id) -> message dict
+        self._messages = {}
+        self._rate_limited_calls = 0
+        self._record = open(record_path, "a", encoding="utf-8") if record_path else None
+        self._started_at = time.monotonic()
+        self._stats = {"calls": {}, "injected_429": 0, "errors": 0}
+        # chat_id -> monotonic time its oldest unanswered update was delivered
+        self._awaiting_answer = {}
+        self._answer_latencies = []
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """Value for TELEGRAM_API_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    # Incoming updates
+
+    def push_update(self, update: dict) -> int:
+        with self._lock:
+            update = dict(update, update_id=next(self._update_ids))
+            message = update.get("message")
+            if message:
+                # Replayed messages can be forwarded and deleted like the ones sent here
+                chat_id = message["chat"]["id"]
+                self._messages[(chat_id, message["message_id"])] = message
+                self._message_ids[chat_id] = max(self._message_ids.get(chat_id, 0), message["message_id"])
+            self._updates.append(update)
+            self._lock.notify_all()
+        return update["update_id"]
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _chat(self, chat_id: int) -> dict:
+        if chat_id < 0:
+            return {"id": chat_id, "type": "group", "title": f"Group {chat_id}"}
+        return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+
+    def _new_message(self, chat_id: int, sender: dict, **content) -> dict:
+        # Called with self._lock held
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        message = {"message_id": message_id, "date": int(time.time()), "chat": self._chat(chat_id), "from": sender, **content}
+        self._messages[(chat_id, message_id)] = message
+        return message
+
+    def send_text(self, chat_id: int, user_id: int, text: str) -> int:
+        """Delivers a text message from a user; returns its update_id."""
+        with self._lock:
+            message = self._new_message(chat_id, self._user(user_id), text=text)
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self.push_update({"message": message})
+
+    def press_button(self, chat_id: int, user_id: int, message_id: int, data: str) -> int:
+        """Delivers a callback query for a button of a message the bot sent; returns its update_id."""
+        with self._lock:
+            message = self._messages.get((chat_id, message_id)) or {"message_id": message_id, "date": int(time.time()), "chat": self._chat(chat_id)}
+        callback_query = {"id": f"cb{next(self._callback_ids)}", "from": self._user(user_id), "chat_instance": str(chat_id), "message": message, "data": data}
+        return self.push_update({"callback_query": callback_query})
+
+    def replay(self, path: str, speed: float = 1.0) -> threading.Thread:
+        """Delivers the updates of a replay file at their recorded offsets, in a background thread."""
+        with open(path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+        def run():
+            started = time.monotonic()
+            for entry in entries:
+                delay = entry.get("at", 0) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                self.push_update(entry["update"])
+            logger.info(f"Replayed {len(entries)} update(s) from {path}.")
+
+        thread = threading.Thread(target=run, name="fake-bot-api-replay", daemon=True)
+        thread.start()
+        return thread
+
+    def latest_message(self, chat_id: int) -> dict | None:
+        """The newest message in a chat, e.g. the menu the bot just sent."""
+        with self._lock:
+            message_id = self._message_ids.get(chat_id)
+            return self._messages.get((chat_id, message_id)) if message_id else None
+
+    # API methods
+
+    def _message(self, chat_id: int, message_id: int, action: str) -> dict:
+        message = self._messages.get((chat_id, message_id))
+        if message is None:
+            raise ApiError(400, f"Bad Request: message to {action} not found")
+        return message
+
+    def call(self, method: str, params: dict):
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            raise ApiError(404, "Not Found: method not found")
+        if method in RATE_LIMITED_METHODS and self.fail_every:
+            with self._lock:
+                self._rate_limited_calls += 1
+                inject = self._rate_limited_calls % self.fail_every == 0
+                if inject:
+                    self._stats["injected_429"] += 1
+            if inject:
+                raise ApiError(429, f"Too Many Requests: retry after {self.retry_after}", {"retry_after": self.retry_after})
+        chat_id = params.get("chat_id")
+        if chat_id is not None and method != "getChat":
+            self._answered(int(chat_id))
+        return handler(params)
+
+    def _api_getMe(self, params):
+        return self.bot_user
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset", 0))
+        deadline = time.monotonic() + float(params.get("timeout", 0))
+        with self._lock:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._lock.wait(timeout=deadline - time.monotonic())
+            updates = self._updates[:int(params.get("limit", 100))]
+            now = time.monotonic()
+            for update in updates:
+                callback_query = update.get("callback_query") or {}
+                message = update.get("message") or callback_query.get("message")
+                if callback_query and message:
+                    self._callback_chats[callback_query["id"]] = message["chat"]["id"]
+                if message:
+                    self._awaiting_answer.setdefault(message["chat"]["id"], now)
+            return updates
+
+    def _answered(self, chat_id: int) -> None:
+        with self._lock:
+            delivered_at = self._awaiting_answer.pop(chat_id, None)
+            if delivered_at is not None:
+                self._answer_latencies.append(time.monotonic() - delivered_at)
+
+    def _api_setMyCommands(self, params):
+        return True
+
+    def _api_setWebhook(self, params):
+        return True
+
+    def _api_deleteWebhook(self, params):
+        return True
+
+    def _api_getChat(self, params):
+        return self._chat(int(params["chat_id"]))
+
+    def _api_sendMessage(self, params):
+        with self._lock:
+            return self._new_message(int(params["chat_id"]), self.bot_user, text=params.get("text", ""), **self._markup(params))
+
+    def _api_sendDocument(self, params):
+        with self._lock:
+            chat_id = int(params["chat_id"])
+            document = {"file_id": f"doc{chat_id}_{self._message_ids.get(chat_id, 0) + 1}", "file_unique_id": "fake", "file_name": params.get("document_name", "document")}
+            return self._new_message(chat_id, self.bot_user, document=document, caption=params.get("caption"))
+
+    def _api_editMessageText(self, params):
+        with self._lock:
+            message = self._message(int(params["chat_id"]), int(params["message_id"]), "edit")
+            markup = self._markup(params)
+            if message.get("text") == params.get("text") and message.get("reply_markup") == markup.get("reply_markup"):
+                raise ApiError(400, "Bad Request: message is not modified")
+            message["text"] = params.get("text", "")
+            message.pop("reply_markup", None)
+            message.update(markup, edit_date=int(time.time()))
+            return message
+
+    def _api_editMessageReplyMarkup(self, params):
+        with self._lock:
+            message = self._message(int(params["chat_id"]), int(params["message_id"]), "edit")
+            message.pop("reply_markup", None)
+            message.update(self._markup(params), edit_date=int(time.time()))
+            return message
+
+    def _api_deleteMessage(self, params):
+        with self._lock:
+            self._message(int(params["chat_id"]), int(params["message_id"]), "delete")
+            del self._messages[(int(params["chat_id"]), int(params["message_id"]))]
+        return True
+
+    def _api_deleteMessages(self, params):
+        with self._lock:
+            for message_id in params["message_ids"]:
+                self._messages.pop((int(params["chat_id"]), int(message_id)), None)
+        return True
+
+    def _forward(self, chat_id: int, from_chat_id: int, message_id: int) -> dict:
+        # Called with self._lock held
+        source = self._message(from_chat_id, message_id, "forward")
+        content = {key: source[key] for key in ("text", "photo", "document", "caption") if key in source}
+        return self._new_message(chat_id, self.bot_user, forward_origin={"type": "chat", "date": source["date"], "sender_chat": source["chat"]}, **content)
+
+    def _api_forwardMessage(self, params):
+        with self._lock:
+            return self._forward(int(params["chat_id"]), int(params["from_chat_id"]), int(params["message_id"]))
+
+    def _api_forwardMessages(self, params):
+        with self._lock:
+            forwarded = []
+            for message_id in params["message_ids"]:
+                if (int(params["from_chat_id"]), int(message_id)) in self._messages:
+                    forwarded.append({"message_id": self._forward(int(params["chat_id"]), int(params["from_chat_id"]), int(message_id))["message_id"]})
+            return forwarded
+
+    def _api_answerCallbackQuery(self, params):
+        with self._lock:
+            chat_id = self._callback_chats.pop(params.get("callback_query_id"), None)
+        if chat_id is not None:
+            self._answered(chat_id)
+        return True
+
+    @staticmethod
+    def _markup(params: dict) -> dict:
+        return {"reply_markup": params["reply_markup"]} if params.get("reply_markup") else {}
+
+    # HTTP
+
+    def _make_handler(self):
+        api = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                if len(parts) != 2 or not parts[0].startswith("bot"):
+                    self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                method = parts[1]
+                params = dict(parse_qsl(url.query))
+                params.update(self._body_params())
+                for key in JSON_PARAMS & params.keys():
+                    if isinstance(params[key], str):
+                        params[key] = json.loads(params[key])
+
+                api._delay()
+                started = time.monotonic()
+                try:
+                    status, body = 200, {"ok": True, "result": api.call(method, params)}
+                except ApiError as e:
+                    status, body = e.error_code, {"ok": False, "error_code": e.error_code, "description": e.description}
+                    if e.parameters:
+                        body["parameters"] = e.parameters
+                    if e.error_code != 429:
+                        with api._lock:
+                            api._stats["errors"] += 1
+                api._count(method, params, status, time.monotonic() - started)
+                self._reply(status, body)
+
+            def _body_params(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                if not length:
+                    return {}
+                body = self.rfile.read(length)
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("application/json"):
+                    return json.loads(body)
+                if content_type.startswith("multipart/form-data"):
+                    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+                    params = {}
+                    for part in message.iter_parts():
+                        name = part.get_param("name", header="content-disposition")
+                        if part.get_filename():
+                            params[f"{name}_name"] = part.get_filename()
+                        else:
+                            params[name] = part.get_content().strip() if isinstance(part.get_content(), str) else part.get_content()
+                    return params
+                return dict(parse_qsl(body.decode()))
+
+            def _reply(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Fake Bot API request: {format % args}")
+
+        return RequestHandler
+
+    def _delay(self) -> None:
+        if self.latency_seconds or self.jitter_seconds:
+            with self._lock:
+                jitter = self._random.uniform(0, self.jitter_seconds) if self.jitter_seconds else 0.0
+            time.sleep(self.latency_seconds + jitter)
+
+    def _count(self, method: str, params: dict, status: int, seconds: float) -> None:
+        with self._lock:
+            self._stats["calls"][method] = self._stats["calls"].get(method, 0) + 1
+            if self._record and method != "getUpdates":
+                self._record.write(json.dumps({"at": round(time.monotonic() - self._started_at, 6), "method": method, "params": params, "status": status}, default=str) + "\n")
+                self._record.flush()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = {"calls": dict(self._stats["calls"]), "injected_429": self._stats["injected_429"], "errors": self._stats["errors"]}
+            latencies = list(self._answer_latencies)
+        elapsed = time.monotonic() - self._started_at
+        stats["elapsed_seconds"] = elapsed
+        stats["answered_updates"] = len(latencies)
+        stats["answered_per_second"] = len(latencies) / elapsed if elapsed else 0.0
+        stats["answer_latency_p50"] = _percentile(latencies, 0.5)
+        stats["answer_latency_p95"] = _percentile(latencies, 0.95)
+        stats["answer_latency_max"] = max(latencies, default=0.0)
+        return stats
+
+    def start(self) -> threading.Thread:
+        """Serves in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, name="fake-bot-api", daemon=True)
+        thread.start()
+        return thread
+
+    def serve_forever(self) -> None:
+        logger.info(f"Fake Bot API listening; set TELEGRAM_API_URL={self.url}")
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._record:
+            self._record.close()
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds per request, from a seeded RNG.")
+    parser.add_argument("--fail-every", type=int, default=0, help="Answer every Nth sending call with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of the injected 429s.")
+    parser.add_argument("--record", help="Append every API call to this JSONL file.")
+    parser.add_argument("--replay", help="Deliver the updates of this JSONL file.")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Replay faster (>1) or slower (<1) than recorded.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="Seconds between stats log lines.")
+    args = parser.parse_args(argv)
+
+    api = FakeBotApi(args.host, args.port, args.latency, args.jitter, args.fail_every, args.retry_after, args.record, args.seed)
+    api.start()
+    if args.replay:
+        api.replay(args.replay, args.replay_speed)
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            logger.info(f"Fake Bot API stats: {api.get_stats()}")
+    except KeyboardInterrupt:
+        api.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from decimal import Decimal
 from bot.config import CURRENCY, FILES_CHANNEL_ID
 from bot.db.repos import get_group_members, get_users_owed_by_user, get_owed_amount, get_user, get_debt_between_users, get_user_display_name, get_owed_amount
 from bot.utils.currency import format_amount
+from bot.services.simplify import get_payable_amount
 from datetime import datetime
 from bot.logger import get_logger
 from bot.ui.wizard_config import WIZARD_CONFIGS
@@ -56,6 +57,9 @@ def render_reports_menu(group_name: str) -> tuple[str, telebot.types.InlineKeybo
         telebot.types.InlineKeyboardButton("📜 History", callback_data="dm:history"),
         telebot.types.InlineKeyboardButton("📈 Analytics", callback_data="dm:analytics")
     )
+    keyboard.row(
+        telebot.types.InlineKeyboardButton("🗓️ Month-End Balances", callback_data="dm:month_end_balances")
+    )
     keyboard.row(
         telebot.types.InlineKeyboardButton("📤 Export Data", callback_data="dm:export_data")
     )
@@ -117,10 +121,55 @@ def render_balances_page(user_id: int, group_name: str, balance_summary: dict, a
 
     if not balance_summary['detailed_debts'] and not other_balances:
         text += "\nEveryone is settled up! 🎉"
+    else:
+        keyboard.add(telebot.types.InlineKeyboardButton("🔀 Simplified", callback_data="dm:simplified_balances"))
 
     keyboard.add(telebot.types.InlineKeyboardButton("◀ Back", callback_data="dm:main_menu"))
     return text, keyboard
 
+def render_simplified_balances_page(user_id: int, group_name: str, transfers: list[dict]) -> tuple[str, telebot.types.InlineKeyboardMarkup]:
+    text = f"🔀 <b>Simplified Balances for {group_name}</b>\n\n"
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=1)
+
+    if not transfers:
+        text += "Everyone is settled up! 🎉"
+    else:
+        text += "The fewest payments that settle everyone up:\n\n"
+        for transfer in transfers:
+            amount = format_amount(transfer['amount_u5'] / 100000)
+            if transfer['from_user_id'] == user_id:
+                text += f"• <b>You pay {transfer['to_user_display_name']}: {amount}</b>\n"
+            elif transfer['to_user_id'] == user_id:
+                text += f"• <b>{transfer['from_user_display_name']} pays you: {amount}</b>\n"
+            else:
+                text += f"• {transfer['from_user_display_name']} pays {transfer['to_user_display_name']}: {amount}\n"
+
+    keyboard.add(telebot.types.InlineKeyboardButton("◀ Back", callback_data="dm:balances"))
+    return text, keyboard
+
+def render_month_end_balances_page(group_name: str, year: int, month: int, balances: list[dict], is_latest: bool) -> tuple[str, telebot.types.InlineKeyboardMarkup]:
+    safe_group_name = html.escape(group_name)
+    month_label = datetime(year, month, 1).strftime('%B %Y')
+    text = f"🗓️ <b>Month-End Balances for {safe_group_name}</b>\n"
+    text += f"<i>As of the end of {month_label}</i>\n\n"
+
+    balances = [debt for debt in balances if debt['amount_u5'] >= 100]
+    if not balances:
+        text += "Everyone was settled up. 🎉"
+    else:
+        for debt in balances:
+            amount = format_amount(debt['amount_u5'] / 100000)
+            text += f"• {debt['from_user_display_name']} owed {debt['to_user_display_name']}: {amount}\n"
+
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    previous_year, previous_month = (year, month - 1) if month > 1 else (year - 1, 12)
+    navigation_row = [telebot.types.InlineKeyboardButton(f"◀ {datetime(previous_year, previous_month, 1).strftime('%b %Y')}", callback_data=f"dm:month_end_balances:{previous_year:04d}-{previous_month:02d}")]
+    if not is_latest:
+        next_year, next_month = (year, month + 1) if month < 12 else (year + 1, 1)
+        navigation_row.append(telebot.types.InlineKeyboardButton(f"{datetime(next_year, next_month, 1).strftime('%b %Y')} ▶", callback_data=f"dm:month_end_balances:{next_year:04d}-{next_month:02d}"))
+    keyboard.row(*navigation_row)
+    keyboard.add(telebot.types.InlineKeyboardButton("◀ Back", callback_data="dm:reports"))
+    return text, keyboard
 
 def render_analytics_page(group_name: str) -> tuple[str, telebot.types.InlineKeyboardMarkup]:
     safe_group_name = html.escape(group_name)
@@ -278,7 +327,7 @@ def render_wizard(wizard_type: str, draft_data: dict, current_step: int, chat_id
     instruction = step_config['instruction']
     if wizard_type == 'settlement' and current_step == 2:
         payee_name = get_user_display_name(draft_data['payee'])
-        total_debt = get_owed_amount(user_id, draft_data['payee']) / 100000
+        total_debt = get_payable_amount(chat_id, user_id, draft_data['payee']) / 100000
         total_debt_str = format_amount(total_debt)
         instruction = instruction.format(payee_name=payee_name, total_debt_str=total_debt_str)
     elif wizard_type == 'expense' and current_step == 1 and 'amount' in draft_data:
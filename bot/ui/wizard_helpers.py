@@ -1,7 +1,9 @@
 
 import telebot
 from bot.config import FILES_CHANNEL_ID
-from bot.db.repos import get_group_members, get_users_owed_by_user
+from bot.db.repos import get_group_members
+from bot.services.balance_cache import get_users_owed_by_user
+from bot.services.simplify import get_suggested_transfers
 from bot.utils.currency import format_amount
 from bot.categories import CATEGORIES
 
@@ -62,6 +64,11 @@ def generate_settlement_step_1_buttons(draft_data, chat_id, user_id):
             draft_data['payee'] = owed_users[0]['user_id']
         payee_buttons = [telebot.types.InlineKeyboardButton(f"{'✅' if draft_data.get('payee') == user['user_id'] else ''} {user['display_name']}", callback_data=f"dm:toggle_payee:{user['user_id']}") for user in owed_users]
         keyboard.add(*payee_buttons, row_width=2)
+
+    # Payees from the simplified balances, which may settle debts along a chain
+    for transfer in get_suggested_transfers(chat_id, user_id):
+        label = f"⭐ Suggested: {transfer['to_user_display_name']} ({format_amount(transfer['amount_u5'] / 100000)})"
+        keyboard.row(telebot.types.InlineKeyboardButton(label, callback_data=f"dm:toggle_suggested_payee:{transfer['to_user_id']}"))
     return keyboard
 
 def generate_settlement_step_2_buttons(draft_data):
@@ -0,0 +1,167 @@
+"""Webhook ingestion: an embedded HTTP server that receives Telegram updates.
+
+Requests are checked against the secret token, queued as raw bodies and
+acknowledged right away. A dispatcher thread parses them and hands them to
+telebot's process_new_updates. The queue is bounded: when it is full the
+server answers 503, and Telegram retries the update later.
+"""
+import hmac
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import telebot
+from bot.logger import get_logger
+
+logger = get_logger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Telegram updates are small; anything larger is not an update.
+MAX_BODY_BYTES = 1024 * 1024
+# How often the dispatcher logs its lag figures.
+METRICS_LOG_INTERVAL_SECONDS = 300
+
+def _update_sent_at(update: telebot.types.Update) -> int | None:
+    """Unix time Telegram attached to the update, when it has one."""
+    if update.message:
+        return update.message.date
+    if update.edited_message:
+        return update.edited_message.edit_date or update.edited_message.date
+    if update.channel_post:
+        return update.channel_post.date
+    return None
+
+class WebhookServer:
+    def __init__(self, bot: telebot.TeleBot, host: str, port: int, path: str, secret: str, queue_size: int):
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "received": 0,
+            "unauthorized": 0,
+            "rejected_full": 0,
+            "invalid": 0,
+            "processed": 0,
+            "failed": 0,
+            "queue_depth_max": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "ingestion_lag_seconds_last": 0.0,
+            "ingestion_lag_seconds_max": 0.0,
+        }
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._dispatcher = threading.Thread(target=self._dispatch, name="webhook-dispatcher", daemon=True)
+
+    def _make_handler(self):
+        server = self
+
+        class UpdateHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                token = self.headers.get(SECRET_TOKEN_HEADER, "")
+                if not hmac.compare_digest(token.encode(), server.secret.encode()):
+                    server._count("unauthorized")
+                    self._reply(403)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_BYTES:
+                    server._count("invalid")
+                    self._reply(413 if length > MAX_BODY_BYTES else 400)
+                    return
+                self._reply(200 if server.enqueue(self.rfile.read(length)) else 503)
+
+            def _reply(self, status: int):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"Webhook request from {self.client_address[0]}: {format % args}")
+
+        return UpdateHandler
+
+    def _count(self, key: str) -> None:
+        with self._metrics_lock:
+            self._metrics[key] += 1
+
+    def enqueue(self, body: bytes) -> bool:
+        """Queues a raw update body; returns False when the queue is full."""
+        try:
+            self._queue.put_nowait((body, time.time()))
+        except queue.Full:
+            self._count("rejected_full")
+            logger.warning(f"Webhook queue is full ({self._queue.maxsize}); asking Telegram to retry.")
+            return False
+        depth = self._queue.qsize()
+        with self._metrics_lock:
+            self._metrics["received"] += 1
+            self._metrics["queue_depth_max"] = max(self._metrics["queue_depth_max"], depth)
+        return True
+
+    def _dispatch(self) -> None:
+        last_logged_at = time.monotonic()
+        while True:
+            try:
+                body, received_at = self._queue.get(timeout=METRICS_LOG_INTERVAL_SECONDS)
+            except queue.Empty:
+                body = None
+            if body is not None:
+                self._process(body, received_at)
+            if time.monotonic() - last_logged_at >= METRICS_LOG_INTERVAL_SECONDS:
+                metrics = self.get_metrics()
+                logger.info(
+                    f"Webhook: {metrics['processed']} processed, queue depth {metrics['queue_depth']}, "
+                    f"queue wait avg {metrics['queue_wait_seconds_avg']:.3f}s max {metrics['queue_wait_seconds_max']:.3f}s, "
+                    f"ingestion lag last {metrics['ingestion_lag_seconds_last']:.1f}s max {metrics['ingestion_lag_seconds_max']:.1f}s."
+                )
+                last_logged_at = time.monotonic()
+
+    def _process(self, body: bytes, received_at: float) -> None:
+        try:
+            update = telebot.types.Update.de_json(json.loads(body))
+        except Exception as e:
+            self._count("invalid")
+            logger.error(f"Dropped an invalid webhook update: {e}")
+            return
+
+        now = time.time()
+        waited = now - received_at
+        sent_at = _update_sent_at(update)
+        with self._metrics_lock:
+            self._metrics["queue_wait_seconds_total"] += waited
+            self._metrics["queue_wait_seconds_max"] = max(self._metrics["queue_wait_seconds_max"], waited)
+            if sent_at is not None:
+                lag = max(now - sent_at, 0.0)
+                self._metrics["ingestion_lag_seconds_last"] = lag
+                self._metrics["ingestion_lag_seconds_max"] = max(self._metrics["ingestion_lag_seconds_max"], lag)
+
+        try:
+            self.bot.process_new_updates([update])
+            self._count("processed")
+        except Exception as e:
+            self._count("failed")
+            logger.error(f"Error processing webhook update {update.update_id}: {e}", exc_info=True)
+
+    def get_metrics(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self._queue.qsize()
+        handled = metrics["processed"] + metrics["failed"]
+        metrics["queue_wait_seconds_avg"] = metrics["queue_wait_seconds_total"] / handled if handled else 0.0
+        return metrics
+
+    def serve_forever(self) -> None:
+        self._dispatcher.start()
+        host, port = self._server.server_address[:2]
+        logger.info(f"Listening for webhook updates on {host}:{port}{self.path}.")
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,3 +1,4 @@
+import argparse
 import sys
 import os
 
@@ -5,6 +6,10 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from bot.app import Bot
 from bot.config import BOT_TOKEN, FILES_CHANNEL_ID
+from bot.db.connection import get_connection
+from bot.db.migrations import run_migrations
+from bot.services.ledger_verifier import verify_ledger, repair_ledger
+from bot.utils.currency import format_amount
 from bot.logger import get_logger
 
 logger = get_logger(__name__)
@@ -19,8 +24,39 @@ def main():
     except Exception as e:
         logger.critical(f"An unhandled exception occurred in main: {e}", exc_info=True)
 
+def verify_ledger_command(args) -> int:
+    """
+    Rebuilds the debts from confirmed expenses and settlements and reports differences.
+    Exits with status 1 if differences were found and not repaired.
+    """
+    with get_connection() as conn:
+        run_migrations(conn)
+
+    differences = verify_ledger(full=args.full, chat_id=args.chat_id)
+    for difference in differences:
+        logger.warning(
+            f"Chat {difference['chat_id']}: users {difference['user_lo']} -> {difference['user_hi']} "
+            f"expected {format_amount(difference['expected_u5'] / 100000)}, stored {format_amount(difference['stored_u5'] / 100000)}"
+        )
+    if differences and args.repair:
+        repair_ledger(differences)
+        return 0
+    return 1 if differences else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Group accountant Telegram bot.")
+    subparsers = parser.add_subparsers(dest="command")
+    verify_parser = subparsers.add_parser("verify-ledger", help="Check the debts against confirmed expenses and settlements.")
+    verify_parser.add_argument("--repair", action="store_true", help="Book the differences as repair entries in one transaction.")
+    verify_parser.add_argument("--full", action="store_true", help="Ignore the stored checkpoints and rebuild from the first row.")
+    verify_parser.add_argument("--chat-id", type=int, help="Only verify this chat.")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    if not BOT_TOKEN:
+    args = parse_args()
+    if args.command == "verify-ledger":
+        sys.exit(verify_ledger_command(args))
+    elif not BOT_TOKEN:
         logger.critical("BOT_TOKEN environment variable not set. Exiting.")
     elif not FILES_CHANNEL_ID or FILES_CHANNEL_ID == 0:
         logger.critical("FILES_CHANNEL_ID environment variable not set or is invalid. Exiting.")